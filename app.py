@@ -1,22 +1,96 @@
-from fastapi import FastAPI, HTTPException, Body, Request
+import time
+# Start of the import-time measurement reported by /readyz
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Body, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from starlette.requests import ClientDisconnect
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import os
 import sys
-import time
 
 # Ensure the 'src' directory can be imported
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from src.admission import AdmissionController, AdmissionRejected
+from src.assets import StaticAssets, etag_matches
 from src.agent import CustomerSupportAgent
+from src.backends import MissingAPIKeyError
 from src.config import settings
+from src.deadlines import Deadline, DeadlineExceeded, RequestAborted, within_deadline
+from src.metrics import metrics
+from src.pool import AgentPool
+from src.profiling import RequestProfiler
+from src.singleflight import SingleFlight
+from src.snapshot import Snapshotter
+from src.startup import startup
+from src.state import get_shared_state
 from src.utils import logger
+from src.voice import VoiceSession
 from src.analytics import analytics
+from src.batch import BatchReplay
+
+# Conversations, profiles and analytics counters shared between workers (None = per process)
+shared_state = get_shared_state()
+
+# Snapshots of per-process state (shared backends persist state themselves)
+snapshotter: Optional[Snapshotter] = None
+
+# Console assets, fingerprinted and precompressed in memory
+assets = StaticAssets()
+
+async def warm_up():
+    """Builds the default agent and opens its provider connections before the first customer arrives."""
+    startup.warming()
+    try:
+        with startup.timed("warmup"):
+            # Building the agent imports the provider SDK, so it runs off the event loop
+            current_agent = await asyncio.to_thread(agent_pool.get)
+            await current_agent.backend.warm_up()
+    except Exception as e:
+        startup.finished(e)
+    else:
+        startup.finished()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global snapshotter
+    with startup.timed("assets"):
+        assets.build()
+    tasks = []
+    if settings.WARMUP_ENABLED:
+        tasks.append(asyncio.create_task(warm_up()))
+    else:
+        startup.finished()
+    # Interactions evicted from the in-memory ring are written to disk off the event loop
+    tasks.append(asyncio.create_task(analytics.interactions.run_writer()))
+    if shared_state is not None:
+        tasks.append(asyncio.create_task(shared_state.run_flusher()))
+    elif settings.SNAPSHOT_PATH:
+        # Only the snapshot index is read here; users are restored on first touch
+        snapshotter = Snapshotter(agent_pool.conversations, analytics)
+        snapshotter.restore()
+        tasks.append(asyncio.create_task(snapshotter.run_periodic()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    analytics.interactions.close()
+    if shared_state is not None:
+        # Push out writes still queued so nothing is lost on shutdown
+        await asyncio.to_thread(shared_state.close)
+    if snapshotter is not None:
+        try:
+            snapshotter.save()
+        except Exception as e:
+            logger.error(f"Shutdown snapshot failed: {e}")
 
-app = FastAPI(title="OmniServe AI - Context-Aware Voice Support")
+app = FastAPI(title="OmniServe AI - Context-Aware Voice Support", lifespan=lifespan)
 
 # Enable CORS for frontend development
 app.add_middleware(
@@ -27,18 +101,150 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Agent
-agent = None
+# Per-user rate limits and a fair, bounded queue for upstream capacity
+admission = AdmissionController()
+
+# Agents are pooled per API key and share one conversation memory; their summaries are admitted too
+agent_pool = AgentPool(admission=admission)
+
+# Coalesces concurrent identical upstream calls
+flights = SingleFlight()
+
+# Opt-in cProfile capture of individual requests
+profiler = RequestProfiler()
+
+class RequestMetricsMiddleware:
+    """Times every request by route template and optionally profiles it.
+
+    A plain ASGI middleware rather than ``@app.middleware("http")``, so
+    streamed responses pass through untouched and their duration runs until
+    the final body chunk has been sent, not just the response headers.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        headers = dict(scope["headers"])
+        profile = self.profiler.start(requested=headers.get(b"x-profile") == b"1")
+        status = 500
+        finished = False
+
+        def route_path() -> str:
+            # Route templates ("/analytics/user/{user_id}") keep label cardinality bounded
+            return getattr(scope.get("route"), "path", "unmatched")
+
+        def record():
+            nonlocal finished
+            finished = True
+            path = route_path()
+            metrics.observe("omniserve_http_request_duration_seconds", time.perf_counter() - start,
+                            route=path, method=scope["method"])
+            metrics.inc("omniserve_http_requests_total", route=path, method=scope["method"], status=str(status))
+
+        async def send_timed(message):
+            nonlocal status, profile
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                profile_path = self.profiler.stop(profile, route_path())
+                profile = None
+                if profile_path:
+                    message["headers"] = [*message.get("headers", []), (b"x-profile-path", profile_path.encode())]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
 
-def get_agent(api_key: Optional[str] = None):
-    global agent
-    if agent is None or api_key:
         try:
-            agent = CustomerSupportAgent(api_key=api_key)
-        except Exception as e:
-            logger.error(f"Failed to initialize agent: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
-    return agent
+            await self.app(scope, receive, send_timed)
+        finally:
+            # Raised before or while responding, or the client went away mid-stream
+            if profile is not None:
+                self.profiler.stop(profile, route_path())
+            if not finished:
+                record()
+
+app.add_middleware(RequestMetricsMiddleware, profiler=profiler)
+
+metrics.gauge("omniserve_upstream_in_flight", "Admitted upstream calls currently running.",
+              lambda: {(): admission.in_flight})
+metrics.gauge("omniserve_admission_queue_depth", "Requests waiting for upstream capacity.",
+              lambda: {(): admission.queue_depth})
+metrics.gauge("omniserve_conversations", "Conversations held in this process.",
+              lambda: {(): agent_pool.conversations.stats()["users"]})
+metrics.gauge("omniserve_conversation_bytes", "Approximate size of conversations held in this process.",
+              lambda: {(): agent_pool.conversations.stats()["bytes"]})
+metrics.gauge("omniserve_startup_seconds", "Cold-start import, asset build and warm-up durations.",
+              lambda: {(("phase", phase),): seconds for phase, seconds in startup.timings.items()})
+metrics.gauge("omniserve_ready", "1 once start-up warm-up has finished.",
+              lambda: {(): int(startup.ready)})
+metrics.gauge("omniserve_coalesced_requests_in_flight", "Distinct upstream calls shared by coalesced requests.",
+              lambda: {(): flights.stats()["in_flight"]})
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "reason": exc.reason},
+        headers=exc.headers,
+    )
+
+@app.exception_handler(RequestAborted)
+async def request_aborted(request: Request, exc: RequestAborted):
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc), "reason": exc.reason})
+
+async def wait_for_disconnect(request: Request):
+    """Returns once the client has gone away (call after the body has been read)."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def run_with_deadline(request: Request, work: Awaitable[Any], deadline: Deadline) -> Any:
+    """Awaits ``work`` within ``deadline``, cancelling it if the client disconnects first.
+
+    Either way the in-flight upstream call is cancelled rather than left to
+    run for nobody, and the abort is counted in analytics and /metrics.
+    """
+    task = asyncio.ensure_future(asyncio.wait_for(work, deadline.remaining()))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+        if not task.done():
+            task.cancel()
+
+    if task in done:
+        try:
+            return task.result()
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            aborted = RequestAborted("timeout", str(deadline.exceeded()))
+    else:
+        aborted = RequestAborted("cancelled", "Client disconnected")
+    record_abort(request, aborted)
+    raise aborted
+
+def record_abort(request: Request, aborted: RequestAborted):
+    """Counts an aborted request in analytics and /metrics."""
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    logger.warning(f"{request.method} {route} aborted: {aborted}")
+    analytics.log_aborted(route, aborted.reason)
+    metrics.inc("omniserve_requests_aborted_total", route=route, reason=aborted.reason)
+
+async def get_agent(api_key: Optional[str] = None) -> CustomerSupportAgent:
+    try:
+        # A first use builds the agent (importing its provider SDK), so it runs off the event loop
+        return await asyncio.to_thread(agent_pool.get, api_key)
+    except MissingAPIKeyError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to initialize agent: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 class ChatQuery(BaseModel):
     query: str
@@ -48,32 +254,97 @@ class ChatQuery(BaseModel):
 class ProfileRequest(BaseModel):
     user_id: str
     api_key: Optional[str] = None
+    refresh: bool = False
+
+class BulkProfileRequest(BaseModel):
+    # Either explicit user_ids, or `count` ids named prefix0..prefixN-1
+    user_ids: Optional[List[str]] = None
+    count: Optional[int] = None
+    prefix: str = "customer_"
+    # "concurrent" (one call per user) or "batched" (PROFILE_PROMPT_BATCH users per prompt)
+    mode: str = "concurrent"
+    refresh: bool = False
+    include_profiles: bool = True
+    api_key: Optional[str] = None
+
+def asset_response(request: Request, name: str) -> Response:
+    """Serves a static asset from memory in the best encoding the client accepts, honouring If-None-Match."""
+    entry = assets.get(name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    asset, cache_control = entry
+    encoding = asset.negotiate(request.headers.get("accept-encoding"))
+    headers = {"ETag": asset.etag(encoding), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
 
 @app.get("/")
-async def read_index():
-    return FileResponse("static/index.html")
+async def read_index(request: Request):
+    return asset_response(request, "index.html")
 
 @app.get("/favicon.ico", include_in_schema=False)
-async def favicon():
-    return FileResponse("static/index.html")
+async def favicon(request: Request):
+    return asset_response(request, "favicon.ico")
 
-@app.post("/chat")
-async def chat(data: ChatQuery):
-    try:
-        start_time = time.time()
-        current_agent = get_agent(data.api_key)
-        response = current_agent.handle_query(data.query, user_id=data.user_id)
-        response_time = time.time() - start_time
-        
-        # Log analytics
+@app.get("/static/{path:path}", include_in_schema=False)
+async def static_asset(request: Request, path: str):
+    return asset_response(request, path)
+
+async def answer_query(
+    current_agent: CustomerSupportAgent, data: ChatQuery, deadline: Optional[Deadline] = None, raise_errors: bool = False
+) -> str:
+    """Runs one chat turn and logs it to analytics (with ``raise_errors``, upstream failures raise and are not logged)."""
+    start_time = time.time()
+    async with admission.slot(data.user_id):
+        response = await current_agent.handle_query_async(
+            data.query, user_id=data.user_id, deadline=deadline, raise_errors=raise_errors
+        )
+    response_time = time.time() - start_time
+
+    # Log analytics
+    with metrics.span("analytics"):
         analytics.log_interaction(
             user_id=data.user_id,
             query=data.query,
             response=response,
             response_time=response_time
         )
-        
+    return response
+
+async def stream_answer(current_agent: CustomerSupportAgent, data: ChatQuery, deadline: Optional[Deadline] = None):
+    """Streams one chat turn sentence by sentence and logs it to analytics once complete."""
+    start_time = time.time()
+    sentences = []
+    async with admission.slot(data.user_id):
+        async for sentence in current_agent.handle_query_stream(data.query, user_id=data.user_id, deadline=deadline):
+            sentences.append(sentence)
+            yield sentence
+
+    with metrics.span("analytics", operation="chat_stream"):
+        analytics.log_interaction(
+            user_id=data.user_id,
+            query=data.query,
+            response=" ".join(sentences),
+            response_time=time.time() - start_time
+        )
+
+@app.post("/chat")
+async def chat(data: ChatQuery, request: Request):
+    try:
+        admission.check(data.user_id)
+        deadline = Deadline.from_header(request.headers.get("x-request-timeout"))
+        current_agent = await get_agent(data.api_key)
+        # Identical concurrent requests (double-clicks, client retries) share one upstream call
+        response = await run_with_deadline(request, flights.do(
+            ("chat", data.user_id, data.query),
+            lambda: answer_query(current_agent, data, deadline)
+        ), deadline)
         return {"response": response}
+    except (AdmissionRejected, RequestAborted):
+        raise
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
@@ -81,35 +352,316 @@ async def chat(data: ChatQuery):
         # Return the error message to the frontend for debugging
         return {"error": str(e), "response": f"I encountered an error: {str(e)}"}
 
+@app.post("/chat/stream")
+async def chat_stream(data: ChatQuery, request: Request):
+    """Streams the response as NDJSON, one complete sentence per line.
+
+    The stream is bounded by the request deadline (``X-Request-Timeout``). If
+    the client disconnects, the upstream stream is cancelled once no other
+    coalesced request is reading it.
+    """
+    # Rejections happen before the stream starts so clients get a real status code
+    admission.check(data.user_id)
+    deadline = Deadline.from_header(request.headers.get("x-request-timeout"))
+    current_agent = await get_agent(data.api_key)
+
+    async def event_stream():
+        sentences = []
+        try:
+            # Coalesced requests share the first one's upstream stream, but each waits only as long as its own deadline
+            async for sentence in within_deadline(flights.stream(
+                ("chat_stream", data.user_id, data.query),
+                lambda: stream_answer(current_agent, data, deadline)
+            ), deadline):
+                sentences.append(sentence)
+                yield json.dumps({"type": "sentence", "text": sentence}, ensure_ascii=False) + "\n"
+
+            response = " ".join(sentences)
+            yield json.dumps({"type": "done", "response": response}, ensure_ascii=False) + "\n"
+        except DeadlineExceeded as e:
+            record_abort(request, RequestAborted("timeout", str(e)))
+            yield json.dumps({"type": "error", "error": str(e), "reason": "timeout"}) + "\n"
+        except asyncio.CancelledError:
+            # The client went away; leaving the loop releases (and if unshared, cancels) the upstream stream
+            record_abort(request, RequestAborted("cancelled", "Client disconnected"))
+            raise
+        except Exception as e:
+            logger.error(f"Chat stream error: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+async def read_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Parses NDJSON records as they arrive; undecodable lines become empty records."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_record(line)
+    if buffer.strip():
+        yield parse_record(buffer)
+
+def parse_record(line: bytes) -> Dict[str, Any]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return {}
+    return record if isinstance(record, dict) else {}
+
+def replay_batch(records: AsyncIterator[Dict[str, Any]], concurrency: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Answers chat records like /chat does, several users at a time, yielding results as they complete."""
+
+    async def answer(record: Dict[str, Any]) -> str:
+        data = ChatQuery(query=str(record["query"]), user_id=str(record["user_id"]), api_key=record.get("api_key"))
+        # Replays skip per-user rate limits but still share upstream capacity fairly with live traffic.
+        # Upstream failures raise, so they are reported as error records and counted in the stats
+        return await answer_query(await get_agent(data.api_key), data, raise_errors=True)
+
+    if concurrency is not None:
+        concurrency = min(concurrency, settings.BATCH_MAX_CONCURRENCY)
+    return BatchReplay(answer, concurrency=concurrency).run(records)
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse for endpoints that keep reading the request body while they respond.
+
+    StreamingResponse normally watches ``receive()`` for a disconnect, which
+    would swallow the body chunks the endpoint is still reading. Here a
+    disconnect surfaces from ``request.stream()`` or the failed send instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+@app.post("/chat/batch")
+async def chat_batch(request: Request, concurrency: Optional[int] = None):
+    """Replays an NDJSON stream of {user_id, query} records and streams NDJSON results.
+
+    Each user's turns run in order while different users run in parallel; the
+    last line reports throughput and latency for the whole batch.
+    """
+
+    async def event_stream():
+        try:
+            async for result in replay_batch(read_ndjson(request.stream()), concurrency):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Batch replay error: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+
+    return DuplexStreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@app.websocket("/ws/session")
+async def voice_session(websocket: WebSocket):
+    """Carries one customer's voice session over a single connection.
+
+    The client opens with ``{"type": "start", "user_id", "api_key"}`` and then
+    sends ``{"type": "interim" | "final", "text"}`` transcripts. Each final
+    transcript is answered with ``sentence`` events and a ``done`` event.
+    Replies are generated speculatively once an interim transcript is stable.
+    """
+    await websocket.accept()
+    try:
+        start = await websocket.receive_json()
+        user_id = start.get("user_id") if start.get("type") == "start" else None
+        if not user_id:
+            await websocket.send_json({"type": "error", "error": "Expected a start message with a user_id"})
+            await websocket.close(code=1008)
+            return
+        try:
+            current_agent = await asyncio.to_thread(agent_pool.get, start.get("api_key"))
+        except Exception as e:
+            logger.error(f"Failed to initialize agent: {e}")
+            await websocket.send_json({"type": "error", "error": str(e)})
+            await websocket.close(code=1011)
+            return
+    except WebSocketDisconnect:
+        return
+
+    # The agent is resolved once per session; this lookup also restores the customer's history
+    await current_agent.conversations.prefetch(user_id)
+    if user_id in current_agent.conversations:
+        logger.info(f"Resuming voice session for user {user_id}")
+
+    async def generate(text: str):
+        async with admission.slot(user_id):
+            async for sentence in current_agent.handle_query_stream(text, user_id=user_id, remember=False):
+                yield sentence
+
+    def commit(text: str, response: str, response_time: float):
+        current_agent.commit_turn(user_id, text, response)
+        with metrics.span("analytics", operation="voice"):
+            analytics.log_interaction(user_id=user_id, query=text, response=response, response_time=response_time)
+
+    session = VoiceSession(generate, commit)
+    try:
+        await websocket.send_json({"type": "ready"})
+        while True:
+            message = await websocket.receive_json()
+            text = (message.get("text") or "").strip()
+            if message.get("type") == "interim":
+                session.interim(text)
+            elif message.get("type") == "final" and text:
+                try:
+                    admission.check(user_id)
+                    sentences = []
+                    async for sentence in session.final(text):
+                        sentences.append(sentence)
+                        await websocket.send_json({"type": "sentence", "text": sentence})
+                    await websocket.send_json({"type": "done", "response": " ".join(sentences)})
+                except AdmissionRejected as e:
+                    await websocket.send_json({"type": "error", "error": str(e), "reason": e.reason})
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    logger.error(f"Voice session error: {e}")
+                    await websocket.send_json({"type": "error", "error": str(e)})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+        logger.info(f"Voice session for user {user_id} closed: {session.stats()}")
+
+async def generate_profile_admitted(
+    current_agent: CustomerSupportAgent, user_id: str, refresh: bool = False, deadline: Optional[Deadline] = None
+):
+    async with admission.slot(user_id):
+        return await current_agent.generate_synthetic_profile_async(user_id, refresh=refresh, deadline=deadline)
+
+async def generate_profile_batch_admitted(current_agent: CustomerSupportAgent, user_ids: List[str], refresh: bool):
+    async with admission.slot(user_ids[0]):
+        return await current_agent.generate_profiles_batched_async(user_ids, refresh=refresh)
+
 @app.post("/generate-profile")
-async def generate_profile(data: ProfileRequest):
+async def generate_profile(data: ProfileRequest, request: Request):
     try:
-        current_agent = get_agent(data.api_key)
-        profile = current_agent.generate_synthetic_profile(data.user_id)
+        admission.check(data.user_id)
+        deadline = Deadline.from_header(request.headers.get("x-request-timeout"))
+        current_agent = await get_agent(data.api_key)
+        profile = await run_with_deadline(request, flights.do(
+            ("profile", data.user_id, data.refresh),
+            lambda: generate_profile_admitted(current_agent, data.user_id, data.refresh, deadline)
+        ), deadline)
         if profile:
             return profile
         else:
             raise HTTPException(status_code=500, detail="Failed to generate profile")
+    except (AdmissionRejected, RequestAborted):
+        raise
     except Exception as e:
         logger.error(f"Profile generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-profiles")
+async def generate_profiles(data: BulkProfileRequest):
+    """Generates (or returns cached) profiles for many users at once.
+
+    With PROFILE_GENERATOR=local this pre-populates thousands of seeded test
+    customers in milliseconds.
+    """
+    user_ids = list(dict.fromkeys(data.user_ids or [f"{data.prefix}{i}" for i in range(data.count or 0)]))
+    if not user_ids or len(user_ids) > settings.PROFILE_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"Expected between 1 and {settings.PROFILE_BULK_MAX} user ids")
+    if data.mode not in ("concurrent", "batched"):
+        raise HTTPException(status_code=400, detail="mode must be 'concurrent' or 'batched'")
+
+    start_time = time.perf_counter()
+    current_agent = await get_agent(data.api_key)
+    profiles: Dict[str, Optional[Dict[str, Any]]] = {}
+    if current_agent.local_profiles is not None:
+        # Seeded local generation never reaches upstream, so it skips admission
+        for user_id in user_ids:
+            profiles[user_id] = await current_agent.generate_synthetic_profile_async(user_id, data.refresh)
+    else:
+        # Stay within the admission queue rather than flooding it with thousands of waiters
+        limit = asyncio.Semaphore(admission.max_concurrency)
+
+        async def bounded(call):
+            async with limit:
+                return await call
+
+        if data.mode == "batched":
+            size = max(1, settings.PROFILE_PROMPT_BATCH)
+            chunks = [user_ids[i:i + size] for i in range(0, len(user_ids), size)]
+            results = await asyncio.gather(
+                *(bounded(generate_profile_batch_admitted(current_agent, chunk, data.refresh)) for chunk in chunks),
+                return_exceptions=True,
+            )
+            for chunk, result in zip(chunks, results):
+                profiles.update(dict.fromkeys(chunk) if isinstance(result, BaseException) else result)
+        else:
+            results = await asyncio.gather(
+                *(bounded(generate_profile_admitted(current_agent, user_id, data.refresh)) for user_id in user_ids),
+                return_exceptions=True,
+            )
+            profiles = {
+                user_id: None if isinstance(result, BaseException) else result
+                for user_id, result in zip(user_ids, results)
+            }
+
+    failed = [user_id for user_id, profile in profiles.items() if profile is None]
+    response: Dict[str, Any] = {
+        "generated": len(profiles) - len(failed),
+        "failed": failed,
+        "elapsed": round(time.perf_counter() - start_time, 3),
+    }
+    if data.include_profiles:
+        response["profiles"] = {user_id: profile for user_id, profile in profiles.items() if profile is not None}
+    return response
+
+@app.delete("/profiles/{user_id}")
+async def invalidate_profile(user_id: str):
+    """Drops a cached profile so the next request generates a fresh one."""
+    return {"invalidated": agent_pool.profile_cache.invalidate(user_id)}
+
 @app.get("/memories/{user_id}")
 async def get_memories(user_id: str):
     try:
-        current_agent = get_agent()
+        current_agent = await get_agent()
+        await current_agent.conversations.prefetch(user_id)
         memories = current_agent.get_user_memories(user_id)
         return {"memories": memories}
     except Exception as e:
         logger.error(f"Memory retrieval error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok", "uptime": startup.stats()["uptime"]}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: 503 until the default agent is warm, then 200; both report cold-start timings."""
+    return JSONResponse(status_code=200 if startup.ready else 503, content=startup.stats())
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition of request, stage and token metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def read_analytics(read, *args):
+    """Runs an analytics report; with shared state it queries the backend, so it runs in a worker thread."""
+    if analytics.shared is None:
+        return read(*args)
+    return await asyncio.to_thread(read, *args)
+
 # Analytics Endpoints
 @app.get("/analytics/summary")
 async def get_analytics_summary():
     """Get overall analytics summary."""
     try:
-        return analytics.get_summary_stats()
+        summary = await read_analytics(analytics.get_summary_stats)
+        if agent_pool.response_cache is not None:
+            summary["response_cache"] = agent_pool.response_cache.stats()
+        summary["request_coalescing"] = flights.stats()
+        summary["profile_cache"] = agent_pool.profile_cache.stats()
+        summary["aborted_requests"] = analytics.get_aborted_stats()
+        return summary
     except Exception as e:
         logger.error(f"Analytics summary error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -118,33 +670,104 @@ async def get_analytics_summary():
 async def get_user_analytics(user_id: str):
     """Get analytics for a specific user."""
     try:
-        return analytics.get_user_stats(user_id)
+        return await read_analytics(analytics.get_user_stats, user_id)
     except Exception as e:
         logger.error(f"User analytics error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/analytics/memory")
+async def get_memory_stats():
+    """Get conversation store size and hit/eviction counters."""
+    try:
+        return agent_pool.conversations.stats()
+    except Exception as e:
+        logger.error(f"Memory stats error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/analytics/admission")
+async def get_admission_stats():
+    """Get upstream concurrency, queue depth, queue wait times and rejections."""
+    try:
+        return admission.stats()
+    except Exception as e:
+        logger.error(f"Admission stats error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/analytics/state")
+async def get_state_stats():
+    """Get shared state backend batching and cache counters."""
+    if shared_state is None:
+        return {"backend": "memory"}
+    try:
+        return shared_state.stats()
+    except Exception as e:
+        logger.error(f"State stats error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/analytics/snapshot")
+async def get_snapshot_stats():
+    """Get snapshot save timings and lazy-restore progress."""
+    if snapshotter is None:
+        return {"enabled": False}
+    try:
+        return {"enabled": True, **snapshotter.stats()}
+    except Exception as e:
+        logger.error(f"Snapshot stats error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/analytics/providers")
+async def get_provider_stats():
+    """Get per-provider latency, error rate and circuit breaker state."""
+    try:
+        backend = (await get_agent()).backend
+        if hasattr(backend, "stats"):
+            return backend.stats()
+        return {"hedged_requests": 0, "providers": [{"provider": backend.name, "model": backend.model_name}]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Provider stats error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/analytics/recent")
 async def get_recent_interactions(limit: int = 10):
     """Get recent interactions."""
     try:
-        return {"interactions": analytics.get_recent_interactions(limit)}
+        # Older records are read from the segment files, which the spill writer may hold
+        return {"interactions": await asyncio.to_thread(analytics.get_recent_interactions, limit)}
     except Exception as e:
         logger.error(f"Recent interactions error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/analytics/timeseries")
+async def get_timeseries(
+    start: Optional[float] = Query(None, alias="from"),
+    end: Optional[float] = Query(None, alias="to"),
+    step: int = 60,
+):
+    """Get per-step interaction counts, latencies and unique users between from and to (epoch seconds)."""
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    if step <= 0 or end <= start:
+        raise HTTPException(status_code=400, detail="Expected step > 0 and from < to")
+    if (end - start) / step > settings.ANALYTICS_TIMESERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.ANALYTICS_TIMESERIES_MAX_POINTS} points per query; use a larger step")
+    try:
+        return {"from": start, "to": end, "step": step, "points": analytics.get_timeseries(start, end, step)}
+    except Exception as e:
+        logger.error(f"Timeseries error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/analytics/top-users")
 async def get_top_users(limit: int = 5):
     """Get most active users."""
     try:
-        return {"top_users": analytics.get_top_users(limit)}
+        return {"top_users": await read_analytics(analytics.get_top_users, limit)}
     except Exception as e:
         logger.error(f"Top users error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# Mount static files
-if not os.path.exists("static"):
-    os.makedirs("static")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+startup.record("import_app", time.perf_counter() - IMPORT_STARTED)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,160 @@
+"""
+Load-testing benchmark for the API, driven against the offline fake LLM backend
+Run with: python benchmarks/bench_api.py --concurrency 1 8 32 --requests 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Never spend Gemini quota from a benchmark, and keep analytics in memory
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "lognormal:0.05,0.3")
+os.environ.setdefault("ANALYTICS_SEGMENT_DIR", "")
+# Measure the API itself, not the per-user rate limiter
+os.environ.setdefault("ADMISSION_USER_RATE", "0")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+# method, path, JSON body, read-as-stream
+Request = Tuple[str, str, Optional[Dict[str, Any]], bool]
+
+SCENARIOS: Dict[str, Callable[[int], Request]] = {
+    "chat": lambda i: ("POST", "/chat", {"query": f"Where is my order #{i}?", "user_id": f"bench_user_{i % 50}"}, False),
+    "chat_stream": lambda i: ("POST", "/chat/stream", {"query": f"Can I return item {i}?", "user_id": f"bench_user_{i % 50}"}, True),
+    "generate_profile": lambda i: ("POST", "/generate-profile", {"user_id": f"bench_user_{i % 50}"}, False),
+    "analytics_summary": lambda i: ("GET", "/analytics/summary", None, False),
+    "analytics_top_users": lambda i: ("GET", "/analytics/top-users", None, False),
+    "analytics_recent": lambda i: ("GET", "/analytics/recent?limit=10", None, False),
+}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def _send(client: httpx.AsyncClient, request: Request) -> bool:
+    """Sends one request and returns whether it succeeded."""
+    method, path, body, stream = request
+    if stream:
+        async with client.stream(method, path, json=body) as response:
+            lines = [line async for line in response.aiter_lines() if line]
+        return response.status_code < 400 and bool(lines) and json.loads(lines[-1]).get("type") == "done"
+
+    response = await client.request(method, path, json=body)
+    if response.status_code >= 400:
+        return False
+    data = response.json()
+    return not (isinstance(data, dict) and "error" in data)
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, concurrency: int, total: int) -> Dict[str, Any]:
+    """Runs ``total`` requests of one scenario with ``concurrency`` workers."""
+    make_request = SCENARIOS[name]
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                ok = await _send(client, make_request(i))
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+async def run_benchmark(scenarios: List[str], concurrency_levels: List[int], requests: int) -> List[Dict[str, Any]]:
+    """Drives the in-process app at increasing concurrency and returns one row per run."""
+    from app import app
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        for name in scenarios:
+            for concurrency in concurrency_levels:
+                results.append(await run_scenario(client, name, concurrency, requests))
+    return results
+
+
+def print_table(results: List[Dict[str, Any]]):
+    header = f"{'scenario':<22}{'conc':>6}{'reqs':>7}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['scenario']:<22}{r['concurrency']:>6}{r['requests']:>7}{r['errors']:>8}"
+            f"{r['throughput_rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+        )
+
+
+def check_thresholds(results: List[Dict[str, Any]], max_p99_ms: Optional[float], min_rps: Optional[float],
+                     max_error_rate: float) -> List[str]:
+    """Returns a description of every run that breaches a threshold."""
+    failures = []
+    for r in results:
+        label = f"{r['scenario']}@{r['concurrency']}"
+        if max_p99_ms is not None and r["p99_ms"] > max_p99_ms:
+            failures.append(f"{label}: p99 {r['p99_ms']}ms > {max_p99_ms}ms")
+        if min_rps is not None and r["throughput_rps"] < min_rps:
+            failures.append(f"{label}: {r['throughput_rps']} rps < {min_rps} rps")
+        if r["errors"] / r["requests"] > max_error_rate:
+            failures.append(f"{label}: {r['errors']} errors in {r['requests']} requests")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OmniServe API against the fake LLM backend.")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and concurrency level")
+    parser.add_argument("--json", dest="json_path", help="Write results to this JSON file")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail if any run's p99 latency exceeds this")
+    parser.add_argument("--min-rps", type=float, help="Fail if any run's throughput is below this")
+    parser.add_argument("--max-error-rate", type=float, default=0.0, help="Fail if any run's error rate exceeds this")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args.scenarios, args.concurrency, args.requests))
+    print_table(results)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    failures = check_thresholds(results, args.max_p99_ms, args.min_rps, args.max_error_rate)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Replays historical support tickets through the agent
+Run with: python replay.py tickets.ndjson --concurrency 16 --output results.ndjson
+
+Each input line is a JSON record with ``user_id`` and ``query`` (``-`` reads
+stdin). By default the replay runs in this process; with ``--url`` the
+records are streamed to a running server's ``/chat/batch`` instead.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Any, AsyncIterator, Dict, Optional, TextIO
+
+# Add the current directory to sys.path to ensure 'src' is found correctly
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def read_lines(source: TextIO, chunk_lines: int = 256) -> AsyncIterator[bytes]:
+    """Reads the input in chunks off the event loop, so large files stream in."""
+    loop = asyncio.get_running_loop()
+    while True:
+        lines = await loop.run_in_executor(None, lambda: [source.readline() for _ in range(chunk_lines)])
+        lines = [line for line in lines if line]
+        if not lines:
+            return
+        yield "".join(lines).encode("utf-8")
+
+
+async def replay_local(source: TextIO, concurrency: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+    from app import app, read_ndjson, replay_batch
+
+    # Runs the app's startup/shutdown so replayed conversations are flushed or snapshotted (pre-warming)
+    async with app.router.lifespan_context(app):
+        async for result in replay_batch(read_ndjson(read_lines(source)), concurrency):
+            yield result
+
+
+async def replay_remote(source: TextIO, url: str, concurrency: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+    import httpx
+
+    params = {"concurrency": concurrency} if concurrency else None
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        async with client.stream("POST", "/chat/batch", params=params, content=read_lines(source),
+                                 headers={"Content-Type": "application/x-ndjson"}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+async def replay(args: argparse.Namespace) -> Dict[str, Any]:
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    results = replay_remote(source, args.url, args.concurrency) if args.url else replay_local(source, args.concurrency)
+    stats: Dict[str, Any] = {}
+    try:
+        async for result in results:
+            if result.get("type") == "stats":
+                stats = result
+                continue
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay NDJSON support tickets through the OmniServe agent.")
+    parser.add_argument("input", help="NDJSON file of {user_id, query} records, or - for stdin")
+    parser.add_argument("--concurrency", type=int, help="Users answered in parallel (default BATCH_CONCURRENCY)")
+    parser.add_argument("--output", help="Write results here instead of stdout")
+    parser.add_argument("--url", help="Replay against a running server (e.g. http://localhost:8000)")
+    args = parser.parse_args()
+
+    stats = asyncio.run(replay(args))
+    print(json.dumps(stats), file=sys.stderr)
+    sys.exit(1 if stats.get("errors") else 0)
+
+
+if __name__ == "__main__":
+    main()
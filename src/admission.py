@@ -0,0 +1,213 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from src.config import settings
+from src.metrics import metrics
+from src.sketches import LatencyHistogram, RunningStats
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is refused before reaching the upstream model.
+
+    ``status_code`` is 429 when the user is over their rate and 503 when the
+    server as a whole is saturated; ``retry_after`` is in seconds.
+    """
+
+    def __init__(self, reason: str, status_code: int, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, up to ``burst``."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Per-user rate limits plus a fair, bounded queue in front of the upstream model.
+
+    At most ``max_concurrency`` admitted calls run at once. Callers beyond that
+    wait in per-user queues served round-robin, so one user's burst only delays
+    that user. The queue holds at most ``max_queue`` waiters, and a waiter that
+    is not admitted within ``queue_timeout`` seconds is rejected rather than
+    left to pile up.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        user_rate: Optional[float] = None,
+        user_burst: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        max_tracked_users: int = 100_000,
+    ):
+        self.max_concurrency = max_concurrency or settings.ADMISSION_MAX_CONCURRENCY
+        self.user_rate = user_rate if user_rate is not None else settings.ADMISSION_USER_RATE
+        self.user_burst = user_burst or settings.ADMISSION_USER_BURST
+        self.max_queue = max_queue if max_queue is not None else settings.ADMISSION_MAX_QUEUE
+        self.queue_timeout = queue_timeout if queue_timeout is not None else settings.ADMISSION_QUEUE_TIMEOUT
+        self.max_tracked_users = max_tracked_users
+
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._bucket_lock = threading.Lock()
+        # user_id -> waiting futures; insertion order is the round-robin order
+        self._waiters: "OrderedDict[str, deque[asyncio.Future]]" = OrderedDict()
+        self.in_flight = 0
+        self.queue_depth = 0
+
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+        self.queue_wait = LatencyHistogram()
+        self.queue_wait_stats = RunningStats()
+        self.service_time = RunningStats()
+
+    # --- Rate limiting ---
+
+    def check(self, user_id: str):
+        """Fails fast if the user is over their rate or the queue is full."""
+        if self.user_rate > 0:
+            now = time.monotonic()
+            with self._bucket_lock:
+                bucket = self._buckets.get(user_id)
+                if bucket is None:
+                    bucket = TokenBucket(self.user_rate, self.user_burst, now)
+                    self._buckets[user_id] = bucket
+                    if len(self._buckets) > self.max_tracked_users:
+                        # An evicted user simply comes back with a full bucket
+                        self._buckets.popitem(last=False)
+                else:
+                    self._buckets.move_to_end(user_id)
+                if not bucket.take(now):
+                    self.rejected["rate_limited"] += 1
+                    raise AdmissionRejected("Too many requests for this user", 429, bucket.retry_after())
+
+        if self.in_flight >= self.max_concurrency and self.queue_depth >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise AdmissionRejected("Server is busy, please retry shortly", 503, self._estimated_wait())
+
+    def _estimated_wait(self) -> float:
+        # Time for everyone ahead to be served at the observed service time
+        per_call = self.service_time.mean if self.service_time.count else 1.0
+        return (self.queue_depth + 1) * per_call / self.max_concurrency
+
+    # --- Concurrency slots ---
+
+    async def acquire(self, user_id: str):
+        """Waits for an upstream slot, taking turns fairly with other users."""
+        if self.in_flight < self.max_concurrency and not self.queue_depth:
+            self.in_flight += 1
+            self._record_wait(0.0)
+            return
+        if self.queue_depth >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise AdmissionRejected("Server is busy, please retry shortly", 503, self._estimated_wait())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_id, deque()).append(future)
+        self.queue_depth += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if not future.done():
+                future.cancel()
+                self._forget(user_id, future)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.rejected["queue_timeout"] += 1
+                raise AdmissionRejected("Timed out waiting for capacity", 503, self._estimated_wait())
+            # The slot was handed over just as we gave up
+            if isinstance(e, asyncio.CancelledError):
+                self.release()
+                raise
+        self._record_wait(time.monotonic() - start)
+
+    def release(self):
+        """Frees a slot, handing it straight to the next user in round-robin order."""
+        while self._waiters:
+            user_id, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(user_id)
+            else:
+                del self._waiters[user_id]
+            self.queue_depth -= 1
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: str):
+        await self.acquire(user_id)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.service_time.add(time.monotonic() - start)
+            self.release()
+
+    def _forget(self, user_id: str, future: asyncio.Future):
+        queue = self._waiters.get(user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            return
+        self.queue_depth -= 1
+        if not queue:
+            del self._waiters[user_id]
+
+    def _record_wait(self, seconds: float):
+        self.admitted += 1
+        self.queue_wait.record(seconds)
+        self.queue_wait_stats.add(seconds)
+        metrics.observe("omniserve_admission_queue_wait_seconds", seconds)
+
+    def stats(self) -> Dict:
+        percentiles = self.queue_wait.percentiles()
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "queued_users": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_queue_wait": round(self.queue_wait_stats.mean, 4),
+            "max_queue_wait": round(max(self.queue_wait_stats.max, 0.0), 4),
+            "p50_queue_wait": round(percentiles["p50"], 4),
+            "p95_queue_wait": round(percentiles["p95"], 4),
+            "p99_queue_wait": round(percentiles["p99"], 4),
+        }
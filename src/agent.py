@@ -1,24 +1,51 @@
+import asyncio
+import hashlib
 import json
+import time
 import traceback
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-
-import google.generativeai as genai
+from typing import Optional, Dict, Any, List, AsyncIterator, Awaitable, Callable
 
+from src.admission import AdmissionController
+from src.backends import ModelBackend, create_backend
+from src.cache import ResponseCache
 from src.config import settings
+from src.context import ContextBuilder
+from src.deadlines import Deadline, DeadlineExceeded, call_with_retries, within_deadline
+from src.memory import ConversationStore
+from src.metrics import metrics
+from src.profiles import LocalProfileGenerator, ProfileCache, extract_json
+from src.streaming import SentenceSegmenter
 from src.utils import logger
 
+SUMMARY_PROMPT = """Update the running summary of a customer support conversation.
+Keep order numbers, products, dates, names and any unresolved issues. Write at most 5 sentences,
+in the language the customer used.
+
+Current summary:
+{previous}
+
+New conversation turns:
+{transcript}
+
+Return ONLY the updated summary."""
+
+class UpstreamError(RuntimeError):
+    """Raised when a streamed reply fails upstream; its message is the error text to show the customer."""
+
 class CustomerSupportAgent:
-    """Core logic for the AI Customer Support Agent with simple memory (using Gemini)."""
+    """Core logic for the AI Customer Support Agent with simple memory (Gemini by default)."""
     
-    def __init__(self, api_key: Optional[str] = None):
-        # Use provided API key or fallback to settings
-        key = api_key or settings.GOOGLE_API_KEY
-        if not key:
-            raise ValueError("Google API Key is required for Gemini.")
-        
-        genai.configure(api_key=key)
-        
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        conversations: Optional[ConversationStore] = None,
+        backend: Optional[ModelBackend] = None,
+        response_cache: Optional[ResponseCache] = None,
+        profile_cache: Optional[ProfileCache] = None,
+        admission: Optional[AdmissionController] = None,
+    ):
         # System Instruction for Persona
         system_instruction = """You are an expert customer support AI for TechGadgets.com, a premium online electronics retailer.
 
@@ -46,118 +73,344 @@ Guidelines:
 - If you don't have specific information, acknowledge it honestly and offer to help in other ways
 - Always end with a helpful follow-up question or offer when appropriate"""
 
-        self.model = genai.GenerativeModel(
-            model_name=settings.GEMINI_MODEL,
-            system_instruction=system_instruction
-        )
+        # Provider backend (uses the provided API key or falls back to settings)
+        self.backend = backend or create_backend(api_key, system_instruction)
+
+        # Opt-in cache for first-turn answers, namespaced by model and prompt version
+        if response_cache is None and settings.RESPONSE_CACHE_ENABLED:
+            response_cache = ResponseCache()
+        self.response_cache = response_cache
+        prompt_version = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:12]
+        self.cache_namespace = f"{self.backend.name}:{self.backend.model_name}:{prompt_version}"
         self.app_id = settings.APP_ID
+
+        # Generated profiles are cached per user; "local" swaps the LLM for a seeded generator
+        self.profile_cache = profile_cache if profile_cache is not None else ProfileCache()
+        self.local_profiles = LocalProfileGenerator() if settings.PROFILE_GENERATOR == "local" else None
         
-        # Simple in-memory storage for conversations
-        self.conversations: Dict[str, List[Dict[str, str]]] = {}
-        logger.info("Agent initialized successfully with Gemini.")
+        # Bounded in-memory storage for conversations (may be shared between agents)
+        self.conversations = conversations if conversations is not None else ConversationStore()
+        # Packs history into a token budget and summarizes older turns in the background
+        # (admitted like requests, so summaries count against user and upstream limits)
+        self.context = ContextBuilder(self.conversations, self._summarize, admission=admission)
+
+        # Caps the number of in-flight upstream calls made through the async API
+        self.max_concurrency = max_concurrency or settings.MAX_UPSTREAM_CONCURRENCY
+        self._upstream_semaphore = asyncio.Semaphore(self.max_concurrency)
+        logger.info(f"Agent initialized successfully with {self.backend.name} backend.")
+
+    def _one_slot(self, call: Callable[[float], Awaitable[str]]) -> Callable[[float], Awaitable[str]]:
+        """Wraps a retried upstream call so each attempt holds a slot, but backoff sleeps do not."""
+        async def attempt(timeout: float) -> str:
+            async with self._upstream_semaphore:
+                return await call(timeout)
+        return attempt
+
+    def _format_history(self, user_id: str) -> List[Dict[str, Any]]:
+        """Returns token-bounded Gemini history (starts with user and alternates)."""
+        return self.context.build(user_id)
+
+    async def _summarize(self, previous: str, turns: List[Dict[str, Any]]) -> str:
+        """Folds older turns into the rolling conversation summary."""
+        transcript = "\n".join(
+            f"{'Customer' if turn['role'] == 'user' else 'Agent'}: {turn['parts'][0]}" for turn in turns
+        )
+        prompt = SUMMARY_PROMPT.format(previous=previous or "(none)", transcript=transcript)
+        async with self._upstream_semaphore:
+            with metrics.span("upstream", operation="summary"):
+                answer = await self.backend.generate_async(prompt)
+        return answer.strip()
+
+    def _cacheable(self, user_id: str) -> bool:
+        """Only users with no history or profile get (and populate) shared cached answers."""
+        return self.response_cache is not None and user_id not in self.conversations
+
+    def _cached_answer(self, query: str, user_id: str) -> Optional[str]:
+        if not self._cacheable(user_id):
+            return None
+        return self.response_cache.get(self.cache_namespace, query)
+
+    def _cache_answer(self, query: str, answer: str, cacheable: bool):
+        if cacheable:
+            self.response_cache.set(self.cache_namespace, query, answer)
+
+    def _remember(self, user_id: str, query: str, answer: str):
+        """Appends a completed turn to the user's memory."""
+        self.conversations.append(user_id, "user", query)
+        self.conversations.append(user_id, "assistant", answer)
+
+    def _error_response(self, e: Exception) -> str:
+        """Logs an upstream failure and returns the user-facing error message."""
+        error_trace = traceback.format_exc()
+        # The logger also appends errors to error.log, off the calling thread
+        logger.error(f"{self.backend.name} Error: {str(e)}\n{error_trace}")
+
+        if "401" in str(e) or "API_KEY_INVALID" in str(e):
+            return "Error: Invalid Gemini API Key. Please check your key and try again. (ত্রুটি: ভুল Gemini API কী। দয়া করে আপনার কী পরীক্ষা করুন এবং আবার চেষ্টা করুন।)"
+        return f"I encountered an error with the AI: {str(e)}. Please check the logs."
 
     def handle_query(self, query: str, user_id: str) -> str:
         """Handles a customer query by retrieving conversation history and generating a response."""
         try:
             logger.info(f"Handling query for user {user_id}: {query[:50]}...")
-            
-            if user_id not in self.conversations:
-                self.conversations[user_id] = []
-            
-            # Gemini-specific history formatting (must start with user and alternate)
-            formatted_history = []
-            history_slice = self.conversations[user_id][-10:]
-            
-            for msg in history_slice:
-                role = "user" if msg["role"] == "user" else "model"
-                # Ensure we start with 'user' and roles alternate
-                if not formatted_history:
-                    if role != "user": continue
-                elif formatted_history[-1]["role"] == role:
-                    # If same role as last, merge content or skip
-                    formatted_history[-1]["parts"][0] += f"\n{msg['content']}"
-                    continue
-                
-                formatted_history.append({"role": role, "parts": [msg["content"]]})
-
-            # Re-verify alternation before starting chat
-            if formatted_history and formatted_history[-1]["role"] == "user":
-                # We need to end with model or send as part of send_message
-                pass 
-            
-            # Start chat session
-            chat = self.model.start_chat(history=formatted_history)
-            
-            # Simple safety settings
-            safety_settings = {
-                "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
-                "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
-                "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
-                "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
-            }
-
-            response = chat.send_message(query, safety_settings=safety_settings)
-            answer = response.text
-            
+
+            with metrics.span("cache_lookup"):
+                cached = self._cached_answer(query, user_id)
+            if cached is not None:
+                self._remember(user_id, query, cached)
+                return cached
+
+            cacheable = self._cacheable(user_id)
+            with metrics.span("history"):
+                history = self._format_history(user_id)
+            with metrics.span("upstream"):
+                answer = self.backend.send(history, query)
+            self._cache_answer(query, answer, cacheable)
+
             # Update internal memory
-            self.conversations[user_id].append({"role": "user", "content": query})
-            self.conversations[user_id].append({"role": "assistant", "content": answer})
-            
+            with metrics.span("remember"):
+                self._remember(user_id, query, answer)
+            return answer
+
+        except Exception as e:
+            return self._error_response(e)
+
+    async def handle_query_async(
+        self, query: str, user_id: str, deadline: Optional[Deadline] = None, raise_errors: bool = False
+    ) -> str:
+        """Non-blocking variant of handle_query for use on the event loop.
+
+        The upstream call is bounded by ``deadline`` (REQUEST_TIMEOUT by default)
+        and retried with backoff while it allows; running out raises DeadlineExceeded.
+        With ``raise_errors`` an upstream failure raises UpstreamError instead of
+        returning the error text as the answer.
+        """
+        deadline = deadline or Deadline()
+        try:
+            logger.info(f"Handling async query for user {user_id}: {query[:50]}...")
+            await self.conversations.prefetch(user_id)
+            with metrics.span("cache_lookup"):
+                cached = self._cached_answer(query, user_id)
+            if cached is not None:
+                self._remember(user_id, query, cached)
+                return cached
+
+            cacheable = self._cacheable(user_id)
+            with metrics.span("history"):
+                history = self._format_history(user_id)
+            with metrics.span("upstream"):
+                answer = await call_with_retries(
+                    self._one_slot(lambda timeout: self.backend.send_async(history, query, timeout=timeout)),
+                    deadline,
+                )
+            self._cache_answer(query, answer, cacheable)
+
+            with metrics.span("remember"):
+                self._remember(user_id, query, answer)
             return answer
-            
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if raise_errors:
+                raise UpstreamError(self._error_response(e)) from e
+            return self._error_response(e)
+
+    def commit_turn(self, user_id: str, query: str, answer: str):
+        """Commits a turn generated with ``remember=False`` once it is known to be wanted."""
+        self._remember(user_id, query, answer)
+
+    async def handle_query_stream(
+        self, query: str, user_id: str, remember: bool = True, deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[str]:
+        """Streams the response sentence by sentence as the model generates it.
+
+        The full answer is committed to memory once the stream completes, unless
+        ``remember`` is False (speculative replies are committed by the caller).
+        An upstream failure raises UpstreamError rather than being streamed as
+        a reply, so callers never commit or log it as the assistant's answer.
+        The upstream stream is bounded by ``deadline`` (REQUEST_TIMEOUT by
+        default); running out raises DeadlineExceeded.
+        """
+        deadline = deadline or Deadline()
+        try:
+            logger.info(f"Handling streaming query for user {user_id}: {query[:50]}...")
+            await self.conversations.prefetch(user_id)
+            segmenter = SentenceSegmenter()
+            with metrics.span("cache_lookup", operation="chat_stream"):
+                cached = self._cached_answer(query, user_id)
+            if cached is not None:
+                for sentence in segmenter.feed(cached) + segmenter.flush():
+                    yield sentence
+                if remember:
+                    self._remember(user_id, query, cached)
+                return
+
+            cacheable = self._cacheable(user_id)
+            with metrics.span("history", operation="chat_stream"):
+                history = self._format_history(user_id)
+            chunks = []
+            async with self._upstream_semaphore:
+                # Time to first chunk is timed separately; the whole stream includes client backpressure
+                start = time.perf_counter()
+                upstream = self.backend.stream_async(history, query, timeout=deadline.remaining())
+                async for chunk in within_deadline(upstream, deadline):
+                    if not chunks:
+                        metrics.observe(
+                            "omniserve_stage_duration_seconds", time.perf_counter() - start,
+                            stage="upstream_first_chunk", operation="chat_stream",
+                        )
+                    chunks.append(chunk)
+                    for sentence in segmenter.feed(chunk):
+                        yield sentence
+                metrics.observe(
+                    "omniserve_stage_duration_seconds", time.perf_counter() - start,
+                    stage="upstream", operation="chat_stream",
+                )
+            for sentence in segmenter.flush():
+                yield sentence
+
+            answer = "".join(chunks)
+            self._cache_answer(query, answer, cacheable)
+            if remember:
+                with metrics.span("remember", operation="chat_stream"):
+                    self._remember(user_id, query, answer)
+
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            error_trace = traceback.format_exc()
-            logger.error(f"Gemini Error: {str(e)}\n{error_trace}")
-            # Log to file for deep inspection
-            with open("error.log", "a", encoding="utf-8") as f:
-                f.write(f"\n[{datetime.now()}] ERROR: {str(e)}\n{error_trace}\n")
-            
-            if "401" in str(e) or "API_KEY_INVALID" in str(e):
-                return "Error: Invalid Gemini API Key. Please check your key and try again. (ত্রুটি: ভুল Gemini API কী। দয়া করে আপনার কী পরীক্ষা করুন এবং আবার চেষ্টা করুন।)"
-            return f"I encountered an error with the AI: {str(e)}. Please check the logs."
+            raise UpstreamError(self._error_response(e)) from e
 
     def get_user_memories(self, user_id: str) -> List[str]:
         """Retrieves conversation history for a user."""
         try:
-            if user_id in self.conversations:
-                return [f"{msg['role']}: {msg['content']}" for msg in self.conversations[user_id]]
-            return []
+            return [f"{msg['role']}: {msg['content']}" for msg in self.conversations.get(user_id, [])]
         except Exception as e:
             logger.error(f"Failed to fetch memories for {user_id}: {e}")
             return []
 
-    def generate_synthetic_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Generates a realistic customer profile."""
-        try:
-            logger.info(f"Generating synthetic profile for user {user_id}")
-            today = datetime.now()
-            order_date = (today - timedelta(days=10)).strftime("%B %d, %Y")
-            expected_delivery = (today + timedelta(days=2)).strftime("%B %d, %Y")
+    def _profile_prompt(self, user_id: str) -> str:
+        today = datetime.now()
+        order_date = (today - timedelta(days=10)).strftime("%B %d, %Y")
+        expected_delivery = (today + timedelta(days=2)).strftime("%B %d, %Y")
+
+        return f"""Generate a detailed JSON customer profile for ID {user_id}. Include:
+            - Basic Info (Name, Email)
+            - Recent high-end electronics order (Placed: {order_date}, Delivery: {expected_delivery})
+            - 2 past orders and 2 previous support interactions.
+            Return ONLY valid JSON."""
+
+    def _batch_profile_prompt(self, user_ids: List[str]) -> str:
+        today = datetime.now()
+        order_date = (today - timedelta(days=10)).strftime("%B %d, %Y")
+        expected_delivery = (today + timedelta(days=2)).strftime("%B %d, %Y")
 
-            prompt = f"""Generate a detailed JSON customer profile for ID {user_id}. Include:
+        return f"""Generate detailed customer profiles as one JSON object keyed by customer ID.
+            IDs: {", ".join(user_ids)}
+            For each customer include:
             - Basic Info (Name, Email)
             - Recent high-end electronics order (Placed: {order_date}, Delivery: {expected_delivery})
             - 2 past orders and 2 previous support interactions.
             Return ONLY valid JSON."""
 
-            response = self.model.generate_content(prompt)
+    def _store_profile(self, user_id: str, customer_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Caches the profile and stores it in the conversation as context (replacing any previous one)."""
+        if not isinstance(customer_data, dict):
+            raise ValueError("Profile is not a JSON object")
+        self.conversations.set_profile(user_id, f"Customer Profile: {json.dumps(customer_data)}")
+        self.profile_cache.set(user_id, customer_data)
+        return customer_data
 
-            # Clean the response in case Gemini adds markdown formatting
-            content = response.text
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
+    def _cached_profile(self, user_id: str, refresh: bool) -> Optional[Dict[str, Any]]:
+        if refresh:
+            self.profile_cache.invalidate(user_id)
+            return None
+        profile = self.profile_cache.get(user_id)
+        if profile is not None and user_id not in self.conversations:
+            # The conversation expired or was evicted; put the profile back as context
+            self.conversations.set_profile(user_id, f"Customer Profile: {json.dumps(profile)}")
+        return profile
 
-            customer_data = json.loads(content)
-            
-            # Store profile in conversation as context
-            profile_msg = f"Customer Profile: {json.dumps(customer_data)}"
-            if user_id not in self.conversations:
-                self.conversations[user_id] = []
-            self.conversations[user_id].insert(0, {"role": "system", "content": profile_msg})
+    def generate_synthetic_profile(self, user_id: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """Generates a realistic customer profile (cached per user unless ``refresh``)."""
+        try:
+            cached = self._cached_profile(user_id, refresh)
+            if cached is not None:
+                return cached
+            logger.info(f"Generating synthetic profile for user {user_id}")
+            if self.local_profiles is not None:
+                return self._store_profile(user_id, self.local_profiles.generate(user_id))
+            with metrics.span("upstream", operation="profile"):
+                content = self.backend.generate(self._profile_prompt(user_id))
+            with metrics.span("parse", operation="profile"):
+                return self._store_profile(user_id, extract_json(content))
+        except Exception as e:
+            logger.error(f"Profile generation failed: {e}")
+            return None
 
-            return customer_data
+    async def generate_synthetic_profile_async(
+        self, user_id: str, refresh: bool = False, deadline: Optional[Deadline] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Non-blocking variant of generate_synthetic_profile, bounded by ``deadline`` like handle_query_async."""
+        deadline = deadline or Deadline()
+        try:
+            await self.conversations.prefetch(user_id)
+            cached = self._cached_profile(user_id, refresh)
+            if cached is not None:
+                return cached
+            logger.info(f"Generating synthetic profile (async) for user {user_id}")
+            if self.local_profiles is not None:
+                return self._store_profile(user_id, self.local_profiles.generate(user_id))
+            with metrics.span("upstream", operation="profile"):
+                content = await call_with_retries(
+                    self._one_slot(
+                        lambda timeout: self.backend.generate_async(self._profile_prompt(user_id), timeout=timeout)
+                    ),
+                    deadline,
+                )
+            with metrics.span("parse", operation="profile"):
+                return self._store_profile(user_id, extract_json(content))
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Profile generation failed: {e}")
             return None
+
+    async def generate_profiles_batched_async(
+        self, user_ids: List[str], refresh: bool = False
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Generates profiles for several users with a single prompt.
+
+        Cached users are skipped; users missing from the model's answer map to None.
+        """
+        profiles: Dict[str, Optional[Dict[str, Any]]] = {}
+        await asyncio.gather(*(self.conversations.prefetch(user_id) for user_id in user_ids))
+        for user_id in user_ids:
+            profiles[user_id] = self._cached_profile(user_id, refresh)
+        missing = [user_id for user_id, profile in profiles.items() if profile is None]
+        if not missing:
+            return profiles
+        if self.local_profiles is not None:
+            for user_id in missing:
+                profiles[user_id] = self._store_profile(user_id, self.local_profiles.generate(user_id))
+            return profiles
+
+        try:
+            logger.info(f"Generating {len(missing)} synthetic profiles in one prompt")
+            with metrics.span("upstream", operation="profile_batch"):
+                content = await call_with_retries(
+                    self._one_slot(
+                        lambda timeout: self.backend.generate_async(self._batch_profile_prompt(missing), timeout=timeout)
+                    ),
+                    Deadline(),
+                )
+            with metrics.span("parse", operation="profile_batch"):
+                generated = extract_json(content)
+                if not isinstance(generated, dict):
+                    raise ValueError("Batched profiles are not a JSON object keyed by customer ID")
+                for user_id in missing:
+                    if isinstance(generated.get(user_id), dict):
+                        profiles[user_id] = self._store_profile(user_id, generated[user_id])
+        except Exception as e:
+            logger.error(f"Batched profile generation failed: {e}")
+        return profiles
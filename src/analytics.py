@@ -1,19 +1,54 @@
 import json
 from datetime import datetime
-from typing import Dict, List, Optional
-from collections import defaultdict
-import statistics
+from typing import TYPE_CHECKING, Dict, List, Optional
+from collections import OrderedDict, defaultdict, deque
+
+from src.interaction_log import InteractionLog
+from src.config import settings
+from src.rollups import RollupSeries
+from src.sketches import HyperLogLog, LatencyHistogram, RunningStats, TopK
+from src.state import get_shared_state
+
+if TYPE_CHECKING:
+    from src.state import SharedState
 
 class AnalyticsTracker:
-    """Tracks and analyzes agent interactions for insights."""
+    """Tracks and analyzes agent interactions for insights.
+
+    With ``shared`` state, counters are also aggregated across every worker and
+    replica, and the summary, per-user and top-user reports read those totals.
+    The recent-interactions log and the time-series rollups stay per process.
+    """
     
-    def __init__(self):
-        self.interactions: List[Dict] = []
-        self.user_stats: Dict[str, Dict] = defaultdict(lambda: {
-            "total_queries": 0,
-            "total_response_time": 0,
-            "queries": []
-        })
+    def __init__(self, interactions: Optional[InteractionLog] = None, shared: Optional["SharedState"] = None):
+        # Bounded, columnar log of recent interactions (older ones spill to disk)
+        self.interactions = interactions if interactions is not None else InteractionLog()
+        self.shared = shared
+
+        # Running aggregates, updated in O(1) per interaction
+        self.response_time_stats = RunningStats()
+        self.query_length_stats = RunningStats()
+        self.response_length_stats = RunningStats()
+        self.response_time_histogram = LatencyHistogram()
+
+        # Heavy hitters for /analytics/top-users: exact, or Space-Saving with bounded memory
+        self.top_users_mode = settings.TOP_USERS_MODE
+        self.top_users = TopK(
+            capacity=settings.TOP_USERS_CAPACITY if self.top_users_mode == "approximate" else None
+        )
+
+        # Per-user totals, in least- to most-recently active order. In approximate
+        # mode only the TOP_USERS_CAPACITY most recently active users are kept,
+        # and unique users are estimated with a HyperLogLog instead of counted.
+        self.user_stats_capacity = self.top_users.capacity
+        self.user_stats: "OrderedDict[str, Dict]" = OrderedDict()
+        self.unique_users = HyperLogLog() if self.top_users_mode == "approximate" else None
+
+        # Per-minute rollups (downsampled to hours and days) for /analytics/timeseries
+        self.rollups = RollupSeries()
+
+        # Requests abandoned before an answer: {route: {"timeout"|"cancelled": count}}
+        self.aborted: Dict[str, Dict[str, int]] = defaultdict(lambda: {"timeout": 0, "cancelled": 0})
     
     def log_interaction(self, user_id: str, query: str, response: str, 
                        response_time: float, timestamp: Optional[datetime] = None):
@@ -21,26 +56,62 @@ class AnalyticsTracker:
         if timestamp is None:
             timestamp = datetime.now()
         
-        interaction = {
-            "user_id": user_id,
-            "query": query,
-            "response": response,
-            "response_time": response_time,
-            "timestamp": timestamp.isoformat(),
-            "query_length": len(query),
-            "response_length": len(response)
-        }
-        
-        self.interactions.append(interaction)
+        self.interactions.append(user_id, query, response, response_time, timestamp.timestamp())
         
         # Update user stats
-        self.user_stats[user_id]["total_queries"] += 1
-        self.user_stats[user_id]["total_response_time"] += response_time
-        self.user_stats[user_id]["queries"].append(query)
+        stats = self._user(user_id)
+        stats["total_queries"] += 1
+        stats["total_response_time"] += response_time
+        stats["queries"].append(query)
+        if self.unique_users is not None:
+            self.unique_users.add(user_id)
+
+        self.response_time_stats.add(response_time)
+        self.query_length_stats.add(len(query))
+        self.response_length_stats.add(len(response))
+        self.response_time_histogram.record(response_time)
+        self.top_users.increment(user_id)
+        self.rollups.record(timestamp.timestamp(), user_id, response_time, len(query), len(response))
+
+        if self.shared is not None:
+            self.shared.record_interaction(
+                user_id, query, response_time, len(response),
+                self.response_time_histogram.bucket_index(response_time),
+            )
     
+    def _user(self, user_id: str) -> Dict:
+        """Returns the user's stats entry, creating it (and evicting the least recently active user if full)."""
+        stats = self.user_stats.get(user_id)
+        if stats is not None:
+            self.user_stats.move_to_end(user_id)
+            return stats
+        stats = self.user_stats[user_id] = {
+            "total_queries": 0,
+            "total_response_time": 0,
+            "queries": deque(maxlen=5)  # Only the last 5 are ever reported
+        }
+        if self.user_stats_capacity is not None and len(self.user_stats) > self.user_stats_capacity:
+            self.user_stats.popitem(last=False)
+        return stats
+
+    def log_aborted(self, route: str, reason: str):
+        """Count a request that hit its deadline ("timeout") or whose client disconnected ("cancelled")."""
+        self.aborted[route][reason] += 1
+
+    def get_aborted_stats(self) -> Dict:
+        """Get timeout and cancellation counts, in total and per route (this process only)."""
+        by_route = {route: dict(counts) for route, counts in list(self.aborted.items())}
+        return {
+            "timeouts": sum(counts["timeout"] for counts in by_route.values()),
+            "cancellations": sum(counts["cancelled"] for counts in by_route.values()),
+            "by_route": by_route,
+        }
+
     def get_summary_stats(self) -> Dict:
         """Get overall analytics summary."""
-        if not self.interactions:
+        if self.shared is not None:
+            return self._shared_summary_stats()
+        if self.response_time_stats.count == 0:
             return {
                 "total_interactions": 0,
                 "unique_users": 0,
@@ -49,22 +120,71 @@ class AnalyticsTracker:
                 "avg_response_length": 0
             }
         
-        response_times = [i["response_time"] for i in self.interactions]
-        query_lengths = [i["query_length"] for i in self.interactions]
-        response_lengths = [i["response_length"] for i in self.interactions]
+        response_times = self.response_time_stats
+        percentiles = self.response_time_histogram.percentiles()
         
         return {
-            "total_interactions": len(self.interactions),
-            "unique_users": len(self.user_stats),
-            "avg_response_time": round(statistics.mean(response_times), 3),
-            "min_response_time": round(min(response_times), 3),
-            "max_response_time": round(max(response_times), 3),
-            "avg_query_length": round(statistics.mean(query_lengths), 1),
-            "avg_response_length": round(statistics.mean(response_lengths), 1)
+            "total_interactions": response_times.count,
+            "unique_users": self.unique_users.count() if self.unique_users is not None else len(self.user_stats),
+            "avg_response_time": round(response_times.mean, 3),
+            "min_response_time": round(response_times.min, 3),
+            "max_response_time": round(response_times.max, 3),
+            "stddev_response_time": round(response_times.stddev, 3),
+            "p50_response_time": round(percentiles["p50"], 3),
+            "p95_response_time": round(percentiles["p95"], 3),
+            "p99_response_time": round(percentiles["p99"], 3),
+            "avg_query_length": round(self.query_length_stats.mean, 1),
+            "avg_response_length": round(self.response_length_stats.mean, 1)
         }
     
+    def _shared_summary_stats(self) -> Dict:
+        """Summary across all workers, rebuilt from the shared counters."""
+        shared = self.shared.analytics_totals()
+        totals = shared["totals"]
+        count = int(totals.get("interactions", 0))
+        if count == 0:
+            return {
+                "total_interactions": 0,
+                "unique_users": 0,
+                "avg_response_time": 0,
+                "avg_query_length": 0,
+                "avg_response_length": 0
+            }
+
+        histogram = LatencyHistogram()
+        for index, bucket in shared["latency_buckets"].items():
+            histogram.add_bucket(index, bucket)
+        percentiles = histogram.percentiles()
+        mean = totals.get("response_time", 0.0) / count
+        variance = max(totals.get("response_time_sq", 0.0) / count - mean * mean, 0.0)
+
+        return {
+            "total_interactions": count,
+            "unique_users": shared["unique_users"],
+            "avg_response_time": round(mean, 3),
+            # Exact extremes are not mergeable counters; the histogram bounds them within its precision
+            "min_response_time": round(histogram.quantile(0.0), 3),
+            "max_response_time": round(histogram.quantile(1.0), 3),
+            "stddev_response_time": round(variance ** 0.5, 3),
+            "p50_response_time": round(percentiles["p50"], 3),
+            "p95_response_time": round(percentiles["p95"], 3),
+            "p99_response_time": round(percentiles["p99"], 3),
+            "avg_query_length": round(totals.get("query_length", 0.0) / count, 1),
+            "avg_response_length": round(totals.get("response_length", 0.0) / count, 1)
+        }
+
     def get_user_stats(self, user_id: str) -> Dict:
         """Get stats for a specific user."""
+        if self.shared is not None:
+            stats = self.shared.user_stats(user_id)
+            if stats is None:
+                return {"error": "User not found"}
+            return {
+                "user_id": user_id,
+                "total_queries": stats["queries"],
+                "avg_response_time": round(stats["response_time"] / stats["queries"], 3) if stats["queries"] > 0 else 0,
+                "recent_queries": stats["recent_queries"]
+            }
         if user_id not in self.user_stats:
             return {"error": "User not found"}
         
@@ -75,28 +195,74 @@ class AnalyticsTracker:
             "avg_response_time": round(
                 stats["total_response_time"] / stats["total_queries"], 3
             ) if stats["total_queries"] > 0 else 0,
-            "recent_queries": stats["queries"][-5:]  # Last 5 queries
+            "recent_queries": list(stats["queries"])  # Last 5 queries
         }
     
     def get_recent_interactions(self, limit: int = 10) -> List[Dict]:
         """Get most recent interactions."""
-        return self.interactions[-limit:]
+        return self.interactions.recent(limit)
     
+    def get_timeseries(self, start: float, end: float, step: int) -> List[Dict]:
+        """Get per-step aggregates for ``[start, end)`` (epoch seconds) from the rollups."""
+        return self.rollups.query(start, end, step)
+
     def get_top_users(self, limit: int = 5) -> List[Dict]:
         """Get most active users."""
-        sorted_users = sorted(
-            self.user_stats.items(),
-            key=lambda x: x[1]["total_queries"],
-            reverse=True
-        )[:limit]
-        
-        return [
-            {
-                "user_id": user_id,
-                "total_queries": stats["total_queries"]
-            }
-            for user_id, stats in sorted_users
-        ]
+        if self.shared is not None:
+            return [
+                {"user_id": user_id, "total_queries": count}
+                for user_id, count in self.shared.top_users(limit)
+            ]
+        top_users = []
+        for entry in self.top_users.top(limit):
+            user = {"user_id": entry["key"], "total_queries": entry["count"]}
+            if self.top_users_mode == "approximate":
+                # Space-Saving may overcount a user by at most this much
+                user["max_overcount"] = entry["error"]
+            top_users.append(user)
+        return top_users
+
+    def export_state(self) -> Dict:
+        """Returns the tracker's state as JSON-safe data, for snapshots."""
+        return {
+            "response_time": self.response_time_stats.to_dict(),
+            "query_length": self.query_length_stats.to_dict(),
+            "response_length": self.response_length_stats.to_dict(),
+            "response_time_histogram": self.response_time_histogram.to_dict(),
+            "users": {
+                user_id: [stats["total_queries"], stats["total_response_time"], list(stats["queries"])]
+                for user_id, stats in list(self.user_stats.items())
+            },
+            "unique_users": self.unique_users.to_dict() if self.unique_users is not None else None,
+            "interactions": self.interactions.ring_rows(),
+            "rollups": self.rollups.to_dict(),
+        }
+
+    def load_state(self, state: Dict):
+        """Restores state produced by ``export_state`` into an empty tracker."""
+        self.response_time_stats = RunningStats.from_dict(state["response_time"])
+        self.query_length_stats = RunningStats.from_dict(state["query_length"])
+        self.response_length_stats = RunningStats.from_dict(state["response_length"])
+        self.response_time_histogram = LatencyHistogram.from_dict(state["response_time_histogram"])
+        for user_id, (total_queries, total_response_time, queries) in state["users"].items():
+            stats = self._user(user_id)
+            stats["total_queries"] = total_queries
+            stats["total_response_time"] = total_response_time
+            stats["queries"].extend(queries)
+        if self.unique_users is not None:
+            if state.get("unique_users"):
+                self.unique_users = HyperLogLog.from_dict(state["unique_users"])
+            else:
+                for user_id in self.user_stats:
+                    self.unique_users.add(user_id)
+        # Per-user totals are exact for every user kept, so the heavy hitters can be rebuilt from them
+        self.top_users = TopK.from_counts(
+            {user_id: stats["total_queries"] for user_id, stats in self.user_stats.items()},
+            capacity=self.top_users.capacity,
+        )
+        self.interactions.load_rows(state["interactions"])
+        if "rollups" in state:  # Absent from snapshots taken before rollups existed
+            self.rollups.load(state["rollups"])
 
 # Global analytics instance
-analytics = AnalyticsTracker()
+analytics = AnalyticsTracker(shared=get_shared_state())
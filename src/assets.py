@@ -0,0 +1,150 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Callable, Dict, Optional, Tuple
+
+from src.config import settings
+from src.utils import logger
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are built
+    brotli = None
+
+# Served under a content-hashed name and referenced by it from HTML
+FINGERPRINTED = (".js", ".css")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Unhashed URLs (index.html, favicon.ico) can change in place, so clients revalidate with the ETag
+REVALIDATE = "no-cache"
+
+# Smaller bodies are not worth a Content-Encoding round trip
+MIN_COMPRESS_SIZE = 256
+
+# Preference order when the client accepts several encodings equally
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=11)
+COMPRESSORS["gzip"] = lambda body: gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def _compressible(media_type: str) -> bool:
+    return media_type.startswith("text/") or media_type in (
+        "application/javascript", "application/json", "image/svg+xml",
+    )
+
+
+class Asset:
+    """One static file held in memory, with its precompressed variants."""
+
+    __slots__ = ("media_type", "digest", "variants")
+
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants: Dict[str, bytes] = {"identity": body}
+        if _compressible(media_type) and len(body) >= MIN_COMPRESS_SIZE:
+            for encoding, compress in COMPRESSORS.items():
+                compressed = compress(body)
+                if len(compressed) < len(body):
+                    self.variants[encoding] = compressed
+
+    def etag(self, encoding: str) -> str:
+        # Each encoding is a different byte sequence, so each gets its own strong ETag
+        tag = self.digest[:16] if encoding == "identity" else f"{self.digest[:16]}-{encoding}"
+        return f'"{tag}"'
+
+    def negotiate(self, accept_encoding: Optional[str]) -> str:
+        """Picks the prebuilt variant the client weights highest (ties prefer brotli over gzip)."""
+        weights: Dict[str, float] = {}
+        for part in (accept_encoding or "").split(","):
+            coding, _, params = part.strip().partition(";")
+            q = 1.0
+            for param in params.split(";"):
+                key, _, value = param.strip().partition("=")
+                if key == "q":
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            if coding:
+                weights[coding.strip().lower()] = q
+
+        best, best_q = "identity", 0.0
+        for encoding in self.variants:
+            if encoding == "identity":
+                continue
+            q = weights.get(encoding, weights.get("*", 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluates an If-None-Match header against ``etag`` (weak comparison, as RFC 9110 requires)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+class StaticAssets:
+    """In-memory, precompressed copy of the static directory, built once at startup.
+
+    Every ``*.js`` and ``*.css`` file is also published under a content-hashed
+    name (``script.3f2a9c1b7e4d.js``), and references to it in HTML files are
+    rewritten to that name, so those URLs change whenever the content does and
+    can be cached forever. Text assets are gzip- (and, with the ``brotli``
+    package, brotli-) compressed once here instead of on every request.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.STATIC_DIR
+        self._files: Dict[str, Tuple[Asset, str]] = {}
+        self.fingerprints: Dict[str, str] = {}
+        self.built = False
+
+    def build(self):
+        sources: Dict[str, bytes] = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    sources[os.path.relpath(path, self.directory).replace(os.sep, "/")] = f.read()
+
+        fingerprints = {}
+        for name, body in sources.items():
+            stem, ext = os.path.splitext(name)
+            if ext in FINGERPRINTED:
+                fingerprints[name] = f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+
+        files: Dict[str, Tuple[Asset, str]] = {}
+        for name, body in sources.items():
+            if name.endswith(".html"):
+                body = self.rewrite(body.decode("utf-8"), fingerprints).encode("utf-8")
+            asset = Asset(body, mimetypes.guess_type(name)[0] or "application/octet-stream")
+            files[name] = (asset, REVALIDATE)
+            if name in fingerprints:
+                files[fingerprints[name]] = (asset, IMMUTABLE)
+
+        self._files = files
+        self.fingerprints = fingerprints
+        self.built = True
+        logger.info(f"Built {len(sources)} static assets ({len(fingerprints)} fingerprinted) from {self.directory}")
+
+    @staticmethod
+    def rewrite(html: str, fingerprints: Dict[str, str]) -> str:
+        """Points ``/static/<name>`` references (with or without a ``?v=`` buster) at the hashed names."""
+        for name, hashed in fingerprints.items():
+            html = re.sub(rf"/static/{re.escape(name)}(\?[^\"'\s>]*)?", f"/static/{hashed}", html)
+        return html
+
+    def get(self, name: str) -> Optional[Tuple[Asset, str]]:
+        """Returns the asset and its Cache-Control value, or None if there is no such file."""
+        if not self.built:
+            self.build()
+        return self._files.get(name)
@@ -0,0 +1,411 @@
+import asyncio
+import importlib
+import json
+import math
+import random
+import sys
+import time
+from types import ModuleType
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from src.config import settings
+from src.metrics import metrics
+from src.startup import startup
+from src.utils import estimate_tokens
+
+# Simple safety settings
+SAFETY_SETTINGS = {
+    "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
+    "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
+    "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
+}
+
+# History is exchanged in Gemini's wire format: [{"role": "user"|"model", "parts": [text]}]
+History = List[Dict[str, Any]]
+
+
+def import_provider(module: str) -> ModuleType:
+    """Imports a provider SDK on first use and records how long that took.
+
+    SDKs are only imported by the backend that needs them, so importing the
+    app (and running offline) never pays for, e.g., google.generativeai.
+    """
+    if module in sys.modules:
+        return sys.modules[module]
+    with startup.timed(f"import:{module}"):
+        return importlib.import_module(module)
+
+
+class MissingAPIKeyError(ValueError):
+    """Raised when no API key was supplied and none is configured for the provider."""
+
+
+class ModelBackend:
+    """Interface between CustomerSupportAgent and an LLM provider."""
+
+    name = "base"
+    model_name = "unknown"
+
+    def send(self, history: History, message: str) -> str:
+        """Sends a chat message after ``history`` and returns the full reply."""
+        raise NotImplementedError
+
+    async def send_async(self, history: History, message: str, timeout: Optional[float] = None) -> str:
+        """Async ``send``; ``timeout`` (seconds) bounds the provider call (None = provider default)."""
+        raise NotImplementedError
+
+    def stream_async(self, history: History, message: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Yields the reply to a chat message in chunks as they are generated; ``timeout`` bounds the provider call."""
+        raise NotImplementedError
+
+    def generate(self, prompt: str) -> str:
+        """Single-shot (history-free) generation."""
+        raise NotImplementedError
+
+    async def generate_async(self, prompt: str, timeout: Optional[float] = None) -> str:
+        raise NotImplementedError
+
+    async def warm_up(self):
+        """Opens the provider connection ahead of the first real request (no-op by default)."""
+
+
+class GeminiBackend(ModelBackend):
+    """Google Gemini via the google-generativeai SDK.
+
+    ``start_chat`` and ``send_message`` are timed as separate stages, and the
+    token counts Gemini reports in ``usage_metadata`` are recorded. Async
+    calls pass their timeout to the SDK as a per-request deadline.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, system_instruction: str, model_name: Optional[str] = None):
+        genai = import_provider("google.generativeai")
+        self._glm = import_provider("google.ai.generativelanguage")
+        self.model_name = model_name or settings.GEMINI_MODEL
+        self.model = genai.GenerativeModel(
+            model_name=self.model_name,
+            system_instruction=system_instruction
+        )
+        # Give the model its own clients instead of calling the process-global
+        # genai.configure(), so backends with different keys never race each other
+        self._client_options = {"api_key": api_key}
+        self.model._client = self._glm.GenerativeServiceClient(client_options=self._client_options)
+
+    def _ensure_async_client(self):
+        """Creates the async client on first use (it must be built inside a running loop)."""
+        if self.model._async_client is None:
+            self.model._async_client = self._glm.GenerativeServiceAsyncClient(client_options=self._client_options)
+
+    def _start_chat(self, history: History):
+        with metrics.span("start_chat", operation="upstream", provider=self.name):
+            return self.model.start_chat(history=history)
+
+    @staticmethod
+    def _request_options(timeout: Optional[float]) -> Optional[Dict[str, float]]:
+        return {"timeout": timeout} if timeout else None
+
+    def _record_usage(self, response: Any):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            metrics.record_tokens(self.name, usage.prompt_token_count, usage.candidates_token_count)
+
+    def send(self, history: History, message: str) -> str:
+        chat = self._start_chat(history)
+        with metrics.span("send_message", operation="upstream", provider=self.name):
+            response = chat.send_message(message, safety_settings=SAFETY_SETTINGS)
+        self._record_usage(response)
+        return response.text
+
+    async def send_async(self, history: History, message: str, timeout: Optional[float] = None) -> str:
+        self._ensure_async_client()
+        chat = self._start_chat(history)
+        with metrics.span("send_message", operation="upstream", provider=self.name):
+            response = await chat.send_message_async(
+                message, safety_settings=SAFETY_SETTINGS, request_options=self._request_options(timeout)
+            )
+        self._record_usage(response)
+        return response.text
+
+    async def stream_async(self, history: History, message: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        self._ensure_async_client()
+        chat = self._start_chat(history)
+        with metrics.span("send_message", operation="upstream", provider=self.name):
+            response = await chat.send_message_async(
+                message, safety_settings=SAFETY_SETTINGS, stream=True, request_options=self._request_options(timeout)
+            )
+        async for chunk in response:
+            yield chunk.text
+        # The final usage counts are only known once the stream is exhausted
+        self._record_usage(response)
+
+    def generate(self, prompt: str) -> str:
+        with metrics.span("generate_content", operation="upstream", provider=self.name):
+            response = self.model.generate_content(prompt)
+        self._record_usage(response)
+        return response.text
+
+    async def generate_async(self, prompt: str, timeout: Optional[float] = None) -> str:
+        self._ensure_async_client()
+        with metrics.span("generate_content", operation="upstream", provider=self.name):
+            response = await self.model.generate_content_async(
+                prompt, request_options=self._request_options(timeout)
+            )
+        self._record_usage(response)
+        return response.text
+
+    async def warm_up(self):
+        # count_tokens is free and goes over the same channel as generation
+        self._ensure_async_client()
+        await self.model.count_tokens_async("ping")
+
+
+class GroqBackend(ModelBackend):
+    """Groq-hosted models via the groq SDK (OpenAI-style chat completions)."""
+
+    name = "groq"
+
+    def __init__(self, api_key: str, system_instruction: str, model_name: Optional[str] = None):
+        self.model_name = model_name or settings.GROQ_MODEL
+        self.system_instruction = system_instruction
+        groq = import_provider("groq")
+        self.client = groq.Groq(api_key=api_key)
+        # Async calls are retried by the agent within the request deadline, not by the SDK
+        self.async_client = groq.AsyncGroq(api_key=api_key, max_retries=0)
+
+    def _messages(self, history: History, message: str) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": self.system_instruction}]
+        for turn in history:
+            role = "user" if turn["role"] == "user" else "assistant"
+            messages.append({"role": role, "content": turn["parts"][0]})
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def _record_usage(self, completion: Any):
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            metrics.record_tokens(self.name, usage.prompt_tokens, usage.completion_tokens)
+
+    def send(self, history: History, message: str) -> str:
+        with metrics.span("completion", operation="upstream", provider=self.name):
+            completion = self.client.chat.completions.create(
+                model=self.model_name, messages=self._messages(history, message)
+            )
+        self._record_usage(completion)
+        return completion.choices[0].message.content or ""
+
+    async def send_async(self, history: History, message: str, timeout: Optional[float] = None) -> str:
+        # The SDK treats timeout=None as "no timeout", so it is only passed when set
+        options = {"timeout": timeout} if timeout else {}
+        with metrics.span("completion", operation="upstream", provider=self.name):
+            completion = await self.async_client.chat.completions.create(
+                model=self.model_name, messages=self._messages(history, message), **options
+            )
+        self._record_usage(completion)
+        return completion.choices[0].message.content or ""
+
+    async def stream_async(self, history: History, message: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        messages = self._messages(history, message)
+        options = {"timeout": timeout} if timeout else {}
+        with metrics.span("completion", operation="upstream", provider=self.name):
+            stream = await self.async_client.chat.completions.create(
+                model=self.model_name, messages=messages, stream=True, **options
+            )
+        chunks = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                chunks.append(delta)
+                yield delta
+        # Streamed completions carry no usage block, so the counts are estimated
+        metrics.record_tokens(
+            self.name, sum(estimate_tokens(m["content"]) for m in messages), estimate_tokens("".join(chunks))
+        )
+
+    def generate(self, prompt: str) -> str:
+        return self.send([], prompt)
+
+    async def generate_async(self, prompt: str, timeout: Optional[float] = None) -> str:
+        return await self.send_async([], prompt, timeout=timeout)
+
+    async def warm_up(self):
+        # Listing models is free and leaves a pooled HTTPS connection open
+        await self.async_client.models.list()
+
+
+class FakeBackendError(RuntimeError):
+    """Injected upstream failure raised by FakeBackend."""
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Parses a latency distribution spec into a sampler (seconds).
+
+    Supported forms: ``none``, ``fixed:S``, ``uniform:LO,HI``, ``normal:MEAN,STD``
+    and ``lognormal:MEDIAN,SIGMA``.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()]
+    kind = kind.strip().lower()
+    if kind in ("", "none"):
+        return lambda rng: 0.0
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+FAKE_PROFILE = {
+    "name": "Test Customer",
+    "email": "customer@example.com",
+    "recent_order": {"item": "Noise-cancelling headphones", "status": "Shipped"},
+    "past_orders": ["USB-C hub", "Mechanical keyboard"],
+    "support_interactions": ["Asked about warranty", "Requested a return label"],
+}
+
+
+class FakeBackend(ModelBackend):
+    """Deterministic offline stand-in for an LLM provider.
+
+    Used for tests and benchmarks. Replies are either echoes of the message or
+    canned responses matched by substring, and prompts that ask for JSON get
+    a fixed customer profile (one per ID for batched profile prompts).
+    Latency is sampled from a configurable distribution, and ``error_rate``
+    injects failures. Calls are counted in ``calls`` (with concurrency in
+    ``in_flight``/``peak_in_flight``), the last chat history and timeout are
+    kept in ``last_history``/``last_timeout``, and token usage is estimated.
+    """
+
+    name = "fake"
+    model_name = "fake"
+
+    def __init__(
+        self,
+        latency: str = "none",
+        error_rate: float = 0.0,
+        mode: str = "echo",
+        responses: Optional[Dict[str, str]] = None,
+        seed: Optional[int] = 0,
+        chunk_size: int = 16,
+        chunk_delay: float = 0.0,
+    ):
+        self._sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.mode = mode
+        self.responses = responses or {}
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.last_history: History = []
+        self.last_timeout: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls) -> "FakeBackend":
+        return cls(
+            latency=settings.FAKE_LLM_LATENCY,
+            error_rate=settings.FAKE_LLM_ERROR_RATE,
+            mode=settings.FAKE_LLM_MODE,
+            seed=settings.FAKE_LLM_SEED,
+        )
+
+    def _reply(self, message: str) -> str:
+        for trigger, response in self.responses.items():
+            if trigger.lower() in message.lower():
+                return response
+        if "keyed by customer ID" in message:
+            ids = message.split("IDs:", 1)[1].splitlines()[0]
+            return json.dumps({user_id.strip(): dict(FAKE_PROFILE) for user_id in ids.split(",")})
+        if "JSON" in message:
+            return json.dumps(FAKE_PROFILE)
+        if self.mode == "canned":
+            return "Thanks for reaching out! Your request has been noted. Is there anything else I can help with?"
+        return f"You said: {message}. How else can I help?"
+
+    def _begin(self, history: Optional[History] = None) -> float:
+        """Records the call and returns the sampled latency, or raises an injected error."""
+        self.calls += 1
+        if history is not None:
+            self.last_history = list(history)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise FakeBackendError("503 Service Unavailable (injected by FakeBackend)")
+        return self._sample_latency(self._rng)
+
+    def _usage(self, history: History, message: str, reply: str) -> str:
+        """Records estimated token counts, as a real provider would report them."""
+        prompt_tokens = estimate_tokens(message) + sum(estimate_tokens(turn["parts"][0]) for turn in history)
+        metrics.record_tokens(self.name, prompt_tokens, estimate_tokens(reply))
+        return reply
+
+    def send(self, history: History, message: str) -> str:
+        time.sleep(self._begin(history))
+        return self._usage(history, message, self._reply(message))
+
+    async def _wait(self, delay: float):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+
+    async def send_async(self, history: History, message: str, timeout: Optional[float] = None) -> str:
+        self.last_timeout = timeout
+        await self._wait(self._begin(history))
+        return self._usage(history, message, self._reply(message))
+
+    async def stream_async(self, history: History, message: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        self.last_timeout = timeout
+        await self._wait(self._begin(history))
+        reply = self._usage(history, message, self._reply(message))
+        for start in range(0, len(reply), self.chunk_size):
+            if start and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield reply[start:start + self.chunk_size]
+
+    def generate(self, prompt: str) -> str:
+        time.sleep(self._begin())
+        return self._usage([], prompt, self._reply(prompt))
+
+    async def generate_async(self, prompt: str, timeout: Optional[float] = None) -> str:
+        self.last_timeout = timeout
+        await self._wait(self._begin())
+        return self._usage([], prompt, self._reply(prompt))
+
+
+def create_backend(api_key: Optional[str], system_instruction: str) -> ModelBackend:
+    """Builds the backend selected by ``settings.LLM_BACKEND`` / ``settings.LLM_PROVIDERS``.
+
+    With more than one configured provider the result is a ProviderRouter that
+    fails over, hedges and circuit-breaks between them.
+    """
+    if settings.LLM_BACKEND == "fake":
+        return FakeBackend.from_settings()
+
+    backends: List[ModelBackend] = []
+    for provider in (p.strip().lower() for p in settings.LLM_PROVIDERS.split(",")):
+        if provider == "gemini":
+            key = api_key or settings.GOOGLE_API_KEY
+            if key:
+                backends.append(GeminiBackend(api_key=key, system_instruction=system_instruction))
+        elif provider == "groq":
+            if settings.GROQ_API_KEY:
+                backends.append(GroqBackend(api_key=settings.GROQ_API_KEY, system_instruction=system_instruction))
+        elif provider:
+            raise ValueError(f"Unknown LLM provider: {provider}")
+
+    if not backends:
+        raise MissingAPIKeyError("Google API Key is required for Gemini.")
+    if len(backends) == 1:
+        return backends[0]
+
+    from src.router import ProviderRouter
+    return ProviderRouter(backends)
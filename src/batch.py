@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+from src.config import settings
+from src.sketches import LatencyHistogram
+
+# Answers one record; receives the whole record so callers can read extra fields (e.g. api_key)
+Answerer = Callable[[Dict[str, Any]], Awaitable[str]]
+
+_DONE = object()
+
+
+class BatchReplay:
+    """Replays a stream of ``{user_id, query}`` records with bounded parallelism.
+
+    Up to ``concurrency`` records are answered at once, but never two for the
+    same user, so each user's turns run in input order and see the history
+    their earlier turns built. Users with waiting turns are served
+    round-robin. Input is read as it arrives and at most ``max_pending``
+    records are held at a time, queued or answered but not yet taken by the
+    consumer, so a replay of any size runs in bounded memory even when the
+    consumer is slower than the workers. Results are yielded as they complete (not in input order; each
+    carries its input ``index``), followed by one ``stats`` record.
+    """
+
+    def __init__(self, answer: Answerer, concurrency: Optional[int] = None, max_pending: Optional[int] = None):
+        self.answer = answer
+        self.concurrency = max(1, concurrency or settings.BATCH_CONCURRENCY)
+        self.max_pending = max(self.concurrency, max_pending or settings.BATCH_MAX_PENDING)
+
+        self._turns: Dict[str, Deque[Tuple[int, Dict[str, Any]]]] = {}
+        self._ready: Deque[str] = deque()
+        self._busy: Set[str] = set()
+        self._changed = asyncio.Condition()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        # Every held record owns a slot, so the queue never holds more than max_pending results (+ _DONE)
+        self._results: asyncio.Queue = asyncio.Queue(self.max_pending + 1)
+        self._reading = True
+
+        self.records = 0
+        self.errors = 0
+        self.users: Set[str] = set()
+        self.latencies = LatencyHistogram()
+
+    async def run(self, records: AsyncIterable[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        started = time.perf_counter()
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        reader = asyncio.ensure_future(self._read(records))
+        finisher = asyncio.ensure_future(self._finish(reader, workers))
+        try:
+            while True:
+                result = await self._results.get()
+                if result is _DONE:
+                    break
+                self._slots.release()
+                yield result
+            # Surfaces a failure to read the input
+            await finisher
+        finally:
+            # The consumer may stop early (e.g. the client disconnected)
+            for task in [reader, finisher, *workers]:
+                task.cancel()
+            await asyncio.gather(reader, finisher, *workers, return_exceptions=True)
+        yield self.stats(time.perf_counter() - started)
+
+    async def _read(self, records: AsyncIterable[Dict[str, Any]]):
+        index = 0
+        try:
+            async for record in records:
+                await self._slots.acquire()
+                user_id = record.get("user_id") if isinstance(record, dict) else None
+                query = record.get("query") if isinstance(record, dict) else None
+                if not user_id or not query:
+                    self._emit({"type": "error", "index": index, "error": "Each record needs a user_id and a query"})
+                    index += 1
+                    continue
+                user_id = str(user_id)
+                async with self._changed:
+                    self._turns.setdefault(user_id, deque()).append((index, record))
+                    if user_id not in self._busy and user_id not in self._ready:
+                        self._ready.append(user_id)
+                    self._changed.notify()
+                index += 1
+        finally:
+            async with self._changed:
+                self._reading = False
+                self._changed.notify_all()
+
+    async def _worker(self):
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self._ready or not (self._reading or self._busy))
+                if not self._ready:
+                    return
+                user_id = self._ready.popleft()
+                self._busy.add(user_id)
+                index, record = self._turns[user_id].popleft()
+
+            start = time.perf_counter()
+            try:
+                response = await self.answer(record)
+                result = {"type": "result", "index": index, "user_id": user_id, "query": record["query"],
+                          "response": response}
+            except Exception as e:
+                result = {"type": "error", "index": index, "user_id": user_id, "query": record["query"],
+                          "error": str(e)}
+            latency = time.perf_counter() - start
+            result["latency"] = round(latency, 4)
+            self.latencies.record(latency)
+            self.users.add(user_id)
+            self._emit(result)
+
+            async with self._changed:
+                self._busy.discard(user_id)
+                if self._turns[user_id]:
+                    self._ready.append(user_id)
+                else:
+                    del self._turns[user_id]
+                self._changed.notify_all()
+
+    async def _finish(self, reader: asyncio.Task, workers):
+        try:
+            await asyncio.gather(*workers)
+            await reader
+        finally:
+            self._results.put_nowait(_DONE)
+
+    def _emit(self, result: Dict[str, Any]):
+        self.records += 1
+        if result["type"] == "error":
+            self.errors += 1
+        self._results.put_nowait(result)
+
+    def stats(self, elapsed: float) -> Dict[str, Any]:
+        percentiles = self.latencies.percentiles()
+        return {
+            "type": "stats",
+            "records": self.records,
+            "errors": self.errors,
+            "users": len(self.users),
+            "concurrency": self.concurrency,
+            "elapsed": round(elapsed, 3),
+            "throughput_rps": round(self.records / elapsed, 1) if elapsed else 0.0,
+            "p50_latency": round(percentiles["p50"], 4),
+            "p95_latency": round(percentiles["p95"], 4),
+            "p99_latency": round(percentiles["p99"], 4),
+        }
@@ -0,0 +1,91 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from src.config import settings
+
+_BENGALI = re.compile(r"[ঀ-৿]")
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def detect_language(text: str) -> str:
+    """Returns "bn" if the text contains Bengali script, otherwise "en"."""
+    return "bn" if _BENGALI.search(text) else "en"
+
+
+def normalize_query(text: str) -> str:
+    """Case-folds and strips punctuation/extra whitespace so trivial variants share a key."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class ResponseCache:
+    """TTL + size-bounded LRU cache for stateless first-turn answers.
+
+    Keys combine the normalized query, its detected language and a namespace
+    identifying the model and prompt version, so changing either invalidates
+    old answers.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries or settings.RESPONSE_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.RESPONSE_CACHE_TTL
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(namespace: str, query: str) -> Tuple[str, str, str]:
+        return (namespace, detect_language(query), normalize_query(query))
+
+    def get(self, namespace: str, query: str) -> Optional[str]:
+        key = self.key(namespace, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            response, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def set(self, namespace: str, query: str, response: str):
+        key = self.key(namespace, query)
+        if not key[2]:
+            return
+        with self._lock:
+            self._entries[key] = (response, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -16,6 +16,116 @@ class Settings(BaseSettings):
     # Gemini Configuration
     GOOGLE_API_KEY: str = os.getenv("GOOGLE_API_KEY", "")
     GEMINI_MODEL: str = "models/gemini-flash-latest"
+
+    # LLM backend: "gemini", or "fake" for offline tests and benchmarks
+    LLM_BACKEND: str = os.getenv("LLM_BACKEND", "gemini")
+    FAKE_LLM_LATENCY: str = os.getenv("FAKE_LLM_LATENCY", "lognormal:0.4,0.5")
+    FAKE_LLM_ERROR_RATE: float = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+    FAKE_LLM_MODE: str = os.getenv("FAKE_LLM_MODE", "echo")
+    FAKE_LLM_SEED: int = int(os.getenv("FAKE_LLM_SEED", "0"))
+
+    # Provider routing: comma-separated, in order of preference (e.g. "gemini,groq")
+    LLM_PROVIDERS: str = os.getenv("LLM_PROVIDERS", "gemini")
+    ROUTER_EWMA_ALPHA: float = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))
+    ROUTER_HEDGE_ENABLED: bool = os.getenv("ROUTER_HEDGE_ENABLED", "true").lower() == "true"
+    ROUTER_HEDGE_MIN_SAMPLES: int = int(os.getenv("ROUTER_HEDGE_MIN_SAMPLES", "20"))
+    ROUTER_FAILURE_THRESHOLD: int = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "5"))
+    ROUTER_COOLDOWN: float = float(os.getenv("ROUTER_COOLDOWN", "30"))
+
+    # Upstream concurrency (max in-flight LLM calls per agent)
+    MAX_UPSTREAM_CONCURRENCY: int = int(os.getenv("MAX_UPSTREAM_CONCURRENCY", "32"))
+
+    # Request deadlines (seconds; clients may ask for less or more via X-Request-Timeout, up to the max)
+    REQUEST_TIMEOUT: float = float(os.getenv("REQUEST_TIMEOUT", "30"))
+    REQUEST_TIMEOUT_MAX: float = float(os.getenv("REQUEST_TIMEOUT_MAX", "120"))
+    # Failed upstream calls are retried with jittered exponential backoff while the deadline allows
+    UPSTREAM_MAX_RETRIES: int = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+    UPSTREAM_RETRY_BASE_DELAY: float = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.25"))
+    UPSTREAM_RETRY_MAX_DELAY: float = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "2"))
+
+    # Admission control in front of the upstream model (USER_RATE 0 disables per-user limits)
+    ADMISSION_MAX_CONCURRENCY: int = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+    ADMISSION_USER_RATE: float = float(os.getenv("ADMISSION_USER_RATE", "1.0"))
+    ADMISSION_USER_BURST: float = float(os.getenv("ADMISSION_USER_BURST", "10"))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+    # Response cache for stateless first-turn questions (opt-in)
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+    # Synthetic profiles: "llm" (the configured backend) or "local" (seeded, offline)
+    PROFILE_GENERATOR: str = os.getenv("PROFILE_GENERATOR", "llm")
+    PROFILE_SEED: int = int(os.getenv("PROFILE_SEED", "0"))
+    PROFILE_CACHE_MAX_ENTRIES: int = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+    PROFILE_CACHE_TTL: float = float(os.getenv("PROFILE_CACHE_TTL", "86400"))
+    PROFILE_BULK_MAX: int = int(os.getenv("PROFILE_BULK_MAX", "10000"))
+    PROFILE_PROMPT_BATCH: int = int(os.getenv("PROFILE_PROMPT_BATCH", "10"))
+
+    # Build the default agent and open its provider connections at startup (/readyz waits for it)
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+
+    # Agent pool (one agent per API key)
+    AGENT_POOL_SIZE: int = int(os.getenv("AGENT_POOL_SIZE", "16"))
+    AGENT_POOL_IDLE_TTL: float = float(os.getenv("AGENT_POOL_IDLE_TTL", "1800"))
+
+    # Conversation memory bounds
+    CONVERSATION_MAX_TURNS: int = int(os.getenv("CONVERSATION_MAX_TURNS", "50"))
+    CONVERSATION_IDLE_TTL: float = float(os.getenv("CONVERSATION_IDLE_TTL", "86400"))
+    CONVERSATION_MAX_BYTES: int = int(os.getenv("CONVERSATION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+    # Prompt context (token budget for profile + summary + recent turns)
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+    SUMMARY_MIN_TURNS: int = int(os.getenv("SUMMARY_MIN_TURNS", "4"))
+
+    # Analytics interaction log (in-memory ring + on-disk segments)
+    ANALYTICS_RING_CAPACITY: int = int(os.getenv("ANALYTICS_RING_CAPACITY", "10000"))
+    ANALYTICS_SEGMENT_DIR: str = os.getenv("ANALYTICS_SEGMENT_DIR", "data/analytics")
+    ANALYTICS_SEGMENT_MAX_BYTES: int = int(os.getenv("ANALYTICS_SEGMENT_MAX_BYTES", str(16 * 1024 * 1024)))
+    ANALYTICS_MAX_SEGMENTS: int = int(os.getenv("ANALYTICS_MAX_SEGMENTS", "32"))
+    ANALYTICS_MAX_TEXT_LENGTH: int = int(os.getenv("ANALYTICS_MAX_TEXT_LENGTH", "500"))
+    # Seconds between background writes of spilled interactions to the segment files
+    ANALYTICS_SPILL_INTERVAL: float = float(os.getenv("ANALYTICS_SPILL_INTERVAL", "1.0"))
+
+    # Time-series rollups: seconds of minute, hour and day buckets kept before downsampling/dropping
+    ANALYTICS_MINUTE_RETENTION: float = float(os.getenv("ANALYTICS_MINUTE_RETENTION", str(24 * 3600)))
+    ANALYTICS_HOUR_RETENTION: float = float(os.getenv("ANALYTICS_HOUR_RETENTION", str(30 * 86400)))
+    ANALYTICS_DAY_RETENTION: float = float(os.getenv("ANALYTICS_DAY_RETENTION", str(365 * 86400)))
+    ANALYTICS_TIMESERIES_MAX_POINTS: int = int(os.getenv("ANALYTICS_TIMESERIES_MAX_POINTS", "2000"))
+
+    # Top users tracking: "exact" or "approximate" (Space-Saving, bounded memory)
+    TOP_USERS_MODE: str = os.getenv("TOP_USERS_MODE", "exact")
+    TOP_USERS_CAPACITY: int = int(os.getenv("TOP_USERS_CAPACITY", "1000"))
+
+    # Shared state across workers/replicas: "memory" (per process), "sqlite" or "redis"
+    STATE_BACKEND: str = os.getenv("STATE_BACKEND", "memory")
+    STATE_SQLITE_PATH: str = os.getenv("STATE_SQLITE_PATH", "data/state.db")
+    STATE_REDIS_URL: str = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+    STATE_FLUSH_INTERVAL: float = float(os.getenv("STATE_FLUSH_INTERVAL", "0.05"))
+    STATE_FLUSH_BATCH: int = int(os.getenv("STATE_FLUSH_BATCH", "256"))
+    STATE_CACHE_TTL: float = float(os.getenv("STATE_CACHE_TTL", "1.0"))
+
+    # Batch replay (/chat/batch and replay.py): users answered in parallel, records held in memory
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "8"))
+    BATCH_MAX_CONCURRENCY: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "64"))
+    BATCH_MAX_PENDING: int = int(os.getenv("BATCH_MAX_PENDING", "1000"))
+
+    # Voice sessions: seconds an interim transcript must hold before a reply is generated speculatively
+    VOICE_STABLE_AFTER: float = float(os.getenv("VOICE_STABLE_AFTER", "0.35"))
+    VOICE_MAX_SPECULATIONS: int = int(os.getenv("VOICE_MAX_SPECULATIONS", "2"))
+
+    # Opt-in request profiling (cProfile); requests send "X-Profile: 1" or are sampled
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILING_SAMPLE_RATE: float = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+    PROFILING_DIR: str = os.getenv("PROFILING_DIR", "data/profiles")
+
+    # Static console assets (fingerprinted and precompressed in memory at startup)
+    STATIC_DIR: str = os.getenv("STATIC_DIR", "static")
+
+    # Snapshots of in-process conversations and analytics ("" disables)
+    SNAPSHOT_PATH: str = os.getenv("SNAPSHOT_PATH", "data/snapshot.bin")
+    SNAPSHOT_INTERVAL: float = float(os.getenv("SNAPSHOT_INTERVAL", "300"))
     
     class Config:
         env_file = ".env"
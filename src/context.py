@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.admission import AdmissionController
+from src.config import settings
+from src.memory import ContextWindow, ConversationStore
+from src.utils import logger
+
+# Receives the previous summary and the turns to fold into it; returns the new summary
+Summarizer = Callable[[str, List[Dict[str, Any]]], Awaitable[str]]
+
+
+class ContextBuilder:
+    """Builds token-bounded prompt history and keeps a rolling summary of older turns.
+
+    Each request gets the profile, the current summary and as many recent turns
+    as fit in ``token_budget``. Turns that fall out of the window are folded
+    into the summary by a background task, off the request path. At most one
+    refresh runs per user, across every builder sharing the store, and with
+    ``admission`` it takes a rate-limited, queued upstream slot like any
+    request for that user (a rejected refresh is retried on a later turn).
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        summarize: Summarizer,
+        token_budget: Optional[int] = None,
+        min_summary_turns: Optional[int] = None,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.store = store
+        self.summarize = summarize
+        self.token_budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+        self.min_summary_turns = min_summary_turns or settings.SUMMARY_MIN_TURNS
+        self.admission = admission
+        # Kept on the store so pooled agents (one per API key) never summarize the same user at once
+        self._pending: Dict[str, asyncio.Task] = store.summary_tasks
+
+    def build(self, user_id: str) -> List[Dict[str, Any]]:
+        """Returns the Gemini history for the next request."""
+        window = self.store.context_window(user_id, self.token_budget)
+        if len(window.overflow) >= self.min_summary_turns:
+            self._schedule_summary(user_id, window)
+        return window.history
+
+    def _schedule_summary(self, user_id: str, window: ContextWindow):
+        if user_id in self._pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Sync callers have no loop to run on; the next async request will refresh
+            return
+        self._pending[user_id] = loop.create_task(self._refresh_summary(user_id, window))
+
+    async def _refresh_summary(self, user_id: str, window: ContextWindow):
+        try:
+            if self.admission is None:
+                summary = await self.summarize(window.summary, window.overflow)
+            else:
+                self.admission.check(user_id)
+                async with self.admission.slot(user_id):
+                    summary = await self.summarize(window.summary, window.overflow)
+            self.store.set_summary(user_id, summary, window.overflow_upto)
+            logger.info(f"Refreshed conversation summary for user {user_id}")
+        except Exception as e:
+            logger.warning(f"Summary refresh failed for user {user_id}: {e}")
+        finally:
+            self._pending.pop(user_id, None)
+
+    async def wait_pending(self):
+        """Waits for in-flight summary refreshes (used by tests and shutdown)."""
+        if self._pending:
+            await asyncio.gather(*self._pending.values(), return_exceptions=True)
@@ -0,0 +1,133 @@
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from src.config import settings
+from src.metrics import metrics
+from src.utils import logger
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's time budget runs out before its upstream work completes."""
+
+
+class RequestAborted(Exception):
+    """Raised when a request is given up on before it is answered.
+
+    ``reason`` is "timeout" (status 504) when its deadline passed and
+    "cancelled" (status 499, never seen by anyone) when the client disconnected.
+    """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = 504 if reason == "timeout" else 499
+
+
+class Deadline:
+    """Absolute time budget for one request, carried down to the provider calls it makes."""
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = settings.REQUEST_TIMEOUT if timeout is None else timeout
+        self.expires_at = time.monotonic() + self.timeout
+
+    @classmethod
+    def from_header(cls, value: Optional[str]) -> "Deadline":
+        """Builds a deadline from an ``X-Request-Timeout`` header (seconds), capped at REQUEST_TIMEOUT_MAX."""
+        try:
+            timeout = float(value) if value else None
+        except ValueError:
+            timeout = None
+        if timeout is None or timeout <= 0:
+            return cls()
+        return cls(min(timeout, settings.REQUEST_TIMEOUT_MAX))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def exceeded(self) -> DeadlineExceeded:
+        return DeadlineExceeded(f"Request exceeded its {self.timeout:g}s deadline")
+
+
+def is_retryable(error: Exception) -> bool:
+    """Auth failures and exhausted deadlines fail the same way every time; anything else may be transient."""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    message = str(error)
+    return not ("401" in message or "403" in message or "API_KEY_INVALID" in message)
+
+
+async def call_with_retries(
+    call: Callable[[float], Awaitable[T]],
+    deadline: Deadline,
+    max_retries: Optional[int] = None,
+    base_delay: Optional[float] = None,
+    max_delay: Optional[float] = None,
+    rng: Optional[random.Random] = None,
+) -> T:
+    """Runs ``call(timeout)`` within ``deadline``, retrying failures with jittered backoff.
+
+    Each attempt gets the remaining budget as its timeout. A failed attempt is
+    retried after a full-jitter exponential backoff (uniform between 0 and
+    ``base_delay * 2**attempt``, capped at ``max_delay``), but only if the
+    budget outlasts the backoff; otherwise the failure is raised. Running out
+    of budget raises DeadlineExceeded.
+    """
+    max_retries = settings.UPSTREAM_MAX_RETRIES if max_retries is None else max_retries
+    base_delay = settings.UPSTREAM_RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = settings.UPSTREAM_RETRY_MAX_DELAY if max_delay is None else max_delay
+
+    attempt = 0
+    while True:
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise deadline.exceeded()
+        try:
+            return await asyncio.wait_for(call(remaining), remaining)
+        except asyncio.TimeoutError:
+            raise deadline.exceeded()
+        except Exception as e:
+            if deadline.expired:
+                # The provider's own timeout fired (it was given the remaining budget)
+                raise deadline.exceeded() from e
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = (rng or random).uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if delay >= deadline.remaining():
+                raise
+            attempt += 1
+            metrics.inc("omniserve_upstream_retries_total")
+            logger.warning(f"Upstream call failed ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def within_deadline(source: AsyncIterator[T], deadline: Deadline) -> AsyncIterator[T]:
+    """Yields ``source``'s items, raising DeadlineExceeded if the next one is not ready before ``deadline``.
+
+    ``source`` is closed on the way out, so its upstream call does not outlive
+    the request whether it finished, failed, timed out or was abandoned.
+    """
+    iterator = source.__aiter__()
+    try:
+        while True:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise deadline.exceeded()
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), remaining)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise deadline.exceeded()
+            yield item
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
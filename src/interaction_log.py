@@ -0,0 +1,299 @@
+import asyncio
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from src.config import settings
+from src.utils import logger
+
+# Each on-disk record is a JSON payload followed by its length, so segments can be
+# read newest-first by walking backwards from the end of the file
+_LENGTH = struct.Struct("<I")
+
+
+def _intact_before(view: mmap.mmap, end: int) -> bool:
+    """Whether a complete record (JSON object + its length) ends exactly at ``end``."""
+    (length,) = _LENGTH.unpack_from(view, end - _LENGTH.size)
+    start = end - _LENGTH.size - length
+    if start < 0 or length < 2 or view[start] != ord("{") or view[end - _LENGTH.size - 1] != ord("}"):
+        return False
+    try:
+        json.loads(view[start:end - _LENGTH.size])
+    except ValueError:
+        return False
+    return True
+
+
+class InteractionLog:
+    """Fixed-size in-memory ring of interactions with spill to on-disk segments.
+
+    Numeric fields live in typed ``array`` columns; text fields are truncated to
+    ``max_text_length`` characters. When the ring is full, the record about to
+    be overwritten is queued for the current segment file under ``segment_dir``
+    (if configured), so memory use stays flat however long the process runs.
+    Queued records are written by ``flush``, which ``run_writer`` calls from a
+    worker thread, so appends never touch the disk. Segments left by earlier
+    processes are counted and read back like this process's own; a record
+    torn by a crash mid-write is cut off when its segment is first opened.
+    Reads that may reach the disk (``recent``, ``spilled``) block on the
+    writer, so async callers run them in a worker thread.
+    """
+
+    def __init__(
+        self,
+        capacity: Optional[int] = None,
+        segment_dir: Optional[str] = None,
+        segment_max_bytes: Optional[int] = None,
+        max_segments: Optional[int] = None,
+        max_text_length: Optional[int] = None,
+        write_interval: Optional[float] = None,
+    ):
+        self.capacity = capacity or settings.ANALYTICS_RING_CAPACITY
+        self.segment_dir = segment_dir if segment_dir is not None else settings.ANALYTICS_SEGMENT_DIR
+        self.segment_max_bytes = segment_max_bytes or settings.ANALYTICS_SEGMENT_MAX_BYTES
+        self.max_segments = max_segments or settings.ANALYTICS_MAX_SEGMENTS
+        self.max_text_length = max_text_length or settings.ANALYTICS_MAX_TEXT_LENGTH
+        self.write_interval = write_interval if write_interval is not None else settings.ANALYTICS_SPILL_INTERVAL
+
+        # Columnar ring storage
+        self.timestamps = array("d", bytes(8 * self.capacity))
+        self.response_times = array("d", bytes(8 * self.capacity))
+        self.query_lengths = array("L", bytes(array("L").itemsize * self.capacity))
+        self.response_lengths = array("L", bytes(array("L").itemsize * self.capacity))
+        self.user_ids: List[Optional[str]] = [None] * self.capacity
+        self.queries: List[Optional[str]] = [None] * self.capacity
+        self.responses: List[Optional[str]] = [None] * self.capacity
+
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+        # Records evicted from the ring that are not on disk yet, oldest first
+        self._unwritten: List[Dict] = []
+        self.dropped = 0
+        # Guards the segment files and their record counts; taken before ``_lock``
+        self._io_lock = threading.Lock()
+        self._segment = None
+        self._segment_index: Optional[int] = None
+        # Records per segment file, counted from disk on first use
+        self._segment_counts: Optional[Dict[int, int]] = None
+
+    @property
+    def spilled(self) -> int:
+        """Records that have left the ring but are still kept, on disk or waiting to be written."""
+        with self._io_lock:
+            on_disk = sum(self._counts().values())
+        with self._lock:
+            return on_disk + len(self._unwritten)
+
+    def __len__(self) -> int:
+        spilled = self.spilled
+        with self._lock:
+            return self._size + spilled
+
+    def append(self, user_id: str, query: str, response: str, response_time: float, timestamp: float):
+        with self._lock:
+            i = self._next
+            if self._size == self.capacity:
+                self._spill(i)
+            else:
+                self._size += 1
+
+            self.timestamps[i] = timestamp
+            self.response_times[i] = response_time
+            self.query_lengths[i] = len(query)
+            self.response_lengths[i] = len(response)
+            self.user_ids[i] = user_id
+            self.queries[i] = query[:self.max_text_length]
+            self.responses[i] = response[:self.max_text_length]
+            self._next = (i + 1) % self.capacity
+
+    def ring_rows(self) -> List[list]:
+        """Returns the in-memory records, oldest first, as compact rows (for snapshots)."""
+        with self._lock:
+            start = (self._next - self._size) % self.capacity
+            rows = []
+            for k in range(self._size):
+                i = (start + k) % self.capacity
+                rows.append([
+                    self.user_ids[i], self.queries[i], self.responses[i], self.response_times[i],
+                    self.timestamps[i], self.query_lengths[i], self.response_lengths[i],
+                ])
+            return rows
+
+    def load_rows(self, rows: List[list]):
+        """Appends rows produced by ``ring_rows``, keeping their original lengths."""
+        for user_id, query, response, response_time, timestamp, query_length, response_length in rows:
+            self.append(user_id, query, response, response_time, timestamp)
+            with self._lock:
+                i = (self._next - 1) % self.capacity
+                self.query_lengths[i] = query_length
+                self.response_lengths[i] = response_length
+
+    def _record(self, i: int) -> Dict:
+        return {
+            "user_id": self.user_ids[i],
+            "query": self.queries[i],
+            "response": self.responses[i],
+            "response_time": self.response_times[i],
+            "timestamp": datetime.fromtimestamp(self.timestamps[i]).isoformat(),
+            "query_length": self.query_lengths[i],
+            "response_length": self.response_lengths[i],
+        }
+
+    def recent(self, limit: int = 10) -> List[Dict]:
+        """Returns up to ``limit`` most recent records, oldest first."""
+        if limit <= 0:
+            return []
+        with self._io_lock:
+            with self._lock:
+                count = min(limit, self._size)
+                records = [self._record((self._next - 1 - k) % self.capacity) for k in range(count)]
+                # Evicted records the writer has not reached yet come next, newest first
+                for record in reversed(self._unwritten):
+                    if len(records) == limit:
+                        break
+                    records.append(record)
+            if len(records) < limit and self._counts():
+                for record in self.iter_spilled():
+                    records.append(record)
+                    if len(records) == limit:
+                        break
+        records.reverse()
+        return records
+
+    # --- Segments ---
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.segment_dir, f"segment-{index:06d}.log")
+
+    def _segment_indexes(self) -> List[int]:
+        if not self.segment_dir or not os.path.isdir(self.segment_dir):
+            return []
+        indexes = []
+        for name in os.listdir(self.segment_dir):
+            if name.startswith("segment-") and name.endswith(".log"):
+                indexes.append(int(name[len("segment-"):-len(".log")]))
+        return sorted(indexes)
+
+    def _counts(self) -> Dict[int, int]:
+        # Called with _io_lock held; records are sliced from the mmap but not parsed
+        if self._segment_counts is None:
+            counts = {}
+            for index in self._segment_indexes():
+                self._repair_segment(index)
+                counts[index] = sum(1 for _ in self._read_segment(index))
+            self._segment_counts = counts
+            self._segment_index = max(counts) + 1 if counts else 0
+        return self._segment_counts
+
+    def _spill(self, i: int):
+        # Called with _lock held: only queues the record, the disk write happens in flush()
+        if not self.segment_dir:
+            return
+        if len(self._unwritten) >= self.capacity:
+            # The writer is not keeping up; keep memory bounded by losing the oldest
+            del self._unwritten[0]
+            self.dropped += 1
+        self._unwritten.append(self._record(i))
+
+    def flush(self) -> int:
+        """Appends queued records to the segment files; returns how many were written."""
+        with self._io_lock:
+            with self._lock:
+                records, self._unwritten = self._unwritten, []
+            if not records:
+                return 0
+            counts = self._counts()
+            written = 0
+            try:
+                for record in records:
+                    if self._segment is None:
+                        os.makedirs(self.segment_dir, exist_ok=True)
+                        self._segment = open(self._segment_path(self._segment_index), "ab")
+                    payload = json.dumps(record, ensure_ascii=False).encode("utf-8")
+                    self._segment.write(payload + _LENGTH.pack(len(payload)))
+                    counts[self._segment_index] = counts.get(self._segment_index, 0) + 1
+                    written += 1
+                    if self._segment.tell() >= self.segment_max_bytes:
+                        self._roll_segment()
+                if self._segment is not None:
+                    self._segment.flush()
+            except OSError as e:
+                logger.error(f"Failed to spill {len(records) - written} interactions to disk: {e}")
+                self.dropped += len(records) - written
+            return written
+
+    async def run_writer(self):
+        """Writes spilled records periodically until cancelled (run as a background task)."""
+        try:
+            # Counts (and repairs) earlier segments up front, off the event loop
+            await asyncio.to_thread(self._load_counts)
+            while True:
+                await asyncio.sleep(self.write_interval)
+                await asyncio.to_thread(self.flush)
+        except asyncio.CancelledError:
+            pass
+
+    def _load_counts(self):
+        with self._io_lock:
+            self._counts()
+
+    def _repair_segment(self, index: int):
+        """Truncates a segment after its last intact record (the tail of a write cut short by a crash)."""
+        path = self._segment_path(index)
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            end = size
+            while end >= _LENGTH.size and not _intact_before(view, end):
+                end -= 1
+        if end < _LENGTH.size:
+            end = 0
+        if end != size:
+            logger.warning(f"Truncating {size - end} bytes of an incomplete record from {path}")
+            os.truncate(path, end)
+
+    def _roll_segment(self):
+        self._segment.close()
+        self._segment = None
+        self._segment_index += 1
+        indexes = self._segment_indexes()
+        for index in indexes[:max(0, len(indexes) - self.max_segments)]:
+            os.remove(self._segment_path(index))
+            self._segment_counts.pop(index, None)
+
+    def _read_segment(self, index: int) -> Iterator[bytes]:
+        """Yields the raw payloads of one segment, newest first."""
+        path = self._segment_path(index)
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            end = len(view)
+            while end >= _LENGTH.size:
+                (length,) = _LENGTH.unpack_from(view, end - _LENGTH.size)
+                start = end - _LENGTH.size - length
+                if start < 0:
+                    logger.warning(f"Stopped reading {path} at a corrupt record")
+                    return
+                yield view[start:end - _LENGTH.size]
+                end = start
+
+    def iter_spilled(self) -> Iterator[Dict]:
+        """Yields records written to disk newest first, reading segments through mmap."""
+        for index in reversed(self._segment_indexes()):
+            for payload in self._read_segment(index):
+                yield json.loads(payload)
+
+    def close(self):
+        self.flush()
+        with self._io_lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
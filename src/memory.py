@@ -0,0 +1,537 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from src.config import settings
+from src.utils import estimate_tokens, logger
+
+if TYPE_CHECKING:
+    from src.snapshot import SnapshotReader
+    from src.state import SharedState
+
+# Rough per-message overhead (dict + two small strings) on top of the UTF-8 payload
+MESSAGE_OVERHEAD_BYTES = 64
+
+PROFILE_ACK = "Understood. I will use this customer profile as context for the conversation."
+SUMMARY_PREFIX = "Summary of our earlier conversation: "
+SUMMARY_ACK = "Thanks, I will keep that earlier context in mind."
+
+
+def _text_size(text: str) -> int:
+    return len(text.encode("utf-8")) + MESSAGE_OVERHEAD_BYTES
+
+
+def _message_size(message: Dict[str, str]) -> int:
+    return _text_size(message["content"])
+
+
+def _exchange(text: str, ack: str) -> List[Dict[str, Any]]:
+    """Wraps context text as a user/model exchange so history keeps alternating."""
+    return [{"role": "user", "parts": [text]}, {"role": "model", "parts": [ack]}]
+
+
+class _Turn:
+    """One Gemini-formatted turn with its sequence number and token estimate."""
+
+    __slots__ = ("seq", "content", "tokens")
+
+    def __init__(self, seq: int, role: str, text: str):
+        self.seq = seq
+        self.content = {"role": role, "parts": [text]}
+        self.tokens = estimate_tokens(text)
+
+    @property
+    def role(self) -> str:
+        return self.content["role"]
+
+    @property
+    def text(self) -> str:
+        return self.content["parts"][0]
+
+
+@dataclass
+class ContextWindow:
+    """History packed into a token budget, plus the turns that fell out of it."""
+
+    history: List[Dict[str, Any]]
+    tokens: int
+    summary: str = ""
+    # Turns older than the packed window that the summary does not cover yet
+    overflow: List[Dict[str, Any]] = field(default_factory=list)
+    overflow_upto: int = -1
+
+
+class _Conversation:
+    """One user's bounded transcript plus an optional profile and summary.
+
+    Alongside the raw transcript, turns are kept in Gemini's wire format (user
+    first, strictly alternating ``user``/``model`` roles). The alternation rules
+    are applied once per append, so building the history for a request never
+    re-normalizes the transcript.
+    """
+
+    __slots__ = (
+        "messages", "profile", "profile_turns", "summary", "summary_turns",
+        "summary_upto", "wire", "next_seq", "nbytes", "last_access", "synced_at",
+    )
+
+    def __init__(self, max_messages: int, now: float):
+        self.messages: Deque[Dict[str, str]] = deque(maxlen=max_messages)
+        self.profile: Optional[Dict[str, str]] = None
+        self.profile_turns: List[Dict[str, Any]] = []
+        self.summary = ""
+        self.summary_turns: List[Dict[str, Any]] = []
+        self.summary_upto = -1
+        self.wire: Deque[_Turn] = deque()
+        self.next_seq = 0
+        self.nbytes = 0
+        self.last_access = now
+        # When this copy was last loaded from shared state
+        self.synced_at = now
+
+    def push_wire(self, role: str, content: str) -> int:
+        """Appends a message to the wire history and returns the change in bytes."""
+        role = "user" if role == "user" else "model"
+        wire = self.wire
+        if not wire and role != "user":
+            # Gemini history must start with a user turn
+            return 0
+        if wire and wire[-1].role == role:
+            # Merge consecutive same-role messages into one turn. The turn is
+            # replaced rather than mutated since earlier views may still hold it.
+            wire[-1] = _Turn(wire[-1].seq, role, f"{wire[-1].text}\n{content}")
+            return _text_size(content) - MESSAGE_OVERHEAD_BYTES + 1
+
+        wire.append(_Turn(self.next_seq, role, content))
+        self.next_seq += 1
+        delta = _text_size(content)
+        while len(wire) > self.messages.maxlen or (wire and wire[0].role != "user"):
+            delta -= _text_size(wire.popleft().text)
+        return delta
+
+    def fixed_turns(self) -> List[Dict[str, Any]]:
+        return self.profile_turns + self.summary_turns
+
+    def wire_history(self) -> List[Dict[str, Any]]:
+        return self.fixed_turns() + [turn.content for turn in self.wire]
+
+    def context_window(self, token_budget: int) -> ContextWindow:
+        fixed = self.fixed_turns()
+        used = sum(estimate_tokens(turn["parts"][0]) for turn in fixed)
+
+        # Walk back from the newest turn until the budget is spent
+        packed: List[_Turn] = []
+        for turn in reversed(self.wire):
+            if used + turn.tokens > token_budget:
+                break
+            packed.append(turn)
+            used += turn.tokens
+        # The packed history must still open with a user turn
+        while packed and packed[-1].role != "user":
+            used -= packed.pop().tokens
+        packed.reverse()
+
+        first_seq = packed[0].seq if packed else self.next_seq
+        overflow = []
+        if first_seq - 1 > self.summary_upto:
+            for turn in self.wire:
+                if turn.seq >= first_seq:
+                    break
+                if turn.seq > self.summary_upto:
+                    overflow.append(turn.content)
+        overflow_upto = first_seq - 1 if overflow else -1
+
+        return ContextWindow(
+            history=fixed + [turn.content for turn in packed],
+            tokens=used,
+            summary=self.summary,
+            overflow=overflow,
+            overflow_upto=overflow_upto,
+        )
+
+    def to_list(self) -> List[Dict[str, str]]:
+        history = list(self.messages)
+        if self.profile is not None:
+            history.insert(0, self.profile)
+        return history
+
+
+class ConversationStore(Mapping):
+    """Bounded per-user conversation memory.
+
+    Each user keeps a ring buffer of their most recent messages. Users idle for
+    longer than ``idle_ttl`` expire, and when the total size exceeds
+    ``max_bytes`` the least recently used conversations are evicted.
+
+    Reads behave like a read-only ``Dict[str, List[Dict[str, str]]]``; writes go
+    through ``append`` and ``set_profile``.
+
+    With ``shared`` state, this store becomes a per-process read cache: writes
+    are also queued to the shared backend, and a user's conversation is
+    (re)loaded from it on first read or once the local copy is older than the
+    shared cache TTL. Any worker can then serve any user, no sticky sessions.
+    Loading blocks on the backend, so async code calls ``prefetch`` first; it
+    loads in a worker thread and the reads that follow hit the local copy.
+
+    After a restart, ``attach_snapshot`` makes the previous process's users
+    available without loading them: each one is restored on first touch.
+    """
+
+    def __init__(
+        self,
+        max_messages: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        shared: Optional["SharedState"] = None,
+    ):
+        self.max_messages = max_messages or settings.CONVERSATION_MAX_TURNS * 2
+        self.idle_ttl = idle_ttl if idle_ttl is not None else settings.CONVERSATION_IDLE_TTL
+        self.max_bytes = max_bytes or settings.CONVERSATION_MAX_BYTES
+        self.shared = shared
+
+        self._entries: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.trimmed = 0
+        self.shared_loads = 0
+        self._snapshot: Optional["SnapshotReader"] = None
+        self._unrestored: set = set()
+        self.restored = 0
+        # In-flight background summary refreshes per user, shared by every agent using this store
+        self.summary_tasks: Dict[str, asyncio.Task] = {}
+
+    # --- Mapping interface ---
+
+    def __getitem__(self, user_id: str) -> List[Dict[str, str]]:
+        with self._lock:
+            entry = self._lookup(user_id)
+            if entry is None:
+                raise KeyError(user_id)
+            return entry.to_list()
+
+    def __contains__(self, user_id: object) -> bool:
+        with self._lock:
+            if self.shared is not None or user_id in self._unrestored:
+                return self._lookup(user_id) is not None
+            entry = self._entries.get(user_id)
+            return entry is not None and not self._expired(entry, time.monotonic())
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            return len(self._entries)
+
+    # --- Reads ---
+
+    def recent(self, user_id: str, limit: int) -> List[Dict[str, str]]:
+        """Returns the profile (if any) followed by the last ``limit`` messages."""
+        with self._lock:
+            entry = self._lookup(user_id)
+            if entry is None:
+                return []
+            tail = list(islice(reversed(entry.messages), limit))
+            tail.reverse()
+            if entry.profile is not None:
+                tail.insert(0, entry.profile)
+            return tail
+
+    def wire_history(self, user_id: str) -> List[Dict[str, Any]]:
+        """Returns every retained turn in Gemini wire format.
+
+        The profile and summary (if any) lead as user/model exchanges so they are
+        never sent with a role Gemini rejects.
+        """
+        with self._lock:
+            entry = self._lookup(user_id)
+            if entry is None:
+                return []
+            return entry.wire_history()
+
+    def context_window(self, user_id: str, token_budget: int) -> ContextWindow:
+        """Packs the profile, summary and newest turns into ``token_budget``.
+
+        Only the turns that fit are visited, so the cost is bounded by the
+        budget rather than by the length of the conversation.
+        """
+        with self._lock:
+            entry = self._lookup(user_id)
+            if entry is None:
+                return ContextWindow(history=[], tokens=0)
+            return entry.context_window(token_budget)
+
+    async def prefetch(self, user_id: str):
+        """Loads the user's shared conversation in a worker thread if the local copy is stale."""
+        if self.shared is None:
+            return
+        with self._lock:
+            if self._fresh(self._entries.get(user_id), time.monotonic()):
+                return
+        profile, messages = await asyncio.to_thread(self.shared.load_conversation, user_id)
+        with self._lock:
+            self._apply_shared(user_id, profile, messages, time.monotonic())
+
+    # --- Writes ---
+
+    def append(self, user_id: str, role: str, content: str):
+        """Appends a message, dropping the user's oldest one if the ring is full."""
+        with self._lock:
+            entry = self._get_or_create(user_id)
+            self._append(entry, role, content)
+            self._enforce_budget(keep=user_id)
+            if self.shared is not None:
+                self.shared.append_message(user_id, role, content, self.max_messages, self.idle_ttl)
+
+    def set_profile(self, user_id: str, content: str):
+        """Stores (or replaces) the user's profile context message."""
+        with self._lock:
+            entry = self._get_or_create(user_id)
+            self._set_profile(entry, content)
+            self._enforce_budget(keep=user_id)
+            if self.shared is not None:
+                self.shared.set_profile(user_id, content, self.idle_ttl)
+
+    def set_summary(self, user_id: str, summary: str, upto: int):
+        """Stores the rolling summary covering every turn up to sequence ``upto``."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or upto <= entry.summary_upto:
+                return
+            self._account(entry, _text_size(summary) - (_text_size(entry.summary) if entry.summary else 0))
+            entry.summary = summary
+            entry.summary_turns = _exchange(SUMMARY_PREFIX + summary, SUMMARY_ACK)
+            entry.summary_upto = upto
+
+    def discard(self, user_id: str):
+        """Forgets a user's conversation."""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self.total_bytes -= entry.nbytes
+            self._unrestored.discard(user_id)
+            if self.shared is not None:
+                self.shared.discard(user_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns size and hit/miss/eviction counters for capacity planning."""
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "trimmed_messages": self.trimmed,
+                "shared_loads": self.shared_loads,
+                "restored": self.restored,
+                "unrestored_users": len(self._unrestored),
+            }
+
+    # --- Snapshots ---
+
+    def attach_snapshot(self, reader: "SnapshotReader"):
+        """Makes the users in a snapshot restorable on first touch."""
+        with self._lock:
+            self._snapshot = reader
+            self._unrestored = set(reader.users()) - set(self._entries)
+
+    def snapshot_state(self) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional["SnapshotReader"], List[str]]:
+        """Returns live conversations as JSON-safe records, plus the users still
+        waiting in the attached snapshot, captured consistently."""
+        with self._lock:
+            now = time.monotonic()
+            wall = time.time()
+            self._purge_expired(now)
+            records = []
+            for user_id, entry in self._entries.items():
+                records.append((user_id, {
+                    "profile": entry.profile["content"] if entry.profile is not None else None,
+                    "messages": list(entry.messages),
+                    "summary": entry.summary,
+                    # Turns after the summary, so it can be re-anchored on restore
+                    "unsummarized": entry.next_seq - 1 - entry.summary_upto,
+                    "last_seen": wall - (now - entry.last_access),
+                }))
+            return records, self._snapshot, list(self._unrestored)
+
+    # --- Internals ---
+
+    def _expired(self, entry: _Conversation, now: float) -> bool:
+        return now - entry.last_access > self.idle_ttl
+
+    def _append(self, entry: _Conversation, role: str, content: str):
+        message = {"role": role, "content": content}
+        if len(entry.messages) == entry.messages.maxlen:
+            self._account(entry, -_message_size(entry.messages.popleft()))
+            self.trimmed += 1
+        entry.messages.append(message)
+        self._account(entry, _message_size(message) + entry.push_wire(role, content))
+
+    def _set_profile(self, entry: _Conversation, content: str):
+        message = {"role": "system", "content": content}
+        if entry.profile is not None:
+            self._account(entry, -_message_size(entry.profile))
+        entry.profile = message
+        entry.profile_turns = _exchange(content, PROFILE_ACK)
+        self._account(entry, _message_size(message))
+
+    def _fresh(self, entry: Optional[_Conversation], now: float) -> bool:
+        return entry is not None and now - entry.synced_at < self.shared.cache_ttl
+
+    def _sync(self, user_id: str, now: float) -> Optional[_Conversation]:
+        """Brings the local copy up to date with the user's shared conversation (blocking)."""
+        entry = self._entries.get(user_id)
+        if self._fresh(entry, now):
+            return entry
+        profile, messages = self.shared.load_conversation(user_id)
+        return self._apply_shared(user_id, profile, messages, now)
+
+    def _apply_shared(
+        self, user_id: str, profile: Optional[str], messages: List[Dict[str, str]], now: float
+    ) -> Optional[_Conversation]:
+        """Merges a conversation loaded from shared state into the local copy.
+
+        Messages other workers appended since the last sync are appended here
+        too, which keeps sequence numbers (and so the rolling summary) valid.
+        The summary itself stays local: it is derived from the transcript, so
+        only messages and the profile are shared.
+        """
+        entry = self._entries.get(user_id)
+        self.shared_loads += 1
+        if profile is None and not messages:
+            if entry is not None:
+                del self._entries[user_id]
+                self.total_bytes -= entry.nbytes
+            return None
+
+        new_messages = None
+        if entry is not None:
+            local = list(entry.messages)
+            # Find where the shared transcript picks up from the local one
+            if not local:
+                new_messages = messages
+            for offset in range(len(local)):
+                overlap = len(local) - offset
+                if local[offset:] == messages[:overlap]:
+                    new_messages = messages[overlap:]
+                    break
+        if new_messages is None:
+            if entry is not None:
+                del self._entries[user_id]
+                self.total_bytes -= entry.nbytes
+            entry = _Conversation(self.max_messages, now)
+            self._entries[user_id] = entry
+            new_messages = messages
+
+        if profile is not None and (entry.profile is None or entry.profile["content"] != profile):
+            self._set_profile(entry, profile)
+        for message in new_messages:
+            self._append(entry, message["role"], message["content"])
+        entry.synced_at = now
+        self._enforce_budget(keep=user_id)
+        return entry
+
+    def _restore(self, user_id: str, now: float) -> Optional[_Conversation]:
+        """Rebuilds one user's conversation from the attached snapshot."""
+        self._unrestored.discard(user_id)
+        try:
+            record = self._snapshot.read_user(user_id)
+        except Exception as e:
+            logger.error(f"Could not restore conversation for {user_id}: {e}")
+            return None
+        if record is None or time.time() - record["last_seen"] > self.idle_ttl:
+            return None
+
+        entry = _Conversation(self.max_messages, now)
+        self._entries[user_id] = entry
+        if record["profile"] is not None:
+            self._set_profile(entry, record["profile"])
+        for message in record["messages"]:
+            self._append(entry, message["role"], message["content"])
+        if record["summary"]:
+            summary, upto = record["summary"], entry.next_seq - 1 - record["unsummarized"]
+            entry.summary = summary
+            entry.summary_turns = _exchange(SUMMARY_PREFIX + summary, SUMMARY_ACK)
+            entry.summary_upto = max(upto, -1)
+            self._account(entry, _text_size(summary))
+        self.restored += 1
+        self._enforce_budget(keep=user_id)
+        return entry
+
+    def _find(self, user_id: str, now: float) -> Optional[_Conversation]:
+        if self.shared is not None:
+            return self._sync(user_id, now)
+        entry = self._entries.get(user_id)
+        if entry is None and user_id in self._unrestored:
+            entry = self._restore(user_id, now)
+        return entry
+
+    def _lookup(self, user_id: str) -> Optional[_Conversation]:
+        now = time.monotonic()
+        self._purge_expired(now)
+        entry = self._find(user_id, now)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry.last_access = now
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def _get_or_create(self, user_id: str) -> _Conversation:
+        now = time.monotonic()
+        self._purge_expired(now)
+        if self.shared is not None:
+            # Writes never wait on the backend: they go to the local copy and
+            # the write queue, and the next stale read reconciles the two
+            entry = self._entries.get(user_id)
+        else:
+            entry = self._find(user_id, now)
+        if entry is None:
+            entry = _Conversation(self.max_messages, now)
+            if self.shared is not None:
+                # Not loaded from shared state yet, so the next read merges it in
+                entry.synced_at = float("-inf")
+            self._entries[user_id] = entry
+        else:
+            entry.last_access = now
+            self._entries.move_to_end(user_id)
+        return entry
+
+    def _account(self, entry: _Conversation, delta: int):
+        entry.nbytes += delta
+        self.total_bytes += delta
+
+    def _purge_expired(self, now: float):
+        # Entries are kept in access order, so expired ones are at the front
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if not self._expired(entry, now):
+                break
+            del self._entries[user_id]
+            self.total_bytes -= entry.nbytes
+            self.expirations += 1
+
+    def _enforce_budget(self, keep: str):
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            user_id, entry = next(iter(self._entries.items()))
+            if user_id == keep:
+                break
+            del self._entries[user_id]
+            self.total_bytes -= entry.nbytes
+            self.evictions += 1
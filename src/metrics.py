@@ -0,0 +1,179 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from src.sketches import LatencyHistogram
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Upper bounds (seconds) of the ``le`` buckets exported for every histogram. They
+# are the same in every process, so buckets can be summed across workers and
+# replicas and quantiles computed with histogram_quantile() at query time.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Histogram:
+    """Durations for one label set: a log-bucketed histogram plus an exact sum."""
+
+    __slots__ = ("histogram", "total")
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.histogram.record(value)
+        self.total += value
+
+
+class MetricsRegistry:
+    """Process-wide counters, histograms and gauges in Prometheus text format.
+
+    Histograms are backed by ``LatencyHistogram`` so recording is O(1); at
+    scrape time its buckets are folded into the fixed ``BUCKETS`` bounds, which
+    stay within the histogram's relative error. Gauges are callbacks evaluated
+    at scrape time, so components keep their own counters and nothing extra
+    runs on the request path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._gauges: Dict[str, Callable[[], Dict[Labels, float]]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name: str, amount: float = 1.0, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name: str, help_text: str, callback: Callable[[], Dict[Labels, float]]):
+        """Registers a gauge computed at scrape time.
+
+        ``callback`` returns ``{labels: value}``; use ``()`` as the key for an
+        unlabelled gauge. Re-registering a name replaces the callback.
+        """
+        self.describe(name, "gauge", help_text)
+        self._gauges[name] = callback
+
+    @contextmanager
+    def span(self, stage: str, operation: str = "chat", **labels: str) -> Iterator[None]:
+        """Times a block into ``omniserve_stage_duration_seconds``.
+
+        The block is recorded even when it raises, so failed upstream calls
+        still show up in the stage latencies.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(
+                "omniserve_stage_duration_seconds", time.perf_counter() - start,
+                stage=stage, operation=operation, **labels,
+            )
+
+    def record_tokens(self, provider: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+        """Counts upstream token usage as reported (or estimated) by a backend."""
+        if prompt_tokens:
+            self.inc("omniserve_upstream_tokens_total", prompt_tokens, provider=provider, kind="prompt")
+        if completion_tokens:
+            self.inc("omniserve_upstream_tokens_total", completion_tokens, provider=provider, kind="completion")
+
+    def value(self, name: str, **labels: str) -> float:
+        """Returns a counter's value (or a histogram's count), mainly for tests."""
+        key = _labels(labels)
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name].get(key, 0.0)
+            histogram = self._histograms.get(name, {}).get(key)
+            return float(histogram.histogram.count) if histogram else 0.0
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+
+        def header(name: str, default_kind: str):
+            kind, help_text = self._meta.get(name, (default_kind, name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {
+                    labels: (histogram.histogram.cumulative_counts(BUCKETS), histogram.total, histogram.histogram.count)
+                    for labels, histogram in series.items()
+                }
+                for name, series in self._histograms.items()
+            }
+
+        for name in sorted(counters):
+            header(name, "counter")
+            for labels, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name in sorted(histograms):
+            header(name, "histogram")
+            for labels, (cumulative, total, count) in sorted(histograms[name].items()):
+                for bound, below in zip(BUCKETS, cumulative):
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {below}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:.6g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for name in sorted(self._gauges):
+            try:
+                values = self._gauges[name]()
+            except Exception:
+                continue
+            header(name, "gauge")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("omniserve_stage_duration_seconds", "histogram", "Time spent in each stage of request handling.")
+metrics.describe("omniserve_http_request_duration_seconds", "histogram", "HTTP request latency by route.")
+metrics.describe("omniserve_http_requests_total", "counter", "HTTP requests by route and status code.")
+metrics.describe("omniserve_upstream_tokens_total", "counter", "Tokens sent to and received from LLM providers.")
+metrics.describe("omniserve_profiles_total", "counter", "Requests captured by the opt-in request profiler.")
+metrics.describe("omniserve_voice_speculations_total", "counter", "Speculative voice replies by outcome.")
+metrics.describe("omniserve_upstream_retries_total", "counter", "Upstream calls retried after a failure.")
+metrics.describe("omniserve_admission_queue_wait_seconds", "histogram", "Time admitted upstream calls waited for a slot.")
+metrics.describe("omniserve_requests_aborted_total", "counter", "Requests that hit their deadline or whose client disconnected.")
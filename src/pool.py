@@ -0,0 +1,140 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from src.admission import AdmissionController
+from src.agent import CustomerSupportAgent
+from src.cache import ResponseCache
+from src.config import settings
+from src.memory import ConversationStore
+from src.profiles import ProfileCache
+from src.state import get_shared_state
+from src.utils import logger
+
+
+class AgentPool:
+    """Keeps one agent per API key with LRU/idle eviction.
+
+    Agents are keyed by a hash of their API key, so raw keys are never held as
+    dictionary keys. All agents share one conversation store, response cache and
+    profile cache, which means that switching keys (or evicting an agent) does
+    not reset a customer's memory. With ``admission``, their background
+    summaries are admitted through it like requests.
+
+    Building an agent imports its provider SDK and can take a while, so it
+    happens outside the pool lock: the first caller for a key builds it while
+    later callers for that key wait on its future, and other keys are served
+    meanwhile. Call ``get`` from a worker thread when on the event loop.
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        conversations: Optional[ConversationStore] = None,
+        response_cache: Optional[ResponseCache] = None,
+        profile_cache: Optional[ProfileCache] = None,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.max_size = max_size or settings.AGENT_POOL_SIZE
+        self.idle_ttl = idle_ttl if idle_ttl is not None else settings.AGENT_POOL_IDLE_TTL
+        if conversations is None:
+            conversations = ConversationStore(shared=get_shared_state())
+        self.conversations = conversations
+        if response_cache is None and settings.RESPONSE_CACHE_ENABLED:
+            response_cache = ResponseCache()
+        self.response_cache = response_cache
+        self.profile_cache = profile_cache if profile_cache is not None else ProfileCache()
+        self.admission = admission
+
+        self._agents: "OrderedDict[str, tuple[CustomerSupportAgent, float]]" = OrderedDict()
+        self._building: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(api_key: str) -> str:
+        """Returns the pool key for an API key."""
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def get(self, api_key: Optional[str] = None) -> CustomerSupportAgent:
+        """Returns the pooled agent for this key, building it on first use."""
+        key = api_key or settings.GOOGLE_API_KEY
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_idle(now)
+
+            # Keyless requests share a single "default" agent bound only to the
+            # server's own credentials (building it fails if none are configured),
+            # never to another customer's key
+            pool_key = self.key_for(key) if key else "default"
+            if pool_key in self._agents:
+                self.hits += 1
+                return self._touch(pool_key, now)
+            building = self._building.get(pool_key)
+            if building is None:
+                self.misses += 1
+                self._building[pool_key] = future = Future()
+            else:
+                self.hits += 1
+
+        if building is not None:
+            # Someone else is already building this agent (a failed build raises here too)
+            return building.result()
+
+        try:
+            agent = CustomerSupportAgent(
+                api_key=key or None,
+                conversations=self.conversations,
+                response_cache=self.response_cache,
+                profile_cache=self.profile_cache,
+                admission=self.admission,
+            )
+        except BaseException as e:
+            with self._lock:
+                del self._building[pool_key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._building[pool_key]
+            self._agents[pool_key] = (agent, time.monotonic())
+            while len(self._agents) > self.max_size:
+                self._agents.popitem(last=False)
+                self.evictions += 1
+        future.set_result(agent)
+        return agent
+
+    def _touch(self, pool_key: str, now: float) -> CustomerSupportAgent:
+        agent, _ = self._agents[pool_key]
+        self._agents[pool_key] = (agent, now)
+        self._agents.move_to_end(pool_key)
+        return agent
+
+    def _evict_idle(self, now: float):
+        # Entries are in LRU order, so idle ones are always at the front
+        while self._agents:
+            pool_key, (_, last_used) = next(iter(self._agents.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            del self._agents[pool_key]
+            self.evictions += 1
+            logger.info(f"Evicted idle agent {pool_key[:8]}")
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns pool size and hit/miss/eviction counters."""
+        return {
+            "size": len(self._agents),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
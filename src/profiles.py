@@ -0,0 +1,141 @@
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from src.config import settings
+
+_DECODER = json.JSONDecoder()
+
+
+def extract_json(content: str) -> Any:
+    """Parses the first JSON object or array in model output.
+
+    Tolerates markdown fences and prose around the JSON, which models add
+    even when asked not to.
+    """
+    for index, char in enumerate(content):
+        if char in "{[":
+            try:
+                value, _ = _DECODER.raw_decode(content, index)
+                return value
+            except ValueError:
+                continue
+    raise ValueError("No JSON object found in model output")
+
+
+class ProfileCache:
+    """TTL + size-bounded LRU cache of generated profiles, keyed by user id."""
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries or settings.PROFILE_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.PROFILE_CACHE_TTL
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() >= entry[1]:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id: str, profile: Dict[str, Any]):
+        with self._lock:
+            self._entries[user_id] = (profile, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str) -> bool:
+        with self._lock:
+            if self._entries.pop(user_id, None) is None:
+                return False
+            self.invalidations += 1
+            return True
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+FIRST_NAMES = ["Aisha", "Rahim", "Sofia", "James", "Nusrat", "Liam", "Priya", "Tanvir", "Emma", "Omar",
+               "Fatima", "Noah", "Mei", "Arif", "Chloe", "Daniel", "Sadia", "Lucas", "Hana", "Karim"]
+LAST_NAMES = ["Rahman", "Smith", "Chowdhury", "Garcia", "Khan", "Johnson", "Ahmed", "Lee", "Hossain", "Brown",
+              "Islam", "Martin", "Das", "Wilson", "Akter", "Taylor", "Sarkar", "Clark", "Roy", "Lopez"]
+PRODUCTS = [
+    ("Noise-cancelling headphones", 349.0), ("4K OLED TV 55\"", 1299.0), ("Gaming laptop", 1899.0),
+    ("Mirrorless camera", 1149.0), ("Smartphone Pro Max", 1199.0), ("Tablet 12.9\"", 1099.0),
+    ("Smartwatch", 399.0), ("Soundbar with subwoofer", 599.0), ("Mechanical keyboard", 169.0),
+    ("27\" 4K monitor", 549.0), ("Wireless earbuds", 249.0), ("Robot vacuum", 699.0),
+    ("USB-C hub", 79.0), ("Portable SSD 2TB", 219.0), ("Mesh Wi-Fi system", 329.0),
+]
+ORDER_STATUSES = ["Processing", "Shipped", "Out for delivery", "In transit"]
+SUPPORT_TOPICS = [
+    ("Asked about warranty coverage", "Resolved"), ("Requested a return label", "Resolved"),
+    ("Reported a delayed delivery", "Resolved"), ("Troubleshooting Bluetooth pairing", "Resolved"),
+    ("Asked to change the shipping address", "Resolved"), ("Reported a damaged package", "Refund issued"),
+    ("Asked about price matching", "Declined"), ("Firmware update question", "Resolved"),
+]
+
+
+class LocalProfileGenerator:
+    """Deterministic, seeded stand-in for LLM profile generation.
+
+    The same ``seed`` and user id always give the same profile, with the same
+    shape the LLM is asked for, in microseconds. Used to pre-populate
+    thousands of test customers for load tests.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = settings.PROFILE_SEED if seed is None else seed
+
+    def generate(self, user_id: str, today: Optional[datetime] = None) -> Dict[str, Any]:
+        rng = random.Random(f"{self.seed}:{user_id}")
+        today = today or datetime.now()
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        recent, *past = rng.sample(PRODUCTS, 3)
+
+        def order(product: Tuple[str, float], placed: datetime) -> Dict[str, Any]:
+            return {"order_id": f"TG-{rng.randint(100000, 999999)}", "item": product[0], "price": product[1],
+                    "order_date": placed.strftime("%B %d, %Y")}
+
+        recent_order = order(recent, today - timedelta(days=10))
+        recent_order["expected_delivery"] = (today + timedelta(days=2)).strftime("%B %d, %Y")
+        recent_order["status"] = rng.choice(ORDER_STATUSES)
+        return {
+            "customer_id": user_id,
+            "name": f"{first} {last}",
+            "email": f"{first}.{last}{rng.randint(1, 99)}@example.com".lower(),
+            "recent_order": recent_order,
+            "past_orders": [
+                dict(order(product, today - timedelta(days=rng.randint(30, 400))), status="Delivered")
+                for product in past
+            ],
+            "support_interactions": [
+                {"date": (today - timedelta(days=rng.randint(5, 300))).strftime("%B %d, %Y"),
+                 "issue": issue, "outcome": outcome}
+                for issue, outcome in rng.sample(SUPPORT_TOPICS, 2)
+            ],
+        }
@@ -0,0 +1,79 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from typing import Optional
+
+from src.config import settings
+from src.metrics import metrics
+from src.utils import logger
+
+
+class RequestProfiler:
+    """Opt-in cProfile capture of individual requests for hot-path investigation.
+
+    Nothing runs unless ``enabled``. A request is then profiled when it asks
+    for it (the ``X-Profile: 1`` header) or is picked at ``sample_rate``. Only
+    one capture runs at a time because the interpreter allows a single active
+    profiler; requests arriving meanwhile are simply not profiled. The event
+    loop runs every coroutine on one thread, so a capture also includes work
+    done for concurrent requests while it was active.
+
+    Each capture is written to ``output_dir`` as a ``.prof`` file (open it with
+    ``python -m pstats`` or snakeviz) and its hottest functions are logged.
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        sample_rate: Optional[float] = None,
+        output_dir: Optional[str] = None,
+        top: int = 15,
+    ):
+        self.enabled = settings.PROFILING_ENABLED if enabled is None else enabled
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.output_dir = settings.PROFILING_DIR if output_dir is None else output_dir
+        self.top = top
+        self._active = threading.Lock()
+
+    def start(self, requested: bool = False) -> Optional[cProfile.Profile]:
+        """Starts a capture if this request should be profiled, else returns None."""
+        if not self.enabled:
+            return None
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already attached
+            self._active.release()
+            return None
+        return profile
+
+    def stop(self, profile: Optional[cProfile.Profile], name: str) -> Optional[str]:
+        """Ends a capture started by ``start`` and returns the written file, if any."""
+        if profile is None:
+            return None
+        try:
+            profile.disable()
+        finally:
+            self._active.release()
+
+        metrics.inc("omniserve_profiles_total")
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(self.top)
+        logger.info(f"Profile of {name}:\n{summary.getvalue()}")
+
+        if not self.output_dir:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = name.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        path = os.path.join(self.output_dir, f"{time.time_ns()}-{os.getpid()}-{slug}.prof")
+        profile.dump_stats(path)
+        return path
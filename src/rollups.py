@@ -0,0 +1,190 @@
+import math
+from typing import Dict, List, Optional
+
+from src.config import settings
+from src.sketches import HyperLogLog, LatencyHistogram
+
+# Bucket sizes in seconds, finest first
+MINUTE, HOUR, DAY = 60, 3600, 86400
+TIER_SIZES = (MINUTE, HOUR, DAY)
+
+# Shared bucket layout; rollups keep latencies as sparse {bucket index: count}
+_LATENCY_LAYOUT = LatencyHistogram()
+
+
+class Rollup:
+    """Aggregates for every interaction in one time bucket; mergeable into coarser buckets."""
+
+    __slots__ = ("count", "response_time", "query_length", "response_length", "latency", "users")
+
+    def __init__(self):
+        self.count = 0
+        self.response_time = 0.0
+        self.query_length = 0
+        self.response_length = 0
+        self.latency: Dict[int, int] = {}
+        self.users = HyperLogLog()
+
+    def add(self, user_id: str, response_time: float, query_length: int, response_length: int):
+        self.count += 1
+        self.response_time += response_time
+        self.query_length += query_length
+        self.response_length += response_length
+        index = _LATENCY_LAYOUT.bucket_index(response_time)
+        self.latency[index] = self.latency.get(index, 0) + 1
+        self.users.add(user_id)
+
+    def merge(self, other: "Rollup"):
+        self.count += other.count
+        self.response_time += other.response_time
+        self.query_length += other.query_length
+        self.response_length += other.response_length
+        for index, count in other.latency.items():
+            self.latency[index] = self.latency.get(index, 0) + count
+        self.users.merge(other.users)
+
+    def summary(self) -> Dict:
+        if self.count == 0:
+            return {"count": 0, "unique_users": 0, "avg_response_time": 0, "p50_response_time": 0,
+                    "p95_response_time": 0, "p99_response_time": 0, "avg_query_length": 0, "avg_response_length": 0}
+        histogram = LatencyHistogram()
+        for index, count in self.latency.items():
+            histogram.add_bucket(index, count)
+        percentiles = histogram.percentiles()
+        return {
+            "count": self.count,
+            # HyperLogLog estimate (about 3% error); never more than the interactions themselves
+            "unique_users": min(self.users.count(), self.count),
+            "avg_response_time": round(self.response_time / self.count, 3),
+            "p50_response_time": round(percentiles["p50"], 3),
+            "p95_response_time": round(percentiles["p95"], 3),
+            "p99_response_time": round(percentiles["p99"], 3),
+            "avg_query_length": round(self.query_length / self.count, 1),
+            "avg_response_length": round(self.response_length / self.count, 1),
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "response_time": self.response_time,
+            "query_length": self.query_length,
+            "response_length": self.response_length,
+            "latency": [[index, count] for index, count in self.latency.items()],
+            "users": self.users.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "Rollup":
+        rollup = cls()
+        rollup.count = state["count"]
+        rollup.response_time = state["response_time"]
+        rollup.query_length = state["query_length"]
+        rollup.response_length = state["response_length"]
+        rollup.latency = {index: count for index, count in state["latency"]}
+        rollup.users = HyperLogLog.from_dict(state["users"])
+        return rollup
+
+
+EMPTY_SUMMARY = Rollup().summary()
+
+
+class RollupSeries:
+    """Per-minute analytics rollups, downsampled to hours and days as they age.
+
+    Interactions land in minute buckets. Once a minute bucket is older than
+    ``retention[0]`` seconds it is merged into its hour bucket, hours older
+    than ``retention[1]`` are merged into days, and days older than
+    ``retention[2]`` are dropped. Each interaction therefore lives in exactly
+    one tier, memory is bounded by the retention policy, and a range query
+    touches only the buckets it covers.
+    """
+
+    def __init__(self, retention: Optional[List[float]] = None):
+        self.retention = retention or [
+            settings.ANALYTICS_MINUTE_RETENTION,
+            settings.ANALYTICS_HOUR_RETENTION,
+            settings.ANALYTICS_DAY_RETENTION,
+        ]
+        # Dicts keep insertion order, which is time order for live traffic
+        self.tiers: List[Dict[int, Rollup]] = [{} for _ in TIER_SIZES]
+        self.latest = 0.0
+
+    def record(self, timestamp: float, user_id: str, response_time: float, query_length: int, response_length: int):
+        if timestamp > self.latest:
+            self.latest = timestamp
+        level = self._level_for(timestamp)
+        if level is None:
+            return
+        size = TIER_SIZES[level]
+        start = int(timestamp // size) * size
+        tier = self.tiers[level]
+        rollup = tier.get(start)
+        if rollup is None:
+            rollup = tier[start] = Rollup()
+            # A new bucket is the only time older ones can have aged out
+            self._downsample()
+        rollup.add(user_id, response_time, query_length, response_length)
+
+    def _level_for(self, timestamp: float) -> Optional[int]:
+        age = self.latest - timestamp
+        for level, retention in enumerate(self.retention):
+            if age < retention:
+                return level
+        return None
+
+    def _downsample(self):
+        for level, tier in enumerate(self.tiers):
+            cutoff = self.latest - self.retention[level]
+            while tier:
+                start = next(iter(tier))
+                if start + TIER_SIZES[level] > cutoff:
+                    break
+                rollup = tier.pop(start)
+                if level + 1 < len(self.tiers):
+                    coarser = TIER_SIZES[level + 1]
+                    target = self.tiers[level + 1].setdefault(int(start // coarser) * coarser, Rollup())
+                    target.merge(rollup)
+
+    def query(self, start: float, end: float, step: int) -> List[Dict]:
+        """Returns one summary per ``step`` seconds in ``[start, end)``, aligned to the epoch.
+
+        Buckets coarser than ``step`` (older data that has been downsampled)
+        are counted in the point their bucket starts in, and each point
+        reports the coarsest ``resolution`` that contributed to it.
+        """
+        first = int(start // step) * step
+        points: Dict[int, Rollup] = {}
+        resolution: Dict[int, int] = {}
+        for size, tier in zip(TIER_SIZES, self.tiers):
+            low = int(start // size) * size
+            span = math.ceil((end - low) / size)
+            if span <= len(tier):
+                buckets = ((s, tier.get(s)) for s in range(low, int(math.ceil(end)), size))
+            else:
+                buckets = ((s, r) for s, r in tier.items() if low <= s < end)
+            for bucket_start, rollup in buckets:
+                if rollup is None:
+                    continue
+                point = max(int(bucket_start // step) * step, first)
+                points.setdefault(point, Rollup()).merge(rollup)
+                resolution[point] = max(resolution.get(point, 0), size)
+
+        series = []
+        for point in range(first, int(math.ceil(end)), step):
+            rollup = points.get(point)
+            summary = rollup.summary() if rollup is not None else EMPTY_SUMMARY
+            series.append({"start": point, "resolution": resolution.get(point, min(step, MINUTE)), **summary})
+        return series
+
+    def to_dict(self) -> Dict:
+        return {
+            "latest": self.latest,
+            "tiers": [[[start, rollup.to_dict()] for start, rollup in tier.items()] for tier in self.tiers],
+        }
+
+    def load(self, state: Dict):
+        self.latest = max(self.latest, state["latest"])
+        for tier, buckets in zip(self.tiers, state["tiers"]):
+            for start, rollup in buckets:
+                tier[start] = Rollup.from_dict(rollup)
+        self._downsample()
@@ -0,0 +1,320 @@
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.backends import History, ModelBackend
+from src.config import settings
+from src.sketches import LatencyHistogram
+from src.utils import logger
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Raised when every provider's circuit breaker is open."""
+
+
+class ProviderHealth:
+    """Latency/error tracking and circuit breaker state for one provider."""
+
+    def __init__(self, backend: ModelBackend, alpha: float, failure_threshold: int, cooldown: float):
+        self.backend = backend
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.latency_ewma = 0.0
+        self.first_chunk_ewma = 0.0
+        self.error_rate = 0.0
+        # Full-call latencies (ranking and hedging) and, separately, time to first streamed chunk
+        self.latencies = LatencyHistogram()
+        self.first_chunk_latencies = LatencyHistogram()
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        # Whether the single half-open trial call is in flight
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    def state(self, now: Optional[float] = None) -> str:
+        if self.consecutive_failures < self.failure_threshold:
+            return "closed"
+        now = time.monotonic() if now is None else now
+        # After the cooldown, one request at a time is let through as a trial
+        # (half-open); its failure re-opens the circuit, its success closes it
+        return "open" if now < self.open_until else "half_open"
+
+    def available(self, now: Optional[float] = None) -> bool:
+        state = self.state(now)
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def acquire(self) -> bool:
+        """Claims a call: always granted when closed, granted to one trial at a time when half-open."""
+        with self._lock:
+            state = self.state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def release(self):
+        """Gives back a trial claim whose call ended without an outcome (e.g. it lost a hedge race)."""
+        self.probing = False
+
+    def record_success(self, latency: float, first_chunk: bool = False):
+        """Records a successful call; ``first_chunk`` latencies are time-to-first-chunk of a stream."""
+        self.calls += 1
+        if first_chunk:
+            self.first_chunk_latencies.record(latency)
+            self.first_chunk_ewma = latency if self.first_chunk_latencies.count == 1 else (
+                self.alpha * latency + (1 - self.alpha) * self.first_chunk_ewma
+            )
+        else:
+            self.latencies.record(latency)
+            self.latency_ewma = latency if self.latencies.count == 1 else (
+                self.alpha * latency + (1 - self.alpha) * self.latency_ewma
+            )
+        self.error_rate *= 1 - self.alpha
+        self.consecutive_failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.probing = False
+        self.calls += 1
+        self.failures += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.cooldown
+            logger.warning(f"Circuit opened for provider {self.name} after {self.consecutive_failures} failures")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "model": self.backend.model_name,
+            "state": self.state(),
+            "latency_ewma": round(self.latency_ewma, 3),
+            "latency_p95": round(self.latencies.quantile(0.95), 3),
+            "first_chunk_ewma": round(self.first_chunk_ewma, 3),
+            "first_chunk_p95": round(self.first_chunk_latencies.quantile(0.95), 3),
+            "error_rate": round(self.error_rate, 3),
+            "calls": self.calls,
+            "failures": self.failures,
+        }
+
+
+class ProviderRouter(ModelBackend):
+    """Routes calls across several backends by observed latency and health.
+
+    Providers are ranked by latency EWMA (unmeasured ones first, then in
+    configured order), and providers with an open circuit are skipped; a
+    half-open one gets a single trial call at a time. A failed
+    call fails over to the next provider. With hedging enabled, if the primary
+    has not answered within its own p95 latency, the same request is also sent
+    to the next provider and the first success wins. Streams are ranked and
+    hedged the same way on time to first chunk, which is tracked separately.
+    """
+
+    name = "router"
+
+    def __init__(
+        self,
+        backends: List[ModelBackend],
+        hedge: Optional[bool] = None,
+        hedge_min_samples: Optional[int] = None,
+        alpha: Optional[float] = None,
+        failure_threshold: Optional[int] = None,
+        cooldown: Optional[float] = None,
+    ):
+        self.hedge = settings.ROUTER_HEDGE_ENABLED if hedge is None else hedge
+        self.hedge_min_samples = hedge_min_samples or settings.ROUTER_HEDGE_MIN_SAMPLES
+        self.providers = [
+            ProviderHealth(
+                backend,
+                alpha=alpha or settings.ROUTER_EWMA_ALPHA,
+                failure_threshold=failure_threshold or settings.ROUTER_FAILURE_THRESHOLD,
+                cooldown=cooldown if cooldown is not None else settings.ROUTER_COOLDOWN,
+            )
+            for backend in backends
+        ]
+        self.model_name = "+".join(f"{b.name}:{b.model_name}" for b in backends)
+        self.hedged_requests = 0
+
+    @staticmethod
+    def _unavailable() -> ProviderUnavailableError:
+        return ProviderUnavailableError("All LLM providers are unavailable (circuit open). Please retry shortly.")
+
+    def _ranked(self, first_chunk: bool = False) -> List[ProviderHealth]:
+        now = time.monotonic()
+        available = [p for p in self.providers if p.available(now)]
+        if not available:
+            raise self._unavailable()
+        order = {id(p): i for i, p in enumerate(self.providers)}
+        if first_chunk:
+            return sorted(available, key=lambda p: (
+                p.first_chunk_ewma if p.first_chunk_latencies.count else 0.0, order[id(p)]
+            ))
+        return sorted(available, key=lambda p: (p.latency_ewma if p.latencies.count else 0.0, order[id(p)]))
+
+    @staticmethod
+    def _claim(candidates: List[ProviderHealth]) -> Optional[ProviderHealth]:
+        """Pops candidates until one grants a call (a half-open one may be probing already)."""
+        while candidates:
+            provider = candidates.pop(0)
+            if provider.acquire():
+                return provider
+        return None
+
+    def _hedge_delay(self, provider: ProviderHealth, first_chunk: bool = False) -> Optional[float]:
+        latencies = provider.first_chunk_latencies if first_chunk else provider.latencies
+        if not self.hedge or latencies.count < self.hedge_min_samples:
+            return None
+        return latencies.quantile(0.95)
+
+    # --- Sync calls: failover only ---
+
+    def _call_sync(self, op: Callable[[ModelBackend], Any]) -> Any:
+        error: Optional[Exception] = None
+        for provider in self._ranked():
+            if not provider.acquire():
+                continue
+            start = time.perf_counter()
+            try:
+                result = op(provider.backend)
+            except Exception as e:
+                provider.record_failure()
+                logger.warning(f"Provider {provider.name} failed: {e}")
+                error = e
+                continue
+            provider.record_success(time.perf_counter() - start)
+            return result
+        raise error or self._unavailable()
+
+    def send(self, history: History, message: str) -> str:
+        return self._call_sync(lambda backend: backend.send(history, message))
+
+    def generate(self, prompt: str) -> str:
+        return self._call_sync(lambda backend: backend.generate(prompt))
+
+    # --- Async calls: failover + hedging ---
+
+    async def _timed(self, provider: ProviderHealth, op: Callable[[ModelBackend], Awaitable[Any]]) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await op(provider.backend)
+        except asyncio.CancelledError:
+            # Losing a hedge race is not a provider failure
+            provider.release()
+            raise
+        except Exception as e:
+            provider.record_failure()
+            logger.warning(f"Provider {provider.name} failed: {e}")
+            raise
+        provider.record_success(time.perf_counter() - start)
+        return result
+
+    async def _call_async(self, op: Callable[[ModelBackend], Awaitable[Any]]) -> Any:
+        return await self._race(lambda provider: self._timed(provider, op))
+
+    async def _race(self, start: Callable[[ProviderHealth], Awaitable[Any]], first_chunk: bool = False) -> Any:
+        """Runs ``start`` on the best provider, hedging past its p95 and failing over on errors."""
+        remaining = self._ranked(first_chunk)
+        primary = self._claim(remaining)
+        if primary is None:
+            raise self._unavailable()
+        pending = {asyncio.ensure_future(start(primary))}
+        hedge_delay = self._hedge_delay(primary, first_chunk) if remaining else None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The primary is slower than its p95: hedge with the next provider
+                    hedge_delay = None
+                    hedge = self._claim(remaining)
+                    if hedge is not None:
+                        self.hedged_requests += 1
+                        pending.add(asyncio.ensure_future(start(hedge)))
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    # Fail over to the next provider
+                    hedge_delay = None
+                    fallback = self._claim(remaining)
+                    if fallback is not None:
+                        pending.add(asyncio.ensure_future(start(fallback)))
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    async def send_async(self, history: History, message: str, timeout: Optional[float] = None) -> str:
+        return await self._call_async(lambda backend: backend.send_async(history, message, timeout=timeout))
+
+    async def generate_async(self, prompt: str, timeout: Optional[float] = None) -> str:
+        return await self._call_async(lambda backend: backend.generate_async(prompt, timeout=timeout))
+
+    async def _open_stream(
+        self, provider: ProviderHealth, history: History, message: str, timeout: Optional[float]
+    ) -> Tuple[AsyncIterator[str], Optional[str]]:
+        """Starts a provider's stream and waits for its first chunk (None for an empty reply)."""
+        start = time.perf_counter()
+        stream = provider.backend.stream_async(history, message, timeout=timeout)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except asyncio.CancelledError:
+            # Losing a hedge race (or the caller leaving) before the first chunk is not a failure
+            provider.release()
+            await stream.aclose()
+            raise
+        except Exception as e:
+            provider.record_failure()
+            logger.warning(f"Provider {provider.name} failed: {e}")
+            raise
+        # Time to first chunk is what matters for streamed replies, but it is kept
+        # apart from the full-call latencies that rank and hedge non-streamed calls
+        provider.record_success(time.perf_counter() - start, first_chunk=True)
+        return stream, first
+
+    async def stream_async(self, history: History, message: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Streams from the provider with the best time to first chunk.
+
+        Until the first chunk arrives the stream fails over like a call, and is
+        hedged once the primary is slower than its first-chunk p95; after that
+        an error is raised to the caller.
+        """
+        stream, first = await self._race(
+            lambda provider: self._open_stream(provider, history, message, timeout), first_chunk=True
+        )
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    async def warm_up(self):
+        """Warms every provider; one that fails to warm up is only logged."""
+        results = await asyncio.gather(*(p.backend.warm_up() for p in self.providers), return_exceptions=True)
+        for provider, result in zip(self.providers, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Provider {provider.name} warm-up failed: {result}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedged_requests": self.hedged_requests,
+            "providers": [provider.stats() for provider in self.providers],
+        }
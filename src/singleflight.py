@@ -0,0 +1,124 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class Broadcast:
+    """Replays one producer's stream of items to any number of subscribers."""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    def start(self, source: AsyncIterator[Any]) -> asyncio.Task:
+        self.task = asyncio.ensure_future(self.run(source))
+        return self.task
+
+    async def run(self, source: AsyncIterator[Any]):
+        try:
+            async for item in source:
+                self.items.append(item)
+                async with self._changed:
+                    self._changed.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            # Cancelled between items, the source is still suspended: close it so its upstream call ends
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.items) or self.done)
+            while position < len(self.items):
+                yield self.items[position]
+                position += 1
+            if self.done and position == len(self.items):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls onto one in-flight execution.
+
+    The first caller for a key starts the work; callers that arrive while it is
+    still running share its result (or, for streams, replay its items) instead
+    of issuing their own upstream call. Once the work finishes, the key is
+    released and the next call runs afresh. If every caller waiting on a call
+    (or subscribed to a stream) goes away (timed out, disconnected or closed
+    the stream), the call itself is cancelled.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, Broadcast] = {}
+        # Callers (or stream subscribers) still interested in each in-flight task
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs ``fn`` once for all concurrent callers with the same ``key``."""
+        task = self._calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _, key=key, task=task: self._release(self._calls, key, task))
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # Shielded so one caller going away does not cancel the work for the others
+            return await asyncio.shield(task)
+        finally:
+            self._leave(self._calls, key, task, task)
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Streams ``fn()``'s items once for all concurrent callers with the same ``key``."""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.executed += 1
+            broadcast = Broadcast()
+            self._streams[key] = broadcast
+            task = broadcast.start(fn())
+            task.add_done_callback(lambda _, key=key, value=broadcast: self._release(self._streams, key, value))
+        else:
+            self.coalesced += 1
+            task = broadcast.task
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            async for item in broadcast.subscribe():
+                yield item
+        finally:
+            self._leave(self._streams, key, broadcast, task)
+
+    def _leave(self, registry: Dict[Hashable, Any], key: Hashable, value: Any, task: asyncio.Task):
+        self._waiters[task] -= 1
+        if not self._waiters[task]:
+            del self._waiters[task]
+            # Nobody is left to use the result (no-op if the work already finished);
+            # released now so a new caller starts afresh instead of joining a cancelled call
+            task.cancel()
+            self._release(registry, key, value)
+
+    @staticmethod
+    def _release(registry: Dict[Hashable, Any], key: Hashable, value: Any):
+        if registry.get(key) is value:
+            del registry[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,363 @@
+import base64
+import hashlib
+import math
+from typing import Dict, List, Optional
+
+
+class RunningStats:
+    """Constant-memory count/sum/min/max with Welford's mean and variance."""
+
+    __slots__ = ("count", "total", "min", "max", "mean", "_m2")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.variance)
+
+    def merge(self, other: "RunningStats"):
+        """Combines another set of stats into this one (Chan et al.)."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.total, self.mean, self._m2 = other.count, other.total, other.mean, other._m2
+            self.min, self.max = other.min, other.max
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def to_dict(self) -> Dict:
+        """Returns a JSON-safe copy of the state, for snapshots."""
+        if self.count == 0:
+            return {"count": 0}
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "mean": self.mean, "m2": self._m2}
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "RunningStats":
+        stats = cls()
+        if state.get("count"):
+            stats.count, stats.total, stats.mean, stats._m2 = state["count"], state["total"], state["mean"], state["m2"]
+            stats.min, stats.max = state["min"], state["max"]
+        return stats
+
+
+class LatencyHistogram:
+    """Log-bucketed (HDR-style) histogram for latency percentiles.
+
+    Bucket boundaries grow geometrically by ``1 + precision``, so any reported
+    quantile is within ``precision`` relative error of the true value. Memory
+    and query cost depend only on the configured range, never on how many
+    values were recorded, and histograms with the same layout can be merged.
+    """
+
+    def __init__(self, min_value: float = 1e-4, max_value: float = 3600.0, precision: float = 0.02):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self._size = int(math.ceil(math.log(max_value / min_value) / self._log_base)) + 2
+        self.counts: List[int] = [0] * self._size
+        self.count = 0
+
+    def bucket_index(self, value: float) -> int:
+        """Returns the bucket ``value`` falls into (stable for a given layout)."""
+        return self._index(value)
+
+    def add_bucket(self, index: int, count: int):
+        """Adds ``count`` values to a bucket, e.g. when rebuilding from shared counters."""
+        self.counts[index] += count
+        self.count += count
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        if value >= self.max_value:
+            return self._size - 1
+        return int(math.log(value / self.min_value) / self._log_base) + 1
+
+    def _bucket_value(self, index: int) -> float:
+        if index == 0:
+            return self.min_value
+        # Midpoint of the bucket in log space
+        return min(self.min_value * math.exp((index - 0.5) * self._log_base), self.max_value)
+
+    def record(self, value: float):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Returns the approximate value at quantile ``q`` (0..1)."""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, int(math.ceil(q * self.count)))
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= rank:
+                return self._bucket_value(index)
+        return self.max_value
+
+    def cumulative_counts(self, bounds: List[float]) -> List[int]:
+        """Returns how many values are at most each of the ascending ``bounds``.
+
+        A bound counts the whole bucket it falls in, so the counts are exact up
+        to the histogram's relative precision. Used to export fixed Prometheus
+        ``le`` buckets, which aggregate across processes where quantiles do not.
+        """
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            last = self._index(bound)
+            while index <= last:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def percentiles(self, quantiles: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        """Returns several quantiles in one pass over the buckets."""
+        quantiles = quantiles or {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+        if self.count == 0:
+            return {name: 0.0 for name in quantiles}
+        targets = sorted((max(1, int(math.ceil(q * self.count))), name) for name, q in quantiles.items())
+        result = {}
+        seen = 0
+        position = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            while position < len(targets) and seen >= targets[position][0]:
+                result[targets[position][1]] = self._bucket_value(index)
+                position += 1
+            if position == len(targets):
+                break
+        return result
+
+    def merge(self, other: "LatencyHistogram"):
+        """Adds another histogram with the same layout into this one."""
+        if (other.min_value, other.max_value, other.precision) != (self.min_value, self.max_value, self.precision):
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        for index, bucket in enumerate(other.counts):
+            self.counts[index] += bucket
+        self.count += other.count
+
+    def to_dict(self) -> Dict:
+        """Returns the layout and the non-empty buckets, for snapshots."""
+        return {
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "precision": self.precision,
+            "buckets": [[index, bucket] for index, bucket in enumerate(self.counts) if bucket],
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "LatencyHistogram":
+        histogram = cls(state["min_value"], state["max_value"], state["precision"])
+        for index, bucket in state["buckets"]:
+            histogram.add_bucket(index, bucket)
+        return histogram
+
+
+class HyperLogLog:
+    """Mergeable distinct-count estimate in ``2 ** precision`` bytes.
+
+    The standard error is about ``1.04 / sqrt(2 ** precision)`` (3.2% at the
+    default precision of 10), with linear counting for small cardinalities.
+    Sketches with the same precision merge by taking register maxima, so
+    per-minute sketches can be rolled up into hours and days.
+    """
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = 10):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: str):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs with different precisions")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        estimate = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> Dict:
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "HyperLogLog":
+        sketch = cls(state["precision"])
+        sketch.registers = bytearray(base64.b64decode(state["registers"]))
+        return sketch
+
+
+class _CountBucket:
+    """All keys sharing one count, linked in ascending count order."""
+
+    __slots__ = ("count", "keys", "prev", "next")
+
+    def __init__(self, count: int):
+        self.count = count
+        self.keys: Dict[str, None] = {}  # insertion-ordered set
+        self.prev: Optional["_CountBucket"] = None
+        self.next: Optional["_CountBucket"] = None
+
+
+class TopK:
+    """Incrementally maintained heavy hitters (Stream-Summary).
+
+    Keys are grouped into buckets of equal count kept in sorted order, so an
+    increment is O(1) and reading the top ``k`` is O(k). With ``capacity=None``
+    every key is tracked and counts are exact. With a capacity the structure
+    runs the Space-Saving algorithm: a new key replaces the least frequent one
+    and inherits its count, and ``error`` bounds how much it may be overcounted.
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = capacity
+        self._bucket_of: Dict[str, _CountBucket] = {}
+        self._error: Dict[str, int] = {}
+        self._head: Optional[_CountBucket] = None  # smallest count
+        self._tail: Optional[_CountBucket] = None  # largest count
+
+    def __len__(self) -> int:
+        return len(self._bucket_of)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._bucket_of
+
+    def count(self, key: str) -> int:
+        bucket = self._bucket_of.get(key)
+        return bucket.count if bucket else 0
+
+    def increment(self, key: str):
+        bucket = self._bucket_of.get(key)
+        if bucket is not None:
+            self._move_up(key, bucket)
+            return
+
+        if self.capacity is None or len(self._bucket_of) < self.capacity:
+            self._error[key] = 0
+            if self._head is not None and self._head.count == 1:
+                target = self._head
+            else:
+                target = self._insert_after(None, 1)
+            target.keys[key] = None
+            self._bucket_of[key] = target
+            return
+
+        # Space-Saving: replace the oldest key with the minimum count
+        head = self._head
+        evicted = next(iter(head.keys))
+        del head.keys[evicted]
+        del self._bucket_of[evicted]
+        del self._error[evicted]
+        head.keys[key] = None
+        self._bucket_of[key] = head
+        self._error[key] = head.count
+        self._move_up(key, head)
+
+    def top(self, k: int) -> List[Dict]:
+        """Returns up to ``k`` keys with the highest counts, highest first."""
+        result = []
+        bucket = self._tail
+        while bucket is not None and len(result) < k:
+            for key in bucket.keys:
+                result.append({"key": key, "count": bucket.count, "error": self._error[key]})
+                if len(result) == k:
+                    break
+            bucket = bucket.prev
+        return result
+
+    @classmethod
+    def from_counts(cls, counts: Dict[str, int], capacity: Optional[int] = None) -> "TopK":
+        """Builds a structure holding exact ``counts`` (the largest ``capacity`` of them)."""
+        top = cls(capacity)
+        entries = sorted(counts.items(), key=lambda item: item[1])
+        if capacity is not None:
+            entries = entries[-capacity:] if capacity > 0 else []
+        for key, count in entries:
+            tail = top._tail
+            if tail is None or tail.count != count:
+                tail = top._insert_after(tail, count)
+            tail.keys[key] = None
+            top._bucket_of[key] = tail
+            top._error[key] = 0
+        return top
+
+    def _move_up(self, key: str, bucket: _CountBucket):
+        nxt = bucket.next
+        if nxt is None or nxt.count != bucket.count + 1:
+            nxt = self._insert_after(bucket, bucket.count + 1)
+        del bucket.keys[key]
+        nxt.keys[key] = None
+        self._bucket_of[key] = nxt
+        if not bucket.keys:
+            self._unlink(bucket)
+
+    def _insert_after(self, bucket: Optional[_CountBucket], count: int) -> _CountBucket:
+        new = _CountBucket(count)
+        if bucket is None:
+            new.next = self._head
+            if self._head is not None:
+                self._head.prev = new
+            self._head = new
+        else:
+            new.prev, new.next = bucket, bucket.next
+            if bucket.next is not None:
+                bucket.next.prev = new
+            bucket.next = new
+        if new.next is None:
+            self._tail = new
+        return new
+
+    def _unlink(self, bucket: _CountBucket):
+        if bucket.prev is not None:
+            bucket.prev.next = bucket.next
+        else:
+            self._head = bucket.next
+        if bucket.next is not None:
+            bucket.next.prev = bucket.prev
+        else:
+            self._tail = bucket.prev
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from src.config import settings
+from src.utils import logger
+
+if TYPE_CHECKING:
+    from src.analytics import AnalyticsTracker
+    from src.memory import ConversationStore
+
+# File layout:
+#   record*  : <I length> + zlib-compressed JSON
+#   index    : <I length> + zlib-compressed JSON {"users": {user_id: [offset, length]}, "analytics": [...]}
+#   trailer  : <Q index offset> + MAGIC
+# The index sits at the end so records can be streamed out without knowing the
+# total up front, and a reader only has to load the index to start serving.
+MAGIC = b"OMNISNP1"
+_LENGTH = struct.Struct("<I")
+_TRAILER = struct.Struct("<Q8s")
+
+# Conversation records, the attached reader and its unrestored users, and the analytics state
+Captured = Tuple[List[Tuple[str, Dict[str, Any]]], Optional["SnapshotReader"], List[str], Dict[str, Any]]
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing its trailer or index."""
+
+
+def _compress(data: Any) -> bytes:
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _decompress(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SnapshotReader:
+    """Random access to the records of one snapshot file.
+
+    Opening reads only the trailer and index; each user's record is read and
+    decompressed on demand.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()
+        try:
+            self._file.seek(0, os.SEEK_END)
+            size = self._file.tell()
+            if size < _TRAILER.size:
+                raise SnapshotError(f"{path} is too short to be a snapshot")
+            self._file.seek(size - _TRAILER.size)
+            index_offset, magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+            if magic != MAGIC:
+                raise SnapshotError(f"{path} is not a snapshot (bad magic)")
+            index = _decompress(self._read_at(index_offset))
+        except Exception:
+            self._file.close()
+            raise
+        self._users: Dict[str, Tuple[int, int]] = {user_id: tuple(span) for user_id, span in index["users"].items()}
+        self._analytics = tuple(index["analytics"]) if index.get("analytics") else None
+        self.created_at = index.get("created_at", 0.0)
+
+    def _read_at(self, offset: int, length: Optional[int] = None) -> bytes:
+        with self._lock:
+            self._file.seek(offset)
+            header = self._file.read(_LENGTH.size)
+            if length is None:
+                (length,) = _LENGTH.unpack(header)
+            return self._file.read(length)
+
+    def users(self) -> List[str]:
+        return list(self._users)
+
+    def raw_user(self, user_id: str) -> Optional[bytes]:
+        """Returns the user's compressed record without decoding it."""
+        span = self._users.get(user_id)
+        return self._read_at(*span) if span else None
+
+    def read_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        blob = self.raw_user(user_id)
+        return _decompress(blob) if blob is not None else None
+
+    def read_analytics(self) -> Optional[Dict[str, Any]]:
+        return _decompress(self._read_at(*self._analytics)) if self._analytics else None
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SnapshotWriter:
+    """Streams records to a temporary file and atomically replaces the target."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp_path = f"{path}.tmp"
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(self._tmp_path, "wb")
+        self._offset = 0
+        self._users: Dict[str, List[int]] = {}
+        self._analytics: Optional[List[int]] = None
+
+    def _write(self, blob: bytes) -> List[int]:
+        span = [self._offset, len(blob)]
+        self._file.write(_LENGTH.pack(len(blob)))
+        self._file.write(blob)
+        self._offset += _LENGTH.size + len(blob)
+        return span
+
+    def add_user(self, user_id: str, record: Dict[str, Any]):
+        self._users[user_id] = self._write(_compress(record))
+
+    def add_raw_user(self, user_id: str, blob: bytes):
+        self._users[user_id] = self._write(blob)
+
+    def add_analytics(self, state: Dict[str, Any]):
+        self._analytics = self._write(_compress(state))
+
+    def commit(self) -> int:
+        index_offset = self._offset
+        self._write(_compress({"users": self._users, "analytics": self._analytics, "created_at": time.time()}))
+        self._file.write(_TRAILER.pack(index_offset, MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return self._offset + _TRAILER.size
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+class Snapshotter:
+    """Periodic and shutdown snapshots of conversations and analytics.
+
+    ``restore`` only opens the latest snapshot and loads the (small) analytics
+    record; conversations are restored per user on first touch by the store.
+    Users not touched since the restore are copied into the next snapshot
+    as-is, without being decompressed. Periodic saves capture the state on
+    the event loop, where it is mutated, and only compress and write it in a
+    worker thread.
+    """
+
+    def __init__(
+        self,
+        conversations: "ConversationStore",
+        analytics: "AnalyticsTracker",
+        path: Optional[str] = None,
+        interval: Optional[float] = None,
+    ):
+        self.conversations = conversations
+        self.analytics = analytics
+        self.path = path if path is not None else settings.SNAPSHOT_PATH
+        self.interval = interval if interval is not None else settings.SNAPSHOT_INTERVAL
+        self._save_lock = threading.Lock()
+        self.saves = 0
+        self.last_save_seconds = 0.0
+        self.last_save_bytes = 0
+        self.last_save_users = 0
+        self.restored_users = 0
+
+    def restore(self) -> bool:
+        """Attaches the latest snapshot (if any) for lazy restore."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            reader = SnapshotReader(self.path)
+            analytics_state = reader.read_analytics()
+        except Exception as e:
+            logger.error(f"Ignoring unreadable snapshot {self.path}: {e}")
+            return False
+        if analytics_state is not None:
+            self.analytics.load_state(analytics_state)
+        self.conversations.attach_snapshot(reader)
+        self.restored_users = len(reader.users())
+        logger.info(f"Attached snapshot {self.path} with {self.restored_users} conversations")
+        return True
+
+    def capture(self) -> Captured:
+        """Copies conversations and analytics into JSON-safe data for ``save``.
+
+        Call it from the thread that updates them (the event loop): analytics
+        has no lock, so exporting it from a worker thread could race a write.
+        """
+        records, reader, unrestored = self.conversations.snapshot_state()
+        return records, reader, unrestored, self.analytics.export_state()
+
+    def save(self, captured: Optional[Captured] = None) -> int:
+        """Writes a new snapshot of ``captured`` (or of the current state) and returns its size in bytes."""
+        if not self.path:
+            return 0
+        with self._save_lock:
+            start = time.perf_counter()
+            records, reader, unrestored, analytics_state = captured if captured is not None else self.capture()
+            writer = SnapshotWriter(self.path)
+            try:
+                for user_id, record in records:
+                    writer.add_user(user_id, record)
+                for user_id in unrestored:
+                    blob = reader.raw_user(user_id)
+                    if blob is not None:
+                        writer.add_raw_user(user_id, blob)
+                writer.add_analytics(analytics_state)
+                size = writer.commit()
+            except Exception:
+                writer.abort()
+                raise
+            self.saves += 1
+            self.last_save_seconds = time.perf_counter() - start
+            self.last_save_bytes = size
+            self.last_save_users = len(records) + len(unrestored)
+            return size
+
+    async def run_periodic(self):
+        """Saves every ``interval`` seconds until cancelled (run as a background task)."""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await asyncio.to_thread(self.save, self.capture())
+                except Exception as e:
+                    logger.error(f"Snapshot failed: {e}")
+        except asyncio.CancelledError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "saves": self.saves,
+            "last_save_seconds": round(self.last_save_seconds, 4),
+            "last_save_bytes": self.last_save_bytes,
+            "last_save_users": self.last_save_users,
+            "restored_users": self.restored_users,
+            "pending_restore": self.conversations.stats()["unrestored_users"],
+        }
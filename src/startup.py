@@ -0,0 +1,60 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from src.utils import logger
+
+
+class StartupTracker:
+    """Cold-start timings and readiness of this process.
+
+    Records how long module and provider SDK imports took and how long the
+    background warm-up ran. The process is ``ready`` once warm-up has
+    finished; a failed warm-up is reported but still counts as finished,
+    because requests can bring their own API key.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.timings: Dict[str, float] = {}
+        self.state = "starting"
+        self.error: Optional[str] = None
+
+    def record(self, phase: str, seconds: float):
+        self.timings[phase] = seconds
+        logger.info(f"Startup: {phase} took {seconds * 1000:.0f}ms")
+
+    @contextmanager
+    def timed(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ("ready", "degraded")
+
+    def warming(self):
+        self.state = "warming"
+
+    def finished(self, error: Optional[BaseException] = None):
+        """Marks warm-up done; ``error`` (if any) is reported and readiness becomes "degraded"."""
+        if error is not None:
+            self.error = str(error)
+            logger.warning(f"Warm-up failed, serving without a pre-warmed agent: {error}")
+        self.state = "degraded" if error is not None else "ready"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "uptime": round(time.time() - self.started_at, 3),
+            "timings": {phase: round(seconds, 4) for phase, seconds in self.timings.items()},
+            "error": self.error,
+        }
+
+
+# Global start-up tracker for this process
+startup = StartupTracker()
@@ -0,0 +1,618 @@
+import asyncio
+import json
+import os
+import select
+import socket
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlparse
+
+from src.config import settings
+from src.utils import logger
+
+# A command is a Redis-style tuple such as ("RPUSH", key, value). Both backends
+# accept the same commands and return Redis-shaped replies, so the layer above
+# never cares which one it is talking to.
+Command = Tuple[Any, ...]
+
+WRITE_COMMANDS = {"SET", "DEL", "RPUSH", "LTRIM", "EXPIRE", "HINCRBYFLOAT", "ZINCRBY"}
+
+
+class StateBackendError(Exception):
+    """Raised when the shared state backend rejects or cannot run a command."""
+
+
+class StateBackend:
+    """Executes batches of Redis-style commands against shared storage."""
+
+    name = "base"
+
+    def execute(self, commands: Sequence[Command]) -> List[Any]:
+        """Runs ``commands`` in order and returns one reply per command."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# --- SQLite (WAL) ---
+
+def _resolve_range(start: int, stop: int, length: int) -> Tuple[int, int]:
+    """Turns Redis-style inclusive (possibly negative) indices into offset/limit."""
+    if start < 0:
+        start = max(length + start, 0)
+    if stop < 0:
+        stop = length + stop
+    stop = min(stop, length - 1)
+    if start > stop:
+        return 0, 0
+    return start, stop - start + 1
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class SQLiteStateBackend(StateBackend):
+    """Shared state in a local SQLite database in WAL mode.
+
+    WAL lets every worker process on the host read while one writes, so this
+    covers ``uvicorn --workers N`` on a single node. Each batch runs in one
+    transaction, which is what makes write batching pay off.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS lists (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, value TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS lists_key ON lists (key, seq);
+        CREATE TABLE IF NOT EXISTS hashes (
+            key TEXT NOT NULL, field TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (key, field)
+        );
+        CREATE TABLE IF NOT EXISTS zsets (
+            key TEXT NOT NULL, member TEXT NOT NULL, score REAL NOT NULL, PRIMARY KEY (key, member)
+        );
+        CREATE INDEX IF NOT EXISTS zsets_score ON zsets (key, score);
+        CREATE TABLE IF NOT EXISTS expiry (key TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+    """
+
+    TABLES = ("kv", "lists", "hashes", "zsets")
+
+    def __init__(self, path: Optional[str] = None, purge_interval: float = 60.0):
+        self.path = path or settings.STATE_SQLITE_PATH
+        if self.path != ":memory:" and os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self.purge_interval = purge_interval
+        self._last_purge = time.time()
+
+    def execute(self, commands: Sequence[Command]) -> List[Any]:
+        writes = any(command[0].upper() in WRITE_COMMANDS for command in commands)
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE" if writes else "BEGIN")
+            try:
+                now = time.time()
+                if writes and now - self._last_purge > self.purge_interval:
+                    self._purge_expired(cursor, now)
+                    self._last_purge = now
+                replies = [self._run(cursor, command, now) for command in commands]
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        return replies
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _delete(self, cursor: sqlite3.Cursor, key: str) -> int:
+        removed = 0
+        for table in self.TABLES:
+            removed += cursor.execute(f"DELETE FROM {table} WHERE key = ?", (key,)).rowcount
+        cursor.execute("DELETE FROM expiry WHERE key = ?", (key,))
+        return removed
+
+    def _purge_expired(self, cursor: sqlite3.Cursor, now: float):
+        expired = [row[0] for row in cursor.execute("SELECT key FROM expiry WHERE expires_at <= ?", (now,))]
+        for key in expired:
+            self._delete(cursor, key)
+
+    def _run(self, cursor: sqlite3.Cursor, command: Command, now: float) -> Any:
+        name, args = command[0].upper(), command[1:]
+        if name == "PING":
+            return "PONG"
+
+        key = args[0]
+        row = cursor.execute("SELECT expires_at FROM expiry WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] <= now:
+            self._delete(cursor, key)
+
+        if name == "GET":
+            row = cursor.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+        if name == "SET":
+            cursor.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, str(args[1])))
+            cursor.execute("DELETE FROM expiry WHERE key = ?", (key,))
+            return "OK"
+        if name == "DEL":
+            return sum(1 for k in args if self._delete(cursor, k))
+        if name == "EXPIRE":
+            exists = any(
+                cursor.execute(f"SELECT 1 FROM {table} WHERE key = ? LIMIT 1", (key,)).fetchone()
+                for table in self.TABLES
+            )
+            if not exists:
+                return 0
+            cursor.execute(
+                "INSERT OR REPLACE INTO expiry (key, expires_at) VALUES (?, ?)", (key, now + float(args[1]))
+            )
+            return 1
+        if name == "RPUSH":
+            cursor.executemany(
+                "INSERT INTO lists (key, value) VALUES (?, ?)", [(key, str(value)) for value in args[1:]]
+            )
+            return self._list_length(cursor, key)
+        if name in ("LRANGE", "LTRIM"):
+            offset, limit = _resolve_range(int(args[1]), int(args[2]), self._list_length(cursor, key))
+            if name == "LRANGE":
+                rows = cursor.execute(
+                    "SELECT value FROM lists WHERE key = ? ORDER BY seq LIMIT ? OFFSET ?", (key, limit, offset)
+                )
+                return [row[0] for row in rows]
+            cursor.execute(
+                "DELETE FROM lists WHERE key = ? AND seq NOT IN "
+                "(SELECT seq FROM lists WHERE key = ? ORDER BY seq LIMIT ? OFFSET ?)",
+                (key, key, limit, offset),
+            )
+            return "OK"
+        if name == "HINCRBYFLOAT":
+            field, amount = str(args[1]), float(args[2])
+            cursor.execute(
+                "INSERT INTO hashes (key, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (key, field) DO UPDATE SET value = value + excluded.value",
+                (key, field, amount),
+            )
+            row = cursor.execute("SELECT value FROM hashes WHERE key = ? AND field = ?", (key, field)).fetchone()
+            return _format_number(row[0])
+        if name == "HGETALL":
+            reply: List[str] = []
+            for field, value in cursor.execute("SELECT field, value FROM hashes WHERE key = ?", (key,)):
+                reply.extend((field, _format_number(value)))
+            return reply
+        if name == "ZINCRBY":
+            amount, member = float(args[1]), str(args[2])
+            cursor.execute(
+                "INSERT INTO zsets (key, member, score) VALUES (?, ?, ?) "
+                "ON CONFLICT (key, member) DO UPDATE SET score = score + excluded.score",
+                (key, member, amount),
+            )
+            row = cursor.execute("SELECT score FROM zsets WHERE key = ? AND member = ?", (key, member)).fetchone()
+            return _format_number(row[0])
+        if name == "ZREVRANGE":
+            total = cursor.execute("SELECT COUNT(*) FROM zsets WHERE key = ?", (key,)).fetchone()[0]
+            offset, limit = _resolve_range(int(args[1]), int(args[2]), total)
+            with_scores = len(args) > 3 and str(args[3]).upper() == "WITHSCORES"
+            reply = []
+            for member, score in cursor.execute(
+                "SELECT member, score FROM zsets WHERE key = ? ORDER BY score DESC, member DESC LIMIT ? OFFSET ?",
+                (key, limit, offset),
+            ):
+                reply.append(member)
+                if with_scores:
+                    reply.append(_format_number(score))
+            return reply
+        if name == "ZCARD":
+            return cursor.execute("SELECT COUNT(*) FROM zsets WHERE key = ?", (key,)).fetchone()[0]
+        raise StateBackendError(f"Unsupported command: {name}")
+
+    @staticmethod
+    def _list_length(cursor: sqlite3.Cursor, key: str) -> int:
+        return cursor.execute("SELECT COUNT(*) FROM lists WHERE key = ?", (key,)).fetchone()[0]
+
+
+# --- Redis (RESP) ---
+
+def encode_command(command: Command) -> bytes:
+    """Encodes a command as a RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % len(command)]
+    for arg in command:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+def read_reply(stream) -> Any:
+    """Reads one RESP reply from a buffered binary stream.
+
+    Error replies are returned (not raised) as ``StateBackendError`` so that a
+    pipeline can still drain every reply before failing.
+    """
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    prefix, rest = line[:1], line[1:-2]
+    if prefix == b"+":
+        return rest.decode("utf-8")
+    if prefix == b"-":
+        return StateBackendError(rest.decode("utf-8"))
+    if prefix == b":":
+        return int(rest)
+    if prefix == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        return stream.read(length + 2)[:-2].decode("utf-8")
+    if prefix == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [read_reply(stream) for _ in range(length)]
+    raise StateBackendError(f"Unexpected reply: {line!r}")
+
+
+class RedisStateBackend(StateBackend):
+    """Shared state on any server speaking the Redis protocol (RESP).
+
+    Batches are sent as a single pipeline: every command is written in one go
+    and then all replies are read, so a batch costs one round trip. Talking RESP
+    directly keeps the ``redis`` client library out of the dependencies.
+    A pipeline is never resent: once any of it may have reached the server, a
+    dropped connection is raised, since replaying increments would count them
+    twice. A connection the server closed while idle is replaced before writing.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: Optional[str] = None, timeout: float = 5.0):
+        parsed = urlparse(url or settings.STATE_REDIS_URL)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.strip("/") or 0)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._stream = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._pipeline(setup)
+
+    def _pipeline(self, commands: Sequence[Command]) -> List[Any]:
+        self._sock.sendall(b"".join(encode_command(command) for command in commands))
+        replies = [read_reply(self._stream) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, StateBackendError):
+                raise reply
+        return replies
+
+    def execute(self, commands: Sequence[Command]) -> List[Any]:
+        with self._lock:
+            if self._sock is not None and self._closed_by_server():
+                self._disconnect()
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._pipeline(commands)
+            except (OSError, ConnectionError):
+                self._disconnect()
+                raise
+
+    def _closed_by_server(self) -> bool:
+        """Whether the idle connection has been closed (or reset) by the server, checked without blocking."""
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        if not readable:
+            return False
+        try:
+            # Between pipelines the server sends nothing, so readable means EOF or an error
+            return self._sock.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._stream = None
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+# --- Write-behind batching and read caching ---
+
+def _pairs(reply: Optional[List[str]]) -> List[Tuple[str, str]]:
+    reply = reply or []
+    return list(zip(reply[::2], reply[1::2]))
+
+
+class SharedState:
+    """Conversations, profiles and analytics counters shared between workers.
+
+    Writes only queue commands; ``run_flusher`` sends them to the backend in
+    batches from a worker thread, every ``flush_interval`` seconds or as soon
+    as ``flush_batch`` commands are queued. Counter increments are merged while
+    they wait, so a burst of requests costs one increment per counter per
+    flush. Reads block on the backend, so async code calls them through
+    ``asyncio.to_thread``. Analytics reads are cached for ``cache_ttl``
+    seconds; conversations are cached by ``ConversationStore``.
+    """
+
+    def __init__(
+        self,
+        backend: StateBackend,
+        flush_interval: Optional[float] = None,
+        flush_batch: Optional[int] = None,
+        cache_ttl: Optional[float] = None,
+        max_pending: int = 100_000,
+    ):
+        self.backend = backend
+        self.flush_interval = flush_interval if flush_interval is not None else settings.STATE_FLUSH_INTERVAL
+        self.flush_batch = flush_batch or settings.STATE_FLUSH_BATCH
+        self.cache_ttl = cache_ttl if cache_ttl is not None else settings.STATE_CACHE_TTL
+        self.max_pending = max_pending
+
+        self._pending: List[Command] = []
+        self._increments: Dict[Tuple[str, str, str], float] = defaultdict(float)
+        self._lock = threading.Lock()
+        # Serializes flushes so batches reach the backend in the order they were queued
+        self._flush_lock = threading.Lock()
+        self._cache: Dict[Any, Tuple[float, Any]] = {}
+        # Set while run_flusher is running, so a full buffer can wake it early
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+
+        self.flushes = 0
+        self.flushed_commands = 0
+        self.flush_errors = 0
+        self.dropped_commands = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # --- Writes ---
+
+    def _enqueue(self, commands: Sequence[Command] = (), increments: Sequence[Tuple[str, str, str, float]] = ()):
+        with self._lock:
+            self._pending.extend(commands)
+            for kind, key, field, amount in increments:
+                self._increments[(kind, key, field)] += amount
+            self._trim_pending()
+            due = len(self._pending) + len(self._increments) >= self.flush_batch
+        if due:
+            self._wake_flusher()
+
+    def _trim_pending(self):
+        # Called with _lock held: keeps memory bounded while the backend is down
+        # or the flusher is behind; oldest writes go first. Increments are never
+        # trimmed: they wait merged in _increments, one entry per counter
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped_commands += overflow
+
+    def _wake_flusher(self):
+        loop, wake = self._loop, self._wake
+        if loop is not None and wake is not None and not wake.is_set():
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:  # The loop has already closed
+                pass
+
+    def flush(self) -> int:
+        """Sends every queued write to the backend; returns the number of commands."""
+        with self._flush_lock:
+            with self._lock:
+                writes = self._pending
+                increments = self._increments
+                self._pending = []
+                self._increments = defaultdict(float)
+            commands = list(writes)
+            for (kind, key, field), amount in increments.items():
+                if kind == "hash":
+                    commands.append(("HINCRBYFLOAT", key, field, _format_number(amount)))
+                else:
+                    commands.append(("ZINCRBY", key, _format_number(amount), field))
+            if not commands:
+                return 0
+            try:
+                self.backend.execute(commands)
+            except Exception as e:
+                logger.error(f"Shared state flush failed ({len(commands)} commands queued for retry): {e}")
+                self.flush_errors += 1
+                with self._lock:
+                    self._pending[:0] = writes
+                    # Merged back into the counters rather than queued as commands, so trimming never drops them
+                    for counter, amount in increments.items():
+                        self._increments[counter] += amount
+                    self._trim_pending()
+                return 0
+            self.flushes += 1
+            self.flushed_commands += len(commands)
+            return len(commands)
+
+    async def run_flusher(self):
+        """Flushes in a worker thread every ``flush_interval`` seconds, or sooner
+        once ``flush_batch`` commands are queued, until cancelled (run as a background task)."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                await asyncio.to_thread(self.flush)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop = None
+            self._wake = None
+
+    def close(self):
+        self.flush()
+        self.backend.close()
+
+    # --- Reads ---
+
+    def _read(self, commands: Sequence[Command], cache_key: Any = None) -> List[Any]:
+        # Blocking: flushes and queries the backend in the calling thread
+        now = time.monotonic()
+        if cache_key is not None:
+            cached = self._cache.get(cache_key)
+            if cached is not None and cached[0] > now:
+                self.cache_hits += 1
+                return cached[1]
+            self.cache_misses += 1
+        # Flush first so a worker always reads its own writes
+        self.flush()
+        replies = self.backend.execute(commands)
+        if cache_key is not None and self.cache_ttl > 0:
+            self._cache[cache_key] = (now + self.cache_ttl, replies)
+        return replies
+
+    # --- Conversations and profiles ---
+
+    @staticmethod
+    def _messages_key(user_id: str) -> str:
+        return f"conv:{user_id}:messages"
+
+    @staticmethod
+    def _profile_key(user_id: str) -> str:
+        return f"conv:{user_id}:profile"
+
+    def append_message(self, user_id: str, role: str, content: str, max_messages: int, ttl: float):
+        key = self._messages_key(user_id)
+        self._enqueue([
+            ("RPUSH", key, json.dumps({"role": role, "content": content}, ensure_ascii=False)),
+            ("LTRIM", key, -max_messages, -1),
+            ("EXPIRE", key, max(1, int(ttl))),
+        ])
+
+    def set_profile(self, user_id: str, content: str, ttl: float):
+        key = self._profile_key(user_id)
+        self._enqueue([("SET", key, content), ("EXPIRE", key, max(1, int(ttl)))])
+
+    def discard(self, user_id: str):
+        self._enqueue([("DEL", self._messages_key(user_id), self._profile_key(user_id))])
+
+    def load_conversation(self, user_id: str) -> Tuple[Optional[str], List[Dict[str, str]]]:
+        """Returns the user's profile (or None) and their retained messages."""
+        profile, messages = self._read([
+            ("GET", self._profile_key(user_id)),
+            ("LRANGE", self._messages_key(user_id), 0, -1),
+        ])
+        return profile, [json.loads(message) for message in messages or []]
+
+    # --- Analytics counters ---
+
+    def record_interaction(
+        self, user_id: str, query: str, response_time: float, response_length: int, latency_bucket: int
+    ):
+        self._enqueue(
+            commands=[
+                ("RPUSH", f"analytics:user:{user_id}:queries", query),
+                ("LTRIM", f"analytics:user:{user_id}:queries", -5, -1),
+            ],
+            increments=[
+                ("hash", "analytics:totals", "interactions", 1),
+                ("hash", "analytics:totals", "response_time", response_time),
+                ("hash", "analytics:totals", "response_time_sq", response_time * response_time),
+                ("hash", "analytics:totals", "query_length", len(query)),
+                ("hash", "analytics:totals", "response_length", response_length),
+                ("hash", "analytics:latency", str(latency_bucket), 1),
+                ("hash", f"analytics:user:{user_id}", "queries", 1),
+                ("hash", f"analytics:user:{user_id}", "response_time", response_time),
+                ("zset", "analytics:users", user_id, 1),
+            ],
+        )
+
+    def analytics_totals(self) -> Dict[str, Any]:
+        """Returns cluster-wide totals, unique users and latency bucket counts."""
+        totals, unique_users, latency = self._read(
+            [("HGETALL", "analytics:totals"), ("ZCARD", "analytics:users"), ("HGETALL", "analytics:latency")],
+            cache_key="totals",
+        )
+        return {
+            "totals": {field: float(value) for field, value in _pairs(totals)},
+            "unique_users": int(unique_users or 0),
+            "latency_buckets": {int(field): int(float(value)) for field, value in _pairs(latency)},
+        }
+
+    def user_stats(self, user_id: str) -> Optional[Dict[str, Any]]:
+        totals, queries = self._read(
+            [("HGETALL", f"analytics:user:{user_id}"), ("LRANGE", f"analytics:user:{user_id}:queries", 0, -1)],
+            cache_key=("user", user_id),
+        )
+        totals = {field: float(value) for field, value in _pairs(totals)}
+        if not totals:
+            return None
+        return {"queries": int(totals.get("queries", 0)), "response_time": totals.get("response_time", 0.0),
+                "recent_queries": list(queries or [])}
+
+    def top_users(self, limit: int) -> List[Tuple[str, int]]:
+        (reply,) = self._read([("ZREVRANGE", "analytics:users", 0, limit - 1, "WITHSCORES")], cache_key=("top", limit))
+        return [(member, int(float(score))) for member, score in _pairs(reply)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending) + len(self._increments)
+        return {
+            "backend": self.backend.name,
+            "pending_writes": pending,
+            "flushes": self.flushes,
+            "flushed_commands": self.flushed_commands,
+            "flush_errors": self.flush_errors,
+            "dropped_commands": self.dropped_commands,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+
+def create_shared_state() -> Optional[SharedState]:
+    """Builds the shared state configured by STATE_BACKEND (None for per-process memory)."""
+    kind = settings.STATE_BACKEND.lower()
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        return SharedState(SQLiteStateBackend())
+    if kind == "redis":
+        return SharedState(RedisStateBackend())
+    raise ValueError(f"Unknown STATE_BACKEND: {settings.STATE_BACKEND}")
+
+
+_shared_state: Optional[SharedState] = None
+_shared_state_lock = threading.Lock()
+
+
+def get_shared_state() -> Optional[SharedState]:
+    """Returns the process-wide shared state, creating it on first use."""
+    global _shared_state
+    with _shared_state_lock:
+        if _shared_state is None:
+            _shared_state = create_shared_state()
+        return _shared_state
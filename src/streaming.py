@@ -0,0 +1,44 @@
+import re
+from typing import List
+
+# Sentence terminators for English (. ! ?) and Bengali (। dari, ॥ double dari)
+_TERMINATORS = ".!?।॥"
+_CLOSERS = "\"')]}”’"
+
+# A sentence ends at a terminator run (plus any closing quotes/brackets) that is
+# followed by whitespace. Bengali dari and newlines end a sentence immediately.
+_BOUNDARY = re.compile(
+    rf"[{re.escape(_TERMINATORS)}]+[{re.escape(_CLOSERS)}]*(?=\s)|[।॥][{re.escape(_CLOSERS)}]*|\n+"
+)
+
+# Numbered or lettered list markers ("1.", "12.", "a.", "iv.") belong to the item that follows
+_LIST_MARKER = re.compile(r"^(?:\d{1,3}|[A-Za-z]|[ivxlcdm]{1,6})\.$", re.IGNORECASE)
+
+
+class SentenceSegmenter:
+    """Incrementally splits streamed model output into complete sentences."""
+
+    def __init__(self, min_length: int = 2):
+        self.min_length = min_length
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Adds a chunk of text and returns any sentences it completed."""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _BOUNDARY.finditer(self._buffer):
+            candidate = self._buffer[start:match.end()].strip()
+            # Avoid emitting fragments such as a lone "1." from a numbered list
+            if len(candidate) < self.min_length or _LIST_MARKER.match(candidate):
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        """Returns whatever text remains once the stream has ended."""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return [remainder] if remainder else []
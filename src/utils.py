@@ -1,7 +1,10 @@
+import atexit
 import logging
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
 
-def setup_logger(name: str = "agent-logger") -> logging.Logger:
+def setup_logger(name: str = "agent-logger", error_log: str = "error.log") -> logging.Logger:
     """Sets up a structured logger for the application."""
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
@@ -16,7 +19,25 @@ def setup_logger(name: str = "agent-logger") -> logging.Logger:
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(formatter)
         logger.addHandler(console_handler)
+
+        # Errors are also appended to error.log for deep inspection. A listener thread
+        # does the file writes, so logging an error never blocks the event loop on disk
+        file_handler = logging.FileHandler(error_log, encoding="utf-8", delay=True)
+        file_handler.setLevel(logging.ERROR)
+        file_handler.setFormatter(formatter)
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        listener = QueueListener(records, file_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        queue_handler = QueueHandler(records)
+        queue_handler.setLevel(logging.ERROR)
+        logger.addHandler(queue_handler)
         
     return logger
 
 logger = setup_logger()
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: ~4 chars per token for ASCII, ~2 for other scripts (e.g. Bengali)."""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
@@ -0,0 +1,149 @@
+import asyncio
+import re
+import time
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from src.config import settings
+from src.metrics import metrics
+from src.singleflight import Broadcast
+
+# Streams the reply to a transcript sentence by sentence, without committing it
+Generator = Callable[[str], AsyncIterator[str]]
+# Receives the final transcript, the full reply and the turn latency in seconds
+Committer = Callable[[str, str, float], None]
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def transcript_key(text: str) -> str:
+    """Normalizes a transcript so recognizer noise (case, punctuation, spacing) does not count as a change."""
+    return " ".join(_PUNCTUATION.sub(" ", text.lower()).split())
+
+
+class _Speculation:
+    """A reply being generated (and buffered) for one transcript."""
+
+    def __init__(self, key: str, source: AsyncIterator[str]):
+        self.key = key
+        self.broadcast = Broadcast()
+        self.task = asyncio.ensure_future(self.broadcast.run(source))
+
+    def cancel(self):
+        self.task.cancel()
+
+
+class VoiceSession:
+    """Speculative reply generation for one customer's voice session.
+
+    Interim transcripts are watched for stability: once the same text has been
+    heard for ``stable_after`` seconds, a reply is generated in the background
+    and buffered. A later interim that differs cancels it. When the final
+    transcript arrives, a speculation for the same text is adopted, so its
+    buffered sentences go out at once; otherwise generation starts from the
+    final text. At most ``max_speculations`` are started per utterance, which
+    bounds the extra upstream calls a hesitant speaker can cause.
+
+    Replies are only committed (to memory and analytics) for final
+    transcripts, and turns are handled one at a time.
+    """
+
+    def __init__(
+        self,
+        generate: Generator,
+        commit: Committer,
+        stable_after: Optional[float] = None,
+        max_speculations: Optional[int] = None,
+    ):
+        self.generate = generate
+        self.commit = commit
+        self.stable_after = settings.VOICE_STABLE_AFTER if stable_after is None else stable_after
+        self.max_speculations = settings.VOICE_MAX_SPECULATIONS if max_speculations is None else max_speculations
+        self._speculation: Optional[_Speculation] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._interim_key = ""
+        self._started = 0
+        self.speculations = 0
+        self.adopted = 0
+        self.discarded = 0
+        self.turns = 0
+
+    def interim(self, text: str):
+        """Handles an interim transcript; may start or cancel a speculation."""
+        key = transcript_key(text)
+        if not key or key == self._interim_key:
+            return
+        self._interim_key = key
+        if self._speculation is not None and self._speculation.key != key:
+            self._discard()
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._started < self.max_speculations:
+            self._timer = asyncio.get_running_loop().call_later(self.stable_after, self._speculate, key, text)
+
+    async def final(self, text: str) -> AsyncIterator[str]:
+        """Streams the reply to a final transcript and commits the turn."""
+        start = time.perf_counter()
+        key = transcript_key(text)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        speculation = self._speculation
+        self._speculation = None
+        if speculation is not None and speculation.key == key:
+            self.adopted += 1
+            metrics.inc("omniserve_voice_speculations_total", outcome="adopted")
+        else:
+            if speculation is not None:
+                self._discard(speculation)
+            speculation = _Speculation(key, self.generate(text))
+
+        self._interim_key = ""
+        self._started = 0
+        sentences = []
+        try:
+            async for sentence in speculation.broadcast.subscribe():
+                sentences.append(sentence)
+                yield sentence
+        finally:
+            speculation.cancel()
+        self.turns += 1
+        self.commit(text, " ".join(sentences), time.perf_counter() - start)
+
+    async def close(self):
+        """Cancels any pending speculation (e.g. when the client disconnects)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._speculation is not None:
+            task = self._speculation.task
+            self._discard()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _speculate(self, key: str, text: str):
+        self._timer = None
+        if key != self._interim_key or self._started >= self.max_speculations:
+            return
+        if self._speculation is not None:
+            if self._speculation.key == key:
+                return
+            self._discard()
+        self._started += 1
+        self.speculations += 1
+        self._speculation = _Speculation(key, self.generate(text))
+
+    def _discard(self, speculation: Optional[_Speculation] = None):
+        speculation = speculation or self._speculation
+        if speculation is self._speculation:
+            self._speculation = None
+        speculation.cancel()
+        self.discarded += 1
+        metrics.inc("omniserve_voice_speculations_total", outcome="discarded")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "turns": self.turns,
+            "speculations": self.speculations,
+            "adopted": self.adopted,
+            "discarded": self.discarded,
+        }
@@ -69,6 +69,10 @@ document.addEventListener('DOMContentLoaded', () => {
             if (interimTranscript) {
                 userInput.value = interimTranscript;
                 userInput.style.fontStyle = 'italic';
+                // Lets the server start answering once the transcript stops changing
+                if (voiceSessionOpen()) {
+                    voiceSocket.send(JSON.stringify({ type: 'interim', text: interimTranscript }));
+                }
             }
 
             // When final, send the message
@@ -95,11 +99,11 @@ document.addEventListener('DOMContentLoaded', () => {
         };
     }
 
-    const speak = (text) => {
+    const speak = (text, queue = false) => {
         if (!autoSpeakCheck.checked) return;
 
-        // Cancel any ongoing speech
-        window.speechSynthesis.cancel();
+        // Cancel any ongoing speech unless this continues a streamed answer
+        if (!queue) window.speechSynthesis.cancel();
 
         const utterance = new SpeechSynthesisUtterance(text);
         utterance.lang = languageSelect.value;
@@ -159,6 +163,23 @@ document.addEventListener('DOMContentLoaded', () => {
         msgDiv.innerHTML = `<div class="bubble">${text}</div>`;
         chatMessages.appendChild(msgDiv);
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        return msgDiv.querySelector('.bubble');
+    };
+
+    // Renders one streamed reply event into reply.bubble and speaks each sentence
+    const handleReplyEvent = (reply, event) => {
+        if (event.type === 'sentence') {
+            reply.bubble.textContent += (reply.bubble.textContent ? ' ' : '') + event.text;
+            speak(event.text, reply.spoken++ > 0);
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        } else if (event.type === 'done') {
+            console.log("Server Response:", event);
+            if (!reply.bubble.textContent) {
+                reply.bubble.textContent = "Error: Received undefined response from server.";
+            }
+        } else if (event.type === 'error') {
+            reply.bubble.textContent = `Error: ${event.error}`;
+        }
     };
 
     const updateStatus = (online, message) => {
@@ -171,6 +192,35 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // --- Voice Session (one WebSocket per customer session) ---
+
+    let voiceSocket = null;
+    let voiceReply = null;  // The reply currently streaming over the socket
+
+    const voiceSessionOpen = () => voiceSocket !== null && voiceSocket.readyState === WebSocket.OPEN;
+
+    const openVoiceSession = (userId, apiKey) => {
+        if (voiceSocket) voiceSocket.close();
+        const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const socket = new WebSocket(`${protocol}://${window.location.host}/ws/session`);
+
+        socket.onopen = () => {
+            socket.send(JSON.stringify({ type: 'start', user_id: userId, api_key: apiKey }));
+        };
+        socket.onmessage = (message) => {
+            const event = JSON.parse(message.data);
+            if (event.type === 'ready') return;
+            if (!voiceReply) voiceReply = { bubble: addMessage('assistant', ''), spoken: 0 };
+            handleReplyEvent(voiceReply, event);
+            if (event.type === 'done' || event.type === 'error') voiceReply = null;
+        };
+        // Falls back to HTTP streaming if the session drops
+        socket.onclose = () => {
+            if (voiceSocket === socket) voiceSocket = null;
+        };
+        voiceSocket = socket;
+    };
+
     // --- API Calls ---
 
     const initializeAgent = async () => {
@@ -186,6 +236,7 @@ document.addEventListener('DOMContentLoaded', () => {
         updateStatus(false, lang === 'bn-BD' ? 'সংযুক্ত হচ্ছে...' : 'Connecting...');
 
         updateStatus(true, 'Agent Online');
+        openVoiceSession(userId, apiKey);
 
         const welcomeMsg = lang === 'bn-BD'
             ? `OmniServe AI গ্রাহক <strong>${userId}</strong> এর জন্য প্রস্তুত। আমি আপনাকে কীভাবে সাহায্য করতে পারি?`
@@ -208,22 +259,44 @@ document.addEventListener('DOMContentLoaded', () => {
         addMessage('user', text);
         userInput.value = '';
 
+        if (voiceSessionOpen()) {
+            voiceReply = { bubble: addMessage('assistant', ''), spoken: 0 };
+            voiceSocket.send(JSON.stringify({ type: 'final', text }));
+            return;
+        }
+
         try {
-            const response = await fetch('/chat', {
+            const response = await fetch('/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ query: text, user_id: userId, api_key: apiKey })
             });
-            const data = await response.json();
-            console.log("Server Response:", data);
 
-            if (data.response) {
-                addMessage('assistant', data.response);
-                speak(data.response);
-            } else if (data.detail) {
-                addMessage('assistant', `Error: ${data.detail}`);
-            } else {
-                addMessage('assistant', "Error: Received undefined response from server.");
+            if (!response.ok || !response.body) {
+                const data = await response.json();
+                addMessage('assistant', `Error: ${data.detail || 'Received undefined response from server.'}`);
+                return;
+            }
+
+            // Render and speak each sentence as soon as the server flushes it
+            const reply = { bubble: addMessage('assistant', ''), spoken: 0 };
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            const handleEvent = (event) => handleReplyEvent(reply, event);
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+            }
+            if (buffer.trim()) handleEvent(JSON.parse(buffer));
+
+            if (!reply.bubble.textContent) {
+                reply.bubble.textContent = "Error: Received undefined response from server.";
             }
         } catch (error) {
             addMessage('assistant', 'Error: Could not reach the server.');
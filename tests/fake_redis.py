@@ -0,0 +1,165 @@
+"""
+In-process fake Redis server for testing RedisStateBackend.
+Speaks RESP over a real socket and implements only the commands SharedState uses.
+"""
+import socket
+import socketserver
+import threading
+import time
+
+from src.state import read_reply
+
+
+def _encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return b"-ERR %s\r\n" % str(reply).encode("utf-8")
+    if isinstance(reply, bool):
+        reply = int(reply)
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+    if reply == "OK" or reply == "PONG":
+        return b"+%s\r\n" % reply.encode("utf-8")
+    data = str(reply).encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _slice(items, start: int, stop: int):
+    length = len(items)
+    start = max(length + start, 0) if start < 0 else start
+    stop = length + stop if stop < 0 else stop
+    return items[start:stop + 1]
+
+
+class FakeRedisServer:
+    """A threaded RESP server on an ephemeral localhost port."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.commands = []
+        self.lock = threading.Lock()
+        # When set, the connection is closed after applying a command instead of replying
+        self.drop_before_reply = False
+        self.connections = []
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake.connections.append(self.connection)
+                while True:
+                    try:
+                        command = read_reply(self.rfile)
+                    except (ConnectionError, OSError, ValueError):
+                        return
+                    reply = fake.dispatch(command)
+                    if fake.drop_before_reply:
+                        return
+                    self.wfile.write(_encode(reply))
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"redis://127.0.0.1:{self.port}/0"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def disconnect_clients(self):
+        """Closes every open client connection, as a server does with idle clients."""
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.connections = []
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def dispatch(self, command):
+        name, args = command[0].upper(), command[1:]
+        with self.lock:
+            self.commands.append(name)
+            if args and args[0] in self.expires and self.expires[args[0]] <= time.time():
+                self.data.pop(args[0], None)
+                self.expires.pop(args[0], None)
+            handler = getattr(self, f"cmd_{name.lower()}", None)
+            if handler is None:
+                return Exception(f"unknown command '{name}'")
+            return handler(*args)
+
+    def cmd_ping(self):
+        return "PONG"
+
+    def cmd_select(self, db):
+        return "OK"
+
+    def cmd_get(self, key):
+        return self.data.get(key)
+
+    def cmd_set(self, key, value):
+        self.data[key] = value
+        self.expires.pop(key, None)
+        return "OK"
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            removed += self.data.pop(key, None) is not None
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_expire(self, key, seconds):
+        if key not in self.data:
+            return 0
+        self.expires[key] = time.time() + float(seconds)
+        return 1
+
+    def cmd_rpush(self, key, *values):
+        items = self.data.setdefault(key, [])
+        items.extend(values)
+        return len(items)
+
+    def cmd_ltrim(self, key, start, stop):
+        if key in self.data:
+            self.data[key] = _slice(self.data[key], int(start), int(stop))
+        return "OK"
+
+    def cmd_lrange(self, key, start, stop):
+        return _slice(self.data.get(key, []), int(start), int(stop))
+
+    def cmd_hincrbyfloat(self, key, field, amount):
+        fields = self.data.setdefault(key, {})
+        fields[field] = fields.get(field, 0.0) + float(amount)
+        return _number(fields[field])
+
+    def cmd_hgetall(self, key):
+        reply = []
+        for field, value in self.data.get(key, {}).items():
+            reply.extend((field, _number(value)))
+        return reply
+
+    def cmd_zincrby(self, key, amount, member):
+        scores = self.data.setdefault(key, {})
+        scores[member] = scores.get(member, 0.0) + float(amount)
+        return _number(scores[member])
+
+    def cmd_zrevrange(self, key, start, stop, *options):
+        ranked = sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]), reverse=True)
+        reply = []
+        for member, score in _slice(ranked, int(start), int(stop)):
+            reply.append(member)
+            if options:
+                reply.append(_number(score))
+        return reply
+
+    def cmd_zcard(self, key):
+        return len(self.data.get(key, {}))
@@ -0,0 +1,117 @@
+"""
+Unit tests for admission control (rate limits, fair queuing, concurrency)
+Run with: pytest tests/test_admission.py -v
+"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+from src.admission import AdmissionController, AdmissionRejected
+from src.config import settings
+from src.pool import AgentPool
+
+
+class TestRateLimits:
+    """Test suite for per-user token buckets"""
+
+    def test_burst_then_reject(self):
+        """Test that a user gets their burst and is then told when to retry"""
+        admission = AdmissionController(user_rate=0.5, user_burst=3)
+        for _ in range(3):
+            admission.check("noisy")
+        with pytest.raises(AdmissionRejected) as rejected:
+            admission.check("noisy")
+        assert rejected.value.status_code == 429
+        assert rejected.value.headers == {"Retry-After": "2"}
+        # Other users are unaffected
+        admission.check("quiet")
+        assert admission.stats()["rejected"]["rate_limited"] == 1
+
+    def test_zero_rate_disables_limits(self):
+        """Test that USER_RATE 0 turns per-user limiting off"""
+        admission = AdmissionController(user_rate=0, user_burst=1)
+        for _ in range(100):
+            admission.check("user1")
+
+
+class TestFairQueue:
+    """Test suite for the concurrency limit and round-robin queue"""
+
+    @pytest.mark.asyncio
+    async def test_round_robin_between_users(self):
+        """Test that a burst from one user does not starve another"""
+        admission = AdmissionController(max_concurrency=1, user_rate=0, max_queue=10, queue_timeout=5)
+        order = []
+
+        async def call(user_id, i):
+            async with admission.slot(user_id):
+                order.append(f"{user_id}{i}")
+                await asyncio.sleep(0.01)
+
+        await admission.acquire("holder")
+        tasks = [asyncio.create_task(call("a", i)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("b", 0)))
+        await asyncio.sleep(0)
+        assert admission.stats()["queue_depth"] == 4
+        admission.release()
+        await asyncio.gather(*tasks)
+
+        assert order == ["a0", "b0", "a1", "a2"]
+        stats = admission.stats()
+        assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+        assert stats["max_queue_wait"] > 0
+
+    @pytest.mark.asyncio
+    async def test_queue_full_and_timeout(self):
+        """Test that overload is rejected fast with 503 and Retry-After"""
+        admission = AdmissionController(max_concurrency=1, user_rate=0, max_queue=1, queue_timeout=0.05)
+        await admission.acquire("holder")
+        waiter = asyncio.create_task(admission.acquire("u1"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as full:
+            admission.check("u2")
+        assert full.value.status_code == 503 and "Retry-After" in full.value.headers
+
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await waiter
+        assert timed_out.value.reason == "Timed out waiting for capacity"
+        assert admission.stats()["rejected"] == {"rate_limited": 0, "queue_full": 1, "queue_timeout": 1}
+        assert admission.stats()["queue_depth"] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        """Test that a disconnected client neither leaks a slot nor blocks the queue"""
+        admission = AdmissionController(max_concurrency=1, user_rate=0, max_queue=10, queue_timeout=5)
+        await admission.acquire("holder")
+        waiter = asyncio.create_task(admission.acquire("gone"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        admission.release()
+        assert admission.stats()["in_flight"] == 0
+        await asyncio.wait_for(admission.acquire("next"), 1)
+
+
+class TestAdmissionEndpoints:
+    """Test that the API surfaces rejections properly"""
+
+    def test_chat_rate_limited(self, monkeypatch):
+        """Test that /chat answers 429 with Retry-After once the burst is spent"""
+        monkeypatch.setattr(settings, "LLM_BACKEND", "fake")
+        monkeypatch.setattr(settings, "FAKE_LLM_LATENCY", "none")
+        monkeypatch.setattr(app_module, "agent_pool", AgentPool())
+        monkeypatch.setattr(app_module, "admission", AdmissionController(user_rate=0.1, user_burst=1))
+        client = TestClient(app_module.app)
+
+        body = {"query": "Hello", "user_id": "noisy"}
+        assert client.post("/chat", json=body).status_code == 200
+        response = client.post("/chat", json=body)
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "10"
+        assert client.post("/chat/stream", json=body).status_code == 429
+        assert client.get("/analytics/admission").json()["rejected"]["rate_limited"] == 2
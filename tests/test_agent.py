@@ -5,6 +5,7 @@ Run with: pytest tests/test_agent.py -v
 
 import pytest
 from src.agent import CustomerSupportAgent
+from src.backends import FakeBackend
 from src.config import settings
 
 class TestCustomerSupportAgent:
@@ -12,13 +13,13 @@ class TestCustomerSupportAgent:
     
     @pytest.fixture
     def agent(self):
-        """Create an agent instance for testing"""
-        return CustomerSupportAgent()
+        """Create an agent instance backed by the offline fake model"""
+        return CustomerSupportAgent(backend=FakeBackend())
     
     def test_agent_initialization(self, agent):
         """Test that agent initializes correctly"""
         assert agent is not None
-        assert agent.client is not None
+        assert agent.backend is not None
         assert agent.conversations == {}
     
     def test_handle_query_basic(self, agent):
@@ -33,7 +34,9 @@ class TestCustomerSupportAgent:
         agent.handle_query("My name is John", "test_user_2")
         response = agent.handle_query("What's my name?", "test_user_2")
         
-        assert "john" in response.lower()
+        # The earlier turn is sent to the model as history
+        assert isinstance(response, str)
+        assert agent.backend.last_history[0] == {"role": "user", "parts": ["My name is John"]}
         assert len(agent.conversations["test_user_2"]) >= 4  # 2 queries + 2 responses
     
     def test_multiple_users(self, agent):
@@ -114,6 +117,9 @@ class TestAnalytics:
         assert stats["total_interactions"] == 2
         assert stats["unique_users"] == 2
         assert stats["avg_response_time"] > 0
+        assert stats["min_response_time"] == 0.3
+        assert stats["max_response_time"] == 0.5
+        assert 0.3 <= stats["p50_response_time"] <= stats["p99_response_time"] <= 0.51
     
     def test_user_stats(self, analytics_tracker):
         """Test user-specific statistics"""
@@ -124,6 +130,24 @@ class TestAnalytics:
         
         assert user_stats["total_queries"] == 2
         assert user_stats["avg_response_time"] > 0
+
+    def test_approximate_mode_bounds_user_stats(self, monkeypatch):
+        """Test that approximate mode keeps only the most recently active users and estimates unique users"""
+        from src.analytics import AnalyticsTracker
+        from src.interaction_log import InteractionLog
+        monkeypatch.setattr(settings, "TOP_USERS_MODE", "approximate")
+        monkeypatch.setattr(settings, "TOP_USERS_CAPACITY", 10)
+        tracker = AnalyticsTracker(InteractionLog(segment_dir=""))
+        tracker.log_interaction("regular", "q", "r", 0.1)
+        for i in range(500):
+            tracker.log_interaction(f"user{i}", "q", "r", 0.1)
+            if i % 50 == 0:
+                tracker.log_interaction("regular", "q", "r", 0.1)
+
+        assert len(tracker.user_stats) == 10
+        assert tracker.get_user_stats("user0") == {"error": "User not found"}
+        assert tracker.get_user_stats("user499")["total_queries"] == 1
+        assert tracker.get_summary_stats()["unique_users"] == pytest.approx(501, rel=0.1)
     
     def test_top_users(self, analytics_tracker):
         """Test top users ranking"""
@@ -139,3 +163,361 @@ class TestAnalytics:
         assert len(top_users) == 2
         assert top_users[0]["user_id"] == "user3"
         assert top_users[0]["total_queries"] == 3
+
+
+class TestAsyncAgent:
+    """Test suite for the non-blocking agent API"""
+
+    @pytest.fixture
+    def agent(self):
+        """Create an agent backed by a fake model with a little latency"""
+        return CustomerSupportAgent(backend=FakeBackend(latency="fixed:0.01", chunk_size=10), max_concurrency=2)
+
+    @pytest.mark.asyncio
+    async def test_handle_query_async(self, agent):
+        """Test async query handling updates memory"""
+        response = await agent.handle_query_async("Hello", "async_user")
+        assert response == "You said: Hello. How else can I help?"
+        assert len(agent.conversations["async_user"]) == 2
+
+    @pytest.mark.asyncio
+    async def test_upstream_concurrency_limit(self, agent):
+        """Test that in-flight upstream calls never exceed the configured limit"""
+        import asyncio
+        await asyncio.gather(*(agent.handle_query_async(f"q{i}", f"user_{i}") for i in range(6)))
+        assert agent.backend.peak_in_flight == 2
+
+    @pytest.mark.asyncio
+    async def test_retry_backoff_frees_the_upstream_slot(self, monkeypatch):
+        """Test that a request waiting to retry does not hold a concurrency slot"""
+        import asyncio
+        import src.deadlines
+        monkeypatch.setattr(settings, "UPSTREAM_RETRY_BASE_DELAY", 0.2)
+        monkeypatch.setattr(src.deadlines.random, "uniform", lambda low, high: high)
+        agent = CustomerSupportAgent(backend=FakeBackend(), max_concurrency=1)
+        send = agent.backend.send_async
+        finished = []
+
+        async def flaky(history, message, timeout=None):
+            if message == "flaky" and "flaky" not in finished:
+                finished.append("flaky")
+                raise RuntimeError("503 Service Unavailable")
+            return await send(history, message, timeout=timeout)
+
+        agent.backend.send_async = flaky
+        retried = asyncio.create_task(agent.handle_query_async("flaky", "user_a"))
+        await asyncio.sleep(0.05)
+        # user_a is backing off; user_b gets the only slot straight away
+        assert await asyncio.wait_for(agent.handle_query_async("steady", "user_b"), 0.1) == (
+            "You said: steady. How else can I help?"
+        )
+        assert not retried.done()
+        assert await retried == "You said: flaky. How else can I help?"
+
+    @pytest.mark.asyncio
+    async def test_handle_query_stream(self, agent):
+        """Test streamed sentences and that the full answer is remembered"""
+        agent.backend.responses = {"order": "Sure. Your order ships tomorrow! আপনার অর্ডার পাঠানো হয়েছে।"}
+        sentences = [s async for s in agent.handle_query_stream("Where is my order?", "stream_user")]
+        assert sentences == ["Sure.", "Your order ships tomorrow!", "আপনার অর্ডার পাঠানো হয়েছে।"]
+        assert agent.conversations["stream_user"][-1]["content"] == (
+            "Sure. Your order ships tomorrow! আপনার অর্ডার পাঠানো হয়েছে।"
+        )
+
+    @pytest.mark.asyncio
+    async def test_profiles_are_cached_until_refreshed(self, agent):
+        """Test that repeat requests reuse the profile and never duplicate it in memory"""
+        first = await agent.generate_synthetic_profile_async("cached_profile_user")
+        again = await agent.generate_synthetic_profile_async("cached_profile_user")
+        assert again == first and agent.backend.calls == 1
+        await agent.generate_synthetic_profile_async("cached_profile_user", refresh=True)
+        assert agent.backend.calls == 2
+        assert [m["role"] for m in agent.conversations["cached_profile_user"]] == ["system"]
+
+    @pytest.mark.asyncio
+    async def test_batched_profiles_use_one_prompt(self, agent):
+        """Test that several profiles come from a single upstream call"""
+        profiles = await agent.generate_profiles_batched_async(["b1", "b2", "b3"])
+        assert all(profile["name"] for profile in profiles.values())
+        assert agent.backend.calls == 1
+        assert "b2" in agent.conversations
+
+    def test_local_profile_generator(self, monkeypatch):
+        """Test that PROFILE_GENERATOR=local never calls the model"""
+        monkeypatch.setattr(settings, "PROFILE_GENERATOR", "local")
+        agent = CustomerSupportAgent(backend=FakeBackend())
+        profile = agent.generate_synthetic_profile("local_user")
+        assert profile["customer_id"] == "local_user"
+        assert agent.backend.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_generate_profile_async(self, agent):
+        """Test async profile generation stores the profile as context"""
+        profile = await agent.generate_synthetic_profile_async("profile_user")
+        assert profile["name"]
+        assert agent.conversations["profile_user"][0]["role"] == "system"
+
+    @pytest.mark.asyncio
+    async def test_deadline_reaches_the_backend(self, agent):
+        """Test that the remaining budget is passed down and an exhausted one raises"""
+        from src.deadlines import Deadline, DeadlineExceeded
+        await agent.handle_query_async("Hello", "deadline_user", deadline=Deadline(5))
+        assert 0 < agent.backend.last_timeout <= 5
+
+        agent.backend._sample_latency = lambda rng: 1.0
+        with pytest.raises(DeadlineExceeded):
+            await agent.handle_query_async("Hello again", "deadline_user", deadline=Deadline(0.05))
+        assert len(agent.conversations["deadline_user"]) == 2
+
+    @pytest.mark.asyncio
+    async def test_injected_errors_are_reported(self):
+        """Test that upstream failures become an error message and are not remembered"""
+        agent = CustomerSupportAgent(backend=FakeBackend(error_rate=1.0))
+        response = await agent.handle_query_async("Hello", "error_user")
+        assert "error" in response.lower()
+        assert "error_user" not in agent.conversations
+
+    def test_error_log_written_by_listener_thread(self, tmp_path):
+        """Test that logged errors reach the error log file without the caller writing it"""
+        import time
+        from src.utils import setup_logger
+        path = tmp_path / "error.log"
+        error_logger = setup_logger("error-log-test", error_log=str(path))
+        error_logger.info("not an error")
+        error_logger.error("upstream failed")
+        for _ in range(100):
+            if path.exists() and "upstream failed" in path.read_text(encoding="utf-8"):
+                break
+            time.sleep(0.01)
+        assert "upstream failed" in path.read_text(encoding="utf-8")
+        assert "not an error" not in path.read_text(encoding="utf-8")
+
+    @pytest.mark.asyncio
+    async def test_stream_errors_are_raised_not_streamed(self):
+        """Test that a failed stream raises with the user-facing message instead of yielding it as a reply"""
+        from src.agent import UpstreamError
+        agent = CustomerSupportAgent(backend=FakeBackend(error_rate=1.0))
+        with pytest.raises(UpstreamError, match="encountered an error"):
+            async for _ in agent.handle_query_stream("Hello", "error_user"):
+                pass
+        assert "error_user" not in agent.conversations
+
+
+class TestSentenceSegmenter:
+    """Test suite for streamed sentence segmentation"""
+
+    def test_english_and_bengali_boundaries(self):
+        """Test splitting across chunk boundaries in both languages"""
+        from src.streaming import SentenceSegmenter
+        segmenter = SentenceSegmenter()
+        sentences = []
+        for chunk in ["Hello the", "re. It costs 3.5 dollars", "! ধন্যবাদ। আর কিছু", "?"]:
+            sentences += segmenter.feed(chunk)
+        assert sentences == ["Hello there.", "It costs 3.5 dollars!", "ধন্যবাদ।"]
+        assert segmenter.flush() == ["আর কিছু?"]
+
+    def test_list_markers_stay_with_their_item(self):
+        """Test that "1." and "a." are not emitted as sentences of their own"""
+        from src.streaming import SentenceSegmenter
+        segmenter = SentenceSegmenter()
+        sentences = []
+        for chunk in ["Steps:\n1", ". Open the app. 2. Tap Orders.", " a. Pick one. 12", ". Done.\n"]:
+            sentences += segmenter.feed(chunk)
+        assert sentences == ["Steps:", "1. Open the app.", "2. Tap Orders.", "a. Pick one.", "12. Done."]
+
+
+class TestAgentPool:
+    """Test suite for the per-key agent pool"""
+
+    @pytest.fixture
+    def pool(self):
+        """Create a small pool"""
+        from src.pool import AgentPool
+        return AgentPool(max_size=2, idle_ttl=60)
+
+    def test_reuses_agent_per_key(self, pool):
+        """Test that the same key returns the same agent"""
+        assert pool.get("key-a") is pool.get("key-a")
+        assert pool.get("key-a") is not pool.get("key-b")
+        assert pool.stats()["misses"] == 2
+
+    def test_conversations_survive_key_switch(self, pool):
+        """Test that memory is shared across agents in the pool"""
+        pool.get("key-a")._remember("user1", "hi", "hello")
+        assert pool.get("key-b").get_user_memories("user1") == ["user: hi", "assistant: hello"]
+
+    def test_keyless_request_never_borrows_another_key(self, pool, monkeypatch):
+        """Test that a request without a key is rejected rather than served by a customer's agent"""
+        from src.backends import MissingAPIKeyError
+        monkeypatch.setattr(settings, "LLM_BACKEND", "gemini")
+        monkeypatch.setattr(settings, "LLM_PROVIDERS", "gemini")
+        monkeypatch.setattr(settings, "GOOGLE_API_KEY", "")
+        pool.get("key-a")
+        with pytest.raises(MissingAPIKeyError):
+            pool.get()
+
+    def test_lru_and_idle_eviction(self, pool):
+        """Test that the pool stays bounded"""
+        first = pool.get("key-a")
+        pool.get("key-b")
+        pool.get("key-c")
+        assert len(pool) == 2
+        assert pool.get("key-a") is not first
+
+        pool.idle_ttl = 0
+        import time
+        time.sleep(0.01)
+        pool.get("key-d")
+        assert len(pool) == 1
+
+    def test_slow_build_blocks_only_its_own_key(self, pool, monkeypatch):
+        """Test that concurrent gets build an agent once, and other keys are served meanwhile"""
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        import src.pool
+        release = threading.Event()
+        builds = []
+
+        def build(api_key=None, **kwargs):
+            builds.append(api_key)
+            if api_key == "slow-key":
+                assert release.wait(5)
+            return CustomerSupportAgent(api_key=api_key, backend=FakeBackend(), **kwargs)
+
+        monkeypatch.setattr(src.pool, "CustomerSupportAgent", build)
+        with ThreadPoolExecutor(4) as executor:
+            slow = [executor.submit(pool.get, "slow-key") for _ in range(3)]
+            # The lock is free while "slow-key" is being built
+            assert executor.submit(pool.get, "key-a").result(timeout=5) is pool.get("key-a")
+            assert not any(future.done() for future in slow)
+            release.set()
+            agents = {id(future.result(timeout=5)) for future in slow}
+        assert len(agents) == 1
+        assert builds.count("slow-key") == 1
+        assert pool.stats()["misses"] == 2
+
+
+class TestInteractionLog:
+    """Test suite for the bounded interaction log"""
+
+    def test_ring_spills_to_segments(self, tmp_path):
+        """Test that old records leave memory but stay readable from disk"""
+        from src.interaction_log import InteractionLog
+        log = InteractionLog(capacity=5, segment_dir=str(tmp_path), segment_max_bytes=300, max_segments=100)
+        for i in range(10):
+            log.append(f"user{i}", f"query {i}", f"response {i}", 0.1 * i, 1_700_000_000 + i)
+
+        # Appends only queue the evicted records; the writer puts them on disk
+        assert list(tmp_path.iterdir()) == []
+        assert len(log) == 10
+        assert log.spilled == 5
+        assert [r["query"] for r in log.recent(7)] == [f"query {i}" for i in range(3, 10)]
+        assert log.flush() == 5
+        assert len(list(tmp_path.iterdir())) > 1  # segments were rolled
+        recent = log.recent(7)
+        assert [r["query"] for r in recent] == [f"query {i}" for i in range(3, 10)]
+        assert recent[-1]["response_time"] == pytest.approx(0.9)
+        assert recent[0]["query_length"] == len("query 3")
+        log.close()
+
+    def test_segments_survive_restart_and_retention(self, tmp_path):
+        """Test that a new process counts and reads old segments, and deleted segments stop counting"""
+        from src.interaction_log import InteractionLog
+        log = InteractionLog(capacity=2, segment_dir=str(tmp_path), segment_max_bytes=300, max_segments=100)
+        for i in range(8):
+            log.append("u", f"query {i}", "r", 0.1, 1_700_000_000 + i)
+            log.flush()
+        log.close()
+
+        reopened = InteractionLog(capacity=2, segment_dir=str(tmp_path), segment_max_bytes=300, max_segments=2)
+        assert len(reopened) == 6
+        assert [r["query"] for r in reopened.recent(3)] == ["query 3", "query 4", "query 5"]
+
+        for i in range(8, 20):
+            reopened.append("u", f"query {i}", "r", 0.1, 1_700_000_000 + i)
+            reopened.flush()
+        on_disk = sum(1 for _ in reopened.iter_spilled())
+        assert len(list(tmp_path.iterdir())) <= 3
+        assert reopened.spilled == on_disk < 18
+        assert len(reopened) == on_disk + 2
+        reopened.close()
+
+    def test_torn_tail_record_is_truncated(self, tmp_path):
+        """Test that a record cut short by a crash is dropped when the segment is reopened"""
+        from src.interaction_log import InteractionLog
+        log = InteractionLog(capacity=1, segment_dir=str(tmp_path), max_segments=100)
+        for i in range(4):
+            log.append("u", f"query {i}", "r", 0.1, 1_700_000_000 + i)
+            log.flush()
+        log.close()
+        segment = next(tmp_path.iterdir())
+        intact = segment.stat().st_size
+        with open(segment, "ab") as f:
+            f.write(b'{"user_id": "u", "query": "torn')
+
+        reopened = InteractionLog(capacity=1, segment_dir=str(tmp_path), max_segments=100)
+        assert [r["query"] for r in reopened.recent(4)] == ["query 0", "query 1", "query 2"]
+        assert segment.stat().st_size == intact
+        for i in (4, 5):
+            reopened.append("u", f"query {i}", "r", 0.1, 1_700_000_000 + i)
+            reopened.flush()
+        assert [r["query"] for r in reopened.recent(5)] == ["query 0", "query 1", "query 2", "query 4", "query 5"]
+        reopened.close()
+
+    def test_ring_without_spill_is_bounded(self):
+        """Test that records are dropped when no segment directory is set"""
+        from src.interaction_log import InteractionLog
+        log = InteractionLog(capacity=3, segment_dir="")
+        for i in range(5):
+            log.append("u", "q" * 1000, "r", 0.1, 1_700_000_000 + i)
+        assert len(log) == 3
+        assert log.recent(10)[0]["query_length"] == 1000
+        assert len(log.recent(10)[0]["query"]) == log.max_text_length
+
+
+class TestResponseCache:
+    """Test suite for the first-turn response cache"""
+
+    @pytest.fixture
+    def agent(self):
+        """Create an agent with a response cache"""
+        from src.cache import ResponseCache
+        return CustomerSupportAgent(backend=FakeBackend(), response_cache=ResponseCache(max_entries=2, ttl=60))
+
+    def test_normalization_and_language(self):
+        """Test that trivial variants share a key but languages do not"""
+        from src.cache import ResponseCache, detect_language
+        assert ResponseCache.key("ns", "What is the return window?") == ResponseCache.key("ns", "  what is the RETURN window ")
+        assert detect_language("ফেরত নীতি কী?") == "bn"
+        assert ResponseCache.key("ns", "ফেরত নীতি কী?")[1] == "bn"
+
+    def test_first_turn_answers_are_cached(self, agent):
+        """Test that repeated first-turn questions skip the upstream call"""
+        first = agent.handle_query("What is your return window?", "cache_user_1")
+        second = agent.handle_query("what is your return window", "cache_user_2")
+        assert first == second
+        assert agent.backend.calls == 1
+        assert agent.response_cache.stats()["hits"] == 1
+        # The cached answer still becomes part of the customer's history
+        assert len(agent.conversations["cache_user_2"]) == 2
+
+    def test_users_with_context_bypass_cache(self, agent):
+        """Test that history or a profile disables the cache"""
+        agent.handle_query("What is your return window?", "cache_user_1")
+        agent.conversations.set_profile("cache_user_3", "Customer Profile: {}")
+        agent.handle_query("What is your return window?", "cache_user_3")
+        agent.handle_query("What is your return window?", "cache_user_1")
+        assert agent.backend.calls == 3
+
+    def test_lru_and_ttl(self):
+        """Test size and TTL bounds"""
+        from src.cache import ResponseCache
+        cache = ResponseCache(max_entries=2, ttl=60)
+        for query in ("a", "b", "c"):
+            cache.set("ns", query, query.upper())
+        assert cache.get("ns", "a") is None
+        assert cache.get("ns", "c") == "C"
+        assert cache.stats()["evictions"] == 1
+        cache.ttl = 0
+        cache.set("ns", "d", "D")
+        assert cache.get("ns", "d") is None
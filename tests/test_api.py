@@ -0,0 +1,387 @@
+"""
+API tests against the offline fake LLM backend
+Run with: pytest tests/test_api.py -v
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+from src.admission import AdmissionController
+from src.analytics import AnalyticsTracker
+from src.config import settings
+from src.interaction_log import InteractionLog
+from src.pool import AgentPool
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Create a test client with a fresh fake-backed agent pool and analytics"""
+    monkeypatch.setattr(settings, "LLM_BACKEND", "fake")
+    monkeypatch.setattr(settings, "FAKE_LLM_LATENCY", "none")
+    admission = AdmissionController()
+    monkeypatch.setattr(app_module, "admission", admission)
+    monkeypatch.setattr(app_module, "agent_pool", AgentPool(admission=admission))
+    monkeypatch.setattr(app_module, "analytics", AnalyticsTracker(InteractionLog(segment_dir="")))
+    return TestClient(app_module.app)
+
+
+class TestChatEndpoints:
+    """Test suite for the chat endpoints"""
+
+    def test_chat(self, client):
+        """Test a chat round-trip is answered, remembered and logged"""
+        response = client.post("/chat", json={"query": "Hello", "user_id": "api_user"}).json()
+        assert response["response"].startswith("You said: Hello")
+        assert len(client.get("/memories/api_user").json()["memories"]) == 2
+        assert client.get("/analytics/summary").json()["total_interactions"] == 1
+
+    def test_chat_stream(self, client):
+        """Test NDJSON streaming ends with the assembled answer"""
+        response = client.post("/chat/stream", json={"query": "Hi there", "user_id": "api_user"})
+        events = [json.loads(line) for line in response.text.splitlines() if line]
+        assert events[-1]["type"] == "done"
+        assert all(event["type"] == "sentence" for event in events[:-1])
+        assert events[-1]["response"] == " ".join(event["text"] for event in events[:-1])
+
+    def test_timeseries(self, client):
+        """Test that chats appear in the per-minute rollups and bad ranges are rejected"""
+        import time
+        client.post("/chat", json={"query": "Hello", "user_id": "ts_user"})
+        now = time.time()
+        points = client.get(f"/analytics/timeseries?from={now - 120}&to={now + 60}&step=60").json()["points"]
+        assert sum(p["count"] for p in points) == 1
+        assert client.get("/analytics/timeseries?from=0&to=100000000&step=1").status_code == 400
+
+    def test_generate_profile(self, client):
+        """Test profile generation through the API"""
+        profile = client.post("/generate-profile", json={"user_id": "api_user"}).json()
+        assert profile["name"]
+        assert client.get("/memories/api_user").json()["memories"][0].startswith("system:")
+
+
+class TestStartup:
+    """Test suite for warm-up and the health endpoints"""
+
+    def test_ready_once_warm(self, client, monkeypatch):
+        """Test that /readyz turns 200 after the lifespan warm-up and reports timings"""
+        import time
+        from src.startup import StartupTracker
+        monkeypatch.setattr(settings, "SNAPSHOT_PATH", "")
+        monkeypatch.setattr(app_module, "startup", StartupTracker())
+        assert client.get("/healthz").json()["status"] == "ok"
+        assert client.get("/readyz").status_code == 503
+
+        with TestClient(app_module.app) as started:
+            for _ in range(200):
+                ready = started.get("/readyz")
+                if ready.status_code == 200:
+                    break
+                time.sleep(0.01)
+        assert ready.status_code == 200
+        assert ready.json()["state"] == "ready" and "warmup" in ready.json()["timings"]
+        assert len(app_module.agent_pool) == 1
+
+
+class TestStaticAssets:
+    """Test suite for fingerprinted, precompressed static assets"""
+
+    def test_index_links_to_immutable_assets(self, client):
+        """Test that the console loads hashed, gzipped, cacheable assets with 304 revalidation"""
+        import re
+        index = client.get("/")
+        assert index.headers["cache-control"] == "no-cache" and index.headers["etag"]
+        css = re.search(r"/static/style\.[0-9a-f]{12}\.css", index.text).group(0)
+
+        response = client.get(css, headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert "Accept-Encoding" in response.headers["vary"]
+        again = client.get(css, headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]})
+        assert again.status_code == 304 and again.content == b""
+        assert client.get("/static/missing.js").status_code == 404
+
+    def test_favicon_is_an_icon(self, client):
+        """Test that /favicon.ico serves a real icon rather than the HTML page"""
+        response = client.get("/favicon.ico")
+        assert response.headers["content-type"] == "image/vnd.microsoft.icon"
+        assert response.content[:4] == b"\x00\x00\x01\x00"
+
+
+class TestBulkProfiles:
+    """Test suite for /generate-profiles and profile invalidation"""
+
+    @pytest.mark.parametrize("mode", ["concurrent", "batched"])
+    def test_bulk_generation(self, client, mode):
+        """Test that every requested profile is generated"""
+        result = client.post("/generate-profiles", json={"count": 12, "prefix": "bulk_", "mode": mode}).json()
+        assert result["generated"] == 12 and result["failed"] == []
+        assert set(result["profiles"]) == {f"bulk_{i}" for i in range(12)}
+
+    def test_invalidate(self, client):
+        """Test that invalidation forces regeneration"""
+        client.post("/generate-profile", json={"user_id": "inv_user"})
+        assert client.delete("/profiles/inv_user").json() == {"invalidated": True}
+        assert client.delete("/profiles/inv_user").json() == {"invalidated": False}
+
+
+class TestDeadlines:
+    """Test suite for request deadlines and client disconnects"""
+
+    def test_timeouts_return_504_and_are_counted(self, client, monkeypatch):
+        """Test that a short X-Request-Timeout cuts off slow upstream calls"""
+        monkeypatch.setattr(settings, "FAKE_LLM_LATENCY", "fixed:2")
+        monkeypatch.setattr(app_module, "agent_pool", AgentPool())
+        headers = {"X-Request-Timeout": "0.1"}
+        response = client.post("/chat", json={"query": "Hello", "user_id": "slow_user"}, headers=headers)
+        assert response.status_code == 504 and response.json()["reason"] == "timeout"
+        response = client.post("/generate-profile", json={"user_id": "slow_user"}, headers=headers)
+        assert response.status_code == 504
+
+        aborted = client.get("/analytics/summary").json()["aborted_requests"]
+        assert aborted["timeouts"] == 2 and aborted["by_route"]["/chat"]["timeout"] == 1
+        assert client.get("/memories/slow_user").json()["memories"] == []
+
+    @pytest.mark.asyncio
+    async def test_disconnect_cancels_upstream_work(self, client):
+        """Test that work is cancelled as soon as the client goes away"""
+        import asyncio
+        from starlette.requests import Request
+        from src.deadlines import Deadline, RequestAborted
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def receive():
+            await asyncio.sleep(0.01)
+            return {"type": "http.disconnect"}
+
+        request = Request({"type": "http", "method": "POST", "path": "/chat", "headers": []}, receive)
+        with pytest.raises(RequestAborted) as aborted:
+            await app_module.run_with_deadline(request, work(), Deadline(5))
+        assert aborted.value.status_code == 499
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert app_module.analytics.get_aborted_stats()["cancellations"] == 1
+
+
+class TestBatchReplay:
+    """Test suite for the /chat/batch endpoint"""
+
+    def test_batch_streams_results_then_stats(self, client):
+        """Test that every record is answered, remembered per user and summarized"""
+        records = [{"user_id": f"batch_{i % 3}", "query": f"Question {i}"} for i in range(9)]
+        body = "\n".join(json.dumps(r) for r in records) + "\n"
+        response = client.post("/chat/batch?concurrency=3", content=body,
+                               headers={"Content-Type": "application/x-ndjson"})
+        lines = [json.loads(line) for line in response.text.splitlines() if line]
+
+        assert lines[-1]["type"] == "stats"
+        assert lines[-1]["records"] == 9 and lines[-1]["errors"] == 0 and lines[-1]["users"] == 3
+        assert all(line["response"].startswith(f"You said: {line['query']}") for line in lines[:-1])
+        memories = client.get("/memories/batch_0").json()["memories"]
+        assert [m for m in memories if m.startswith("user:")] == [f"user: Question {i}" for i in (0, 3, 6)]
+
+    def test_batch_counts_upstream_failures(self, client, monkeypatch):
+        """Test that a failed upstream call is an error record, not a reply, and is counted"""
+        monkeypatch.setattr(settings, "FAKE_LLM_ERROR_RATE", 1.0)
+        body = json.dumps({"user_id": "batch_fail", "query": "Hello"}) + "\n"
+        response = client.post("/chat/batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+        lines = [json.loads(line) for line in response.text.splitlines() if line]
+
+        assert lines[0]["type"] == "error" and "encountered an error" in lines[0]["error"]
+        assert lines[-1]["errors"] == 1
+        assert client.get("/memories/batch_fail").json()["memories"] == []
+
+
+class TestVoiceSession:
+    """Test suite for the /ws/session voice endpoint"""
+
+    def test_session_answers_finals_and_commits_once(self, client, monkeypatch):
+        """Test interim then final transcripts over one socket"""
+        monkeypatch.setattr(settings, "VOICE_STABLE_AFTER", 0.0)
+        with client.websocket_connect("/ws/session") as ws:
+            ws.send_json({"type": "start", "user_id": "voice_user"})
+            assert ws.receive_json() == {"type": "ready"}
+            ws.send_json({"type": "interim", "text": "where is my"})
+            ws.send_json({"type": "interim", "text": "where is my order"})
+            ws.send_json({"type": "final", "text": "Where is my order?"})
+            events = []
+            while not events or events[-1]["type"] != "done":
+                events.append(ws.receive_json())
+
+        # The reply was generated speculatively from the matching interim transcript
+        assert events[-1]["response"].startswith("You said: where is my order")
+        assert all(event["type"] == "sentence" for event in events[:-1])
+        assert len(client.get("/memories/voice_user").json()["memories"]) == 2
+        assert client.get("/analytics/summary").json()["total_interactions"] == 1
+
+    def test_session_requires_start(self, client):
+        """Test that a session must open with a start message"""
+        with client.websocket_connect("/ws/session") as ws:
+            ws.send_json({"type": "final", "text": "hello"})
+            assert ws.receive_json()["type"] == "error"
+
+
+class TestMetricsEndpoint:
+    """Test suite for the Prometheus /metrics endpoint"""
+
+    def test_metrics_cover_routes_stages_and_tokens(self, client):
+        """Test that a chat shows up in request, stage and token metrics"""
+        client.post("/chat", json={"query": "Hello", "user_id": "metrics_user"})
+        client.get("/analytics/user/metrics_user")
+        response = client.get("/metrics")
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        assert 'omniserve_http_requests_total{method="POST",route="/chat",status="200"}' in text
+        assert 'route="/analytics/user/{user_id}"' in text
+        for stage in ("history", "upstream", "remember", "analytics"):
+            assert f'omniserve_stage_duration_seconds_count{{operation="chat",stage="{stage}"}}' in text
+        assert 'omniserve_upstream_tokens_total{kind="completion",provider="fake"}' in text
+        assert "omniserve_upstream_in_flight 0" in text
+        assert "# TYPE omniserve_admission_queue_wait_seconds histogram" in text
+        assert 'omniserve_admission_queue_wait_seconds_bucket{le="0.001"}' in text
+
+    def test_stream_duration_covers_the_body(self, client, monkeypatch):
+        """Test that a streamed request is timed until its last chunk, not its headers"""
+        backend = app_module.agent_pool.get().backend
+        backend.chunk_size, backend.chunk_delay = 4, 0.02
+        observed = []
+        observe = app_module.metrics.observe
+        monkeypatch.setattr(app_module.metrics, "observe",
+                            lambda name, value, **labels: observed.append((name, value, labels)) or
+                            observe(name, value, **labels))
+        response = client.post("/chat/stream", json={"query": "Hello there, how are you?", "user_id": "timed"})
+        assert json.loads(response.text.splitlines()[-1])["type"] == "done"
+
+        durations = [value for name, value, labels in observed
+                     if name == "omniserve_http_request_duration_seconds" and labels["route"] == "/chat/stream"]
+        assert len(durations) == 1
+        assert durations[0] >= 0.1
+
+
+class TestBenchmark:
+    """Smoke test for the load-testing benchmark"""
+
+    @pytest.mark.asyncio
+    async def test_benchmark_runs_offline(self, client):
+        """Test that every scenario runs and reports percentiles"""
+        from benchmarks.bench_api import SCENARIOS, check_thresholds, run_benchmark
+        results = await run_benchmark(list(SCENARIOS), [1, 4], 8)
+        assert len(results) == len(SCENARIOS) * 2
+        assert all(r["errors"] == 0 and r["p50_ms"] <= r["p99_ms"] for r in results)
+        assert check_thresholds(results, max_p99_ms=None, min_rps=None, max_error_rate=0.0) == []
+
+
+class TestRequestCoalescing:
+    """Test suite for single-flight request coalescing"""
+
+    @pytest.mark.asyncio
+    async def test_identical_chats_share_one_upstream_call(self, client, monkeypatch):
+        """Test that concurrent duplicate /chat requests hit upstream and memory once"""
+        import asyncio
+        import httpx
+        monkeypatch.setattr(settings, "FAKE_LLM_LATENCY", "fixed:0.05")
+        monkeypatch.setattr(app_module, "agent_pool", AgentPool())
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            body = {"query": "Where is my order?", "user_id": "dup_user"}
+            responses = await asyncio.gather(*(http.post("/chat", json=body) for _ in range(5)))
+            streams = await asyncio.gather(*(http.post("/chat/stream", json=body) for _ in range(3)))
+
+        assert len({r.json()["response"] for r in responses}) == 1
+        assert len({s.text for s in streams}) == 1
+        agent = app_module.agent_pool.get()
+        assert agent.backend.calls == 2
+        assert len(agent.conversations["dup_user"]) == 4
+        assert app_module.analytics.get_summary_stats()["total_interactions"] == 2
+
+    @pytest.mark.asyncio
+    async def test_singleflight_releases_key(self):
+        """Test that sequential calls are not coalesced and errors propagate to all callers"""
+        import asyncio
+        from src.singleflight import SingleFlight
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flights.do("k", work), flights.do("k", work), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        with pytest.raises(ValueError):
+            await flights.do("k", work)
+        assert len(calls) == 2
+        assert flights.stats() == {"in_flight": 0, "executed": 2, "coalesced": 1}
+
+    @pytest.mark.asyncio
+    async def test_singleflight_cancels_when_all_callers_leave(self):
+        """Test that shared work survives one caller leaving and is cancelled when the last one does"""
+        import asyncio
+        from src.singleflight import SingleFlight
+        flights = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.ensure_future(flights.do("k", work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled.is_set()
+        callers[1].cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flights.stats()["in_flight"] == 0
+
+    @pytest.mark.asyncio
+    async def test_singleflight_stream_cancelled_when_last_subscriber_closes(self):
+        """Test that a shared stream keeps running for a remaining subscriber and stops when the last one closes"""
+        import asyncio
+        from src.singleflight import SingleFlight
+        flights = SingleFlight()
+        closed = asyncio.Event()
+
+        async def produce():
+            try:
+                for i in range(1000):
+                    yield i
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.set()
+
+        first = flights.stream("k", produce)
+        second = flights.stream("k", produce)
+        assert await first.__anext__() == 0
+        assert await second.__anext__() == 0
+        await first.aclose()
+        assert await second.__anext__() == 1
+        assert not closed.is_set()
+        await second.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+        assert flights.stats() == {"in_flight": 0, "executed": 1, "coalesced": 1}
+
+    def test_chat_stream_honours_request_timeout(self, client, monkeypatch):
+        """Test that a stream past its X-Request-Timeout ends with a timeout error and is counted as aborted"""
+        monkeypatch.setattr(settings, "FAKE_LLM_LATENCY", "fixed:1")
+        monkeypatch.setattr(app_module, "agent_pool", AgentPool())
+        response = client.post("/chat/stream", json={"query": "Hello", "user_id": "slow_stream"},
+                               headers={"X-Request-Timeout": "0.05"})
+        events = [json.loads(line) for line in response.text.splitlines() if line]
+
+        assert events == [{"type": "error", "error": events[0]["error"], "reason": "timeout"}]
+        assert app_module.agent_pool.get().backend.last_timeout <= 0.05
+        assert client.get("/memories/slow_stream").json()["memories"] == []
+        assert app_module.analytics.get_aborted_stats()["timeouts"] == 1
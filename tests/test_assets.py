@@ -0,0 +1,72 @@
+"""
+Unit tests for the static asset pipeline
+Run with: pytest tests/test_assets.py -v
+"""
+
+import gzip
+
+import pytest
+from src.assets import IMMUTABLE, REVALIDATE, Asset, StaticAssets, etag_matches
+
+
+@pytest.fixture
+def assets(tmp_path):
+    """Build assets from a small static directory"""
+    (tmp_path / "index.html").write_text(
+        '<link rel="stylesheet" href="/static/style.css?v=2"><script src="/static/app.js"></script>'
+    )
+    (tmp_path / "style.css").write_text("body { color: #1e293b; }\n" * 40)
+    (tmp_path / "app.js").write_text("console.log('hi');")
+    bundle = StaticAssets(str(tmp_path))
+    bundle.build()
+    return bundle
+
+
+class TestStaticAssets:
+    """Test suite for StaticAssets"""
+
+    def test_fingerprints_and_rewrites_references(self, assets):
+        """Test that JS/CSS get hashed names and index.html points at them"""
+        css, js = assets.fingerprints["style.css"], assets.fingerprints["app.js"]
+        assert css.startswith("style.") and css.endswith(".css") and len(css) == len("style..css") + 12
+        html = assets.get("index.html")[0].variants["identity"].decode()
+        assert f'href="/static/{css}"' in html and f'src="/static/{js}"' in html
+        assert "?v=2" not in html
+
+    def test_cache_control(self, assets):
+        """Test that only hashed names are immutable"""
+        css = assets.fingerprints["style.css"]
+        assert assets.get(css)[1] == IMMUTABLE
+        assert assets.get("style.css")[1] == REVALIDATE
+        assert assets.get("index.html")[1] == REVALIDATE
+        assert assets.get("missing.js") is None
+
+    def test_precompressed_variants(self, assets):
+        """Test that large text assets are gzipped once and tiny ones are left alone"""
+        css = assets.get("style.css")[0]
+        assert gzip.decompress(css.variants["gzip"]) == css.variants["identity"]
+        assert list(assets.get("app.js")[0].variants) == ["identity"]
+
+
+class TestNegotiation:
+    """Test suite for Accept-Encoding and If-None-Match handling"""
+
+    def test_negotiate(self):
+        """Test that q-values are honoured and unsupported encodings fall back to identity"""
+        asset = Asset(b"body { margin: 0; }\n" * 50, "text/css")
+        assert asset.negotiate("gzip, deflate") == "gzip"
+        assert asset.negotiate("gzip;q=0") == "identity"
+        assert asset.negotiate("*") in asset.variants
+        assert asset.negotiate("deflate") == "identity"
+        assert asset.negotiate(None) == "identity"
+
+    def test_etag_matches(self):
+        """Test strong, weak, list and wildcard If-None-Match values"""
+        asset = Asset(b"x" * 1000, "text/plain")
+        etag = asset.etag("gzip")
+        assert etag != asset.etag("identity")
+        assert etag_matches(etag, etag)
+        assert etag_matches(f'"other", W/{etag}', etag)
+        assert etag_matches("*", etag)
+        assert not etag_matches('"other"', etag)
+        assert not etag_matches(None, etag)
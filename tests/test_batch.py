@@ -0,0 +1,81 @@
+"""
+Unit tests for batch ticket replay
+Run with: pytest tests/test_batch.py -v
+"""
+
+import asyncio
+
+import pytest
+from src.batch import BatchReplay
+
+
+async def records(items):
+    for item in items:
+        yield item
+
+
+@pytest.mark.asyncio
+async def test_users_in_parallel_turns_in_order():
+    """Test that different users overlap, one user's turns never do, and stats come last"""
+    running = set()
+    peak = 0
+    order = {}
+
+    async def answer(record):
+        nonlocal peak
+        user_id = record["user_id"]
+        assert user_id not in running
+        running.add(user_id)
+        peak = max(peak, len(running))
+        await asyncio.sleep(0.01)
+        running.discard(user_id)
+        order.setdefault(user_id, []).append(record["query"])
+        return f"re: {record['query']}"
+
+    items = [{"user_id": f"u{i % 4}", "query": f"q{i}"} for i in range(20)]
+    results = [r async for r in BatchReplay(answer, concurrency=3, max_pending=5).run(records(items))]
+
+    assert results[-1]["type"] == "stats"
+    assert results[-1]["records"] == 20 and results[-1]["errors"] == 0 and results[-1]["users"] == 4
+    assert sorted(r["index"] for r in results[:-1]) == list(range(20))
+    assert peak == 3
+    for user_id, queries in order.items():
+        assert queries == [item["query"] for item in items if item["user_id"] == user_id]
+
+
+@pytest.mark.asyncio
+async def test_invalid_records_and_failures_are_reported():
+    """Test that bad records and failed answers become error results without stopping the batch"""
+    async def answer(record):
+        if record["query"] == "boom":
+            raise RuntimeError("upstream down")
+        return "ok"
+
+    items = [{"user_id": "a", "query": "hi"}, {"query": "no user"}, {"user_id": "a", "query": "boom"}]
+    results = [r async for r in BatchReplay(answer, concurrency=2).run(records(items))]
+    by_index = {r["index"]: r for r in results[:-1]}
+    assert by_index[0]["response"] == "ok"
+    assert by_index[1]["type"] == "error"
+    assert by_index[2]["error"] == "upstream down"
+    assert results[-1]["errors"] == 2
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_bounds_held_results():
+    """Test that workers stop taking records while answered results wait for the consumer"""
+    answered = 0
+
+    async def answer(record):
+        nonlocal answered
+        answered += 1
+        return "ok"
+
+    items = [{"user_id": f"u{i}", "query": "q"} for i in range(50)]
+    replay = BatchReplay(answer, concurrency=2, max_pending=4)
+    results = replay.run(records(items))
+    first = await results.__anext__()
+    await asyncio.sleep(0.05)
+    # One result is with the consumer; at most max_pending were read and answered
+    assert answered <= 5 and replay._results.qsize() <= 4
+    rest = [r async for r in results]
+    assert len([first, *rest[:-1]]) == 50 and rest[-1]["records"] == 50
@@ -0,0 +1,120 @@
+"""
+Unit tests for request deadlines and upstream retries
+Run with: pytest tests/test_deadlines.py -v
+"""
+
+import asyncio
+import random
+
+import pytest
+from src.config import settings
+from src.deadlines import Deadline, DeadlineExceeded, call_with_retries, within_deadline
+
+
+class TestDeadline:
+    """Test suite for Deadline"""
+
+    def test_from_header(self, monkeypatch):
+        """Test that the header overrides the default and is capped at the maximum"""
+        monkeypatch.setattr(settings, "REQUEST_TIMEOUT", 30.0)
+        monkeypatch.setattr(settings, "REQUEST_TIMEOUT_MAX", 60.0)
+        assert Deadline.from_header(None).timeout == 30.0
+        assert Deadline.from_header("2.5").timeout == 2.5
+        assert Deadline.from_header("600").timeout == 60.0
+        assert Deadline.from_header("soon").timeout == 30.0
+        assert Deadline.from_header("-1").timeout == 30.0
+
+    def test_remaining(self):
+        """Test that the budget counts down and never goes negative"""
+        deadline = Deadline(10)
+        assert 9 < deadline.remaining() <= 10 and not deadline.expired
+        assert Deadline(0).remaining() == 0 and Deadline(0).expired
+
+
+class TestCallWithRetries:
+    """Test suite for deadline-aware retries"""
+
+    @pytest.mark.asyncio
+    async def test_retries_transient_failures(self):
+        """Test that failures are retried with backoff and each attempt gets the remaining budget"""
+        timeouts = []
+
+        async def call(timeout):
+            timeouts.append(timeout)
+            if len(timeouts) < 3:
+                raise RuntimeError("503 Service Unavailable")
+            return "ok"
+
+        result = await call_with_retries(call, Deadline(5), max_retries=2, base_delay=0.01, rng=random.Random(1))
+        assert result == "ok"
+        assert len(timeouts) == 3
+        assert all(0 < t <= 5 for t in timeouts) and timeouts == sorted(timeouts, reverse=True)
+
+    @pytest.mark.asyncio
+    async def test_gives_up_without_budget_or_retries(self):
+        """Test that retries stop when exhausted, when the backoff would outlast the deadline, or on auth errors"""
+        calls = []
+
+        async def failing(timeout):
+            calls.append(timeout)
+            raise RuntimeError("503 Service Unavailable")
+
+        with pytest.raises(RuntimeError):
+            await call_with_retries(failing, Deadline(5), max_retries=1, base_delay=0.001)
+        assert len(calls) == 2
+
+        calls.clear()
+        with pytest.raises(RuntimeError):
+            # Backoff is at least 10s but only 0.5s of budget is left
+            await call_with_retries(failing, Deadline(0.5), max_retries=3, base_delay=10, max_delay=10,
+                                    rng=random.Random(0))
+        assert len(calls) == 1
+
+        async def unauthorized(timeout):
+            calls.append(timeout)
+            raise RuntimeError("401 API_KEY_INVALID")
+
+        calls.clear()
+        with pytest.raises(RuntimeError):
+            await call_with_retries(unauthorized, Deadline(5), max_retries=3, base_delay=0.001)
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_call_is_cancelled_at_the_deadline(self):
+        """Test that a hung call is cancelled and reported as DeadlineExceeded"""
+        cancelled = asyncio.Event()
+
+        async def hang(timeout):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with pytest.raises(DeadlineExceeded):
+            await call_with_retries(hang, Deadline(0.05), max_retries=2)
+        assert cancelled.is_set()
+
+
+class TestWithinDeadline:
+    """Test suite for bounding a stream by a deadline"""
+
+    @pytest.mark.asyncio
+    async def test_stalled_stream_is_closed_at_the_deadline(self):
+        """Test that items flow until the deadline, then the source is closed and DeadlineExceeded raised"""
+        closed = asyncio.Event()
+
+        async def source():
+            try:
+                yield "first"
+                await asyncio.sleep(10)
+                yield "never"
+            finally:
+                closed.set()
+
+        items = []
+        with pytest.raises(DeadlineExceeded):
+            async for item in within_deadline(source(), Deadline(0.05)):
+                items.append(item)
+        assert items == ["first"]
+        assert closed.is_set()
@@ -0,0 +1,153 @@
+"""
+Unit tests for the bounded conversation store
+Run with: pytest tests/test_memory.py -v
+"""
+
+import time
+
+import pytest
+from src.memory import ConversationStore
+
+
+class TestConversationStore:
+    """Test suite for ConversationStore"""
+
+    @pytest.fixture
+    def store(self):
+        """Create a small store"""
+        return ConversationStore(max_messages=4, idle_ttl=60, max_bytes=10_000)
+
+    def test_mapping_behaviour(self, store):
+        """Test dict-like reads"""
+        assert store == {}
+        store.append("user1", "user", "hi")
+        assert "user1" in store
+        assert store["user1"] == [{"role": "user", "content": "hi"}]
+        assert store.get("missing", []) == []
+
+    def test_ring_buffer_cap(self, store):
+        """Test that each user keeps only the most recent messages"""
+        for i in range(6):
+            store.append("user1", "user", f"m{i}")
+        assert [m["content"] for m in store["user1"]] == ["m2", "m3", "m4", "m5"]
+        assert store.stats()["trimmed_messages"] == 2
+
+    def test_profile_is_kept_and_replaced(self, store):
+        """Test that the profile survives trimming and is never duplicated"""
+        store.set_profile("user1", "Profile A")
+        for i in range(6):
+            store.append("user1", "user", f"m{i}")
+        store.set_profile("user1", "Profile B")
+        history = store.recent("user1", 2)
+        assert history[0] == {"role": "system", "content": "Profile B"}
+        assert [m["content"] for m in history[1:]] == ["m4", "m5"]
+
+    def test_idle_ttl_expiry(self, store):
+        """Test that idle users expire"""
+        store.idle_ttl = 0
+        store.append("user1", "user", "hi")
+        time.sleep(0.01)
+        assert "user1" not in store
+        assert len(store) == 0
+        assert store.stats()["expirations"] == 1
+
+    def test_byte_budget_evicts_lru(self):
+        """Test that the least recently used users are evicted under the budget"""
+        store = ConversationStore(max_messages=10, idle_ttl=60, max_bytes=700)
+        store.append("old", "user", "x" * 100)
+        store.append("mid", "user", "x" * 100)
+        store.recent("old", 1)  # touch "old" so "mid" becomes LRU
+        store.append("new", "user", "x" * 100)
+        assert "mid" not in store
+        assert "old" in store and "new" in store
+        assert store.stats()["evictions"] == 1
+        assert store.total_bytes <= 700
+
+    def test_wire_history_alternates(self):
+        """Test that wire history starts with user, alternates and merges repeats"""
+        store = ConversationStore(max_messages=20, idle_ttl=60, max_bytes=10_000)
+        store.append("user1", "assistant", "welcome")  # dropped: history must start with user
+        store.append("user1", "user", "a")
+        store.append("user1", "user", "b")
+        store.append("user1", "assistant", "c")
+        assert store.wire_history("user1") == [
+            {"role": "user", "parts": ["a\nb"]},
+            {"role": "model", "parts": ["c"]},
+        ]
+
+    def test_context_window_token_budget(self):
+        """Test that the window packs into the budget without dropping the profile"""
+        store = ConversationStore(max_messages=20, idle_ttl=60, max_bytes=100_000)
+        store.set_profile("user1", "Customer Profile: {}")
+        for i in range(5):
+            store.append("user1", "user", f"question {i} " + "x" * 36)  # ~12 tokens each
+            store.append("user1", "assistant", f"answer {i} " + "y" * 38)
+        window = store.context_window("user1", token_budget=80)
+        history = window.history
+        assert history[0] == {"role": "user", "parts": ["Customer Profile: {}"]}
+        assert [turn["role"] for turn in history] == ["user", "model"] * (len(history) // 2)
+        assert history[-1]["parts"][0].startswith("answer 4")
+        assert window.tokens <= 80
+        # Everything older than the packed turns is waiting to be summarized
+        assert len(window.overflow) + len(history) - 2 == 10
+        assert window.overflow[0]["parts"][0].startswith("question 0")
+
+
+class TestContextBuilder:
+    """Test suite for the rolling-summary context builder"""
+
+    @pytest.mark.asyncio
+    async def test_summary_refreshes_in_background(self):
+        """Test that overflowing turns are folded into the summary off the request path"""
+        from src.context import ContextBuilder
+
+        calls = []
+
+        async def summarize(previous, turns):
+            calls.append(len(turns))
+            return f"{len(turns)} earlier turns"
+
+        store = ConversationStore(max_messages=40, idle_ttl=60, max_bytes=100_000)
+        builder = ContextBuilder(store, summarize, token_budget=40, min_summary_turns=2)
+        for i in range(6):
+            store.append("user1", "user", f"q{i}" + "q" * 38)
+            store.append("user1", "assistant", f"a{i}" + "a" * 38)
+
+        before = builder.build("user1")
+        assert not any("Summary" in turn["parts"][0] for turn in before)
+        await builder.wait_pending()
+
+        after = builder.build("user1")
+        assert after[0]["parts"][0].endswith(f"{calls[0]} earlier turns")
+        assert after[1]["role"] == "model"
+        # Turns already covered by the summary are never summarized a second time
+        overflow = store.context_window("user1", 40).overflow
+        assert all(not turn["parts"][0].startswith("q0") for turn in overflow)
+
+    @pytest.mark.asyncio
+    async def test_summaries_are_shared_per_user_and_admitted(self):
+        """Test that two builders on one store refresh a user once, through the admission controller"""
+        import asyncio
+        from src.admission import AdmissionController
+        from src.context import ContextBuilder
+
+        admission = AdmissionController(max_concurrency=1, user_rate=0)
+        calls = []
+
+        async def summarize(previous, turns):
+            calls.append(admission.in_flight)
+            await asyncio.sleep(0.01)
+            return "summary"
+
+        store = ConversationStore(max_messages=40, idle_ttl=60, max_bytes=100_000)
+        builders = [ContextBuilder(store, summarize, token_budget=40, min_summary_turns=2, admission=admission)
+                    for _ in range(2)]
+        for i in range(6):
+            store.append("user1", "user", f"q{i}" + "q" * 38)
+            store.append("user1", "assistant", f"a{i}" + "a" * 38)
+
+        for builder in builders:
+            builder.build("user1")
+        await builders[0].wait_pending()
+        assert calls == [1]
+        assert admission.admitted == 1 and admission.in_flight == 0
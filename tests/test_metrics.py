@@ -0,0 +1,83 @@
+"""
+Unit tests for the metrics registry and request profiler
+Run with: pytest tests/test_metrics.py -v
+"""
+
+import pytest
+from src.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry:
+    """Test suite for MetricsRegistry"""
+
+    def test_counters_and_tokens(self):
+        """Test that counters accumulate per label set and token usage is split by kind"""
+        registry = MetricsRegistry()
+        registry.inc("requests_total", route="/chat")
+        registry.inc("requests_total", 2, route="/chat")
+        registry.record_tokens("fake", 12, 0)
+        assert registry.value("requests_total", route="/chat") == 3
+        assert registry.value("omniserve_upstream_tokens_total", provider="fake", kind="prompt") == 12
+        assert registry.value("omniserve_upstream_tokens_total", provider="fake", kind="completion") == 0
+
+    def test_span_records_on_error(self):
+        """Test that a span is recorded even when its block raises"""
+        registry = MetricsRegistry()
+        with registry.span("history"):
+            pass
+        with pytest.raises(ValueError):
+            with registry.span("upstream", provider="fake"):
+                raise ValueError("boom")
+        assert registry.value("omniserve_stage_duration_seconds", stage="history", operation="chat") == 1
+        assert registry.value(
+            "omniserve_stage_duration_seconds", stage="upstream", operation="chat", provider="fake"
+        ) == 1
+
+    def test_render_prometheus_text(self):
+        """Test the exposition format for counters, histograms and gauges"""
+        registry = MetricsRegistry()
+        registry.describe("requests_total", "counter", "Requests.")
+        registry.inc("requests_total", route='/a"b')
+        for value in (0.1, 0.2, 0.3):
+            registry.observe("latency_seconds", value, route="/chat")
+        registry.gauge("queue_depth", "Waiting requests.", lambda: {(): 4})
+        registry.gauge("broken", "Raises at scrape time.", lambda: 1 / 0)
+
+        text = registry.render()
+        assert "# HELP requests_total Requests.\n# TYPE requests_total counter\n" in text
+        assert 'requests_total{route="/a\\"b"} 1\n' in text
+        assert "# TYPE latency_seconds histogram" in text
+        # Fixed, cumulative le buckets that can be summed across processes
+        assert 'latency_seconds_bucket{route="/chat",le="0.05"} 0\n' in text
+        assert 'latency_seconds_bucket{route="/chat",le="0.1"} 1\n' in text
+        assert 'latency_seconds_bucket{route="/chat",le="0.25"} 2\n' in text
+        assert 'latency_seconds_bucket{route="/chat",le="0.5"} 3\n' in text
+        assert 'latency_seconds_bucket{route="/chat",le="+Inf"} 3\n' in text
+        assert "quantile=" not in text
+        assert 'latency_seconds_sum{route="/chat"} 0.6\n' in text
+        assert 'latency_seconds_count{route="/chat"} 3\n' in text
+        assert "queue_depth 4\n" in text
+        assert "broken" not in text
+
+
+class TestRequestProfiler:
+    """Test suite for the opt-in request profiler"""
+
+    def test_disabled_by_default(self):
+        """Test that nothing is profiled unless enabled"""
+        from src.profiling import RequestProfiler
+        assert RequestProfiler(enabled=False).start(requested=True) is None
+
+    def test_one_capture_at_a_time(self, tmp_path):
+        """Test that a requested capture is written and concurrent requests are skipped"""
+        from src.profiling import RequestProfiler
+        profiler = RequestProfiler(enabled=True, sample_rate=0, output_dir=str(tmp_path))
+        assert profiler.start(requested=False) is None
+        profile = profiler.start(requested=True)
+        assert profile is not None
+        assert profiler.start(requested=True) is None
+        sum(range(1000))
+        path = profiler.stop(profile, "/analytics/user/{user_id}")
+        assert path.endswith("-analytics_user_user_id.prof")
+        assert (tmp_path / path.split("/")[-1]).exists()
+        assert profiler.stop(profiler.start(requested=True), "/chat") is not None
@@ -0,0 +1,76 @@
+"""
+Unit tests for profile parsing, caching and the seeded local generator
+Run with: pytest tests/test_profiles.py -v
+"""
+
+import time
+
+import pytest
+from src.profiles import LocalProfileGenerator, ProfileCache, extract_json
+
+
+class TestExtractJson:
+    """Test suite for extract_json"""
+
+    @pytest.mark.parametrize("content", [
+        '{"name": "A"}',
+        '```json\n{"name": "A"}\n```',
+        'Here is the profile:\n```\n{"name": "A"}\n```\nLet me know!',
+        'Sure {not json} -> {"name": "A"}',
+    ])
+    def test_tolerates_wrapping(self, content):
+        """Test that fences and prose around the JSON are ignored"""
+        assert extract_json(content) == {"name": "A"}
+
+    def test_no_json(self):
+        """Test that output without JSON is rejected"""
+        with pytest.raises(ValueError):
+            extract_json("I cannot help with that.")
+
+
+class TestLocalProfileGenerator:
+    """Test suite for LocalProfileGenerator"""
+
+    def test_deterministic_per_seed_and_user(self):
+        """Test that profiles repeat for the same seed and differ otherwise"""
+        generator = LocalProfileGenerator(seed=7)
+        first = generator.generate("cust_1")
+        assert first == LocalProfileGenerator(seed=7).generate("cust_1")
+        assert first != generator.generate("cust_2")
+        assert first != LocalProfileGenerator(seed=8).generate("cust_1")
+        assert first["recent_order"]["item"] and len(first["past_orders"]) == 2
+        assert len(first["support_interactions"]) == 2
+
+    def test_thousands_in_well_under_a_second(self):
+        """Test that bulk local generation is fast enough for load-test setup"""
+        generator = LocalProfileGenerator(seed=0)
+        start = time.perf_counter()
+        profiles = [generator.generate(f"cust_{i}") for i in range(2000)]
+        assert time.perf_counter() - start < 1.0
+        assert len({p["email"] for p in profiles}) > 1000
+
+
+class TestProfileCache:
+    """Test suite for ProfileCache"""
+
+    def test_get_set_invalidate_and_ttl(self):
+        """Test hits, invalidation and expiry"""
+        cache = ProfileCache(max_entries=2, ttl=60)
+        cache.set("a", {"name": "A"})
+        assert cache.get("a") == {"name": "A"}
+        assert cache.invalidate("a") and cache.get("a") is None
+        assert not cache.invalidate("a")
+
+        expiring = ProfileCache(max_entries=2, ttl=0)
+        expiring.set("a", {"name": "A"})
+        assert expiring.get("a") is None
+
+    def test_lru_bound(self):
+        """Test that the least recently used profile is evicted"""
+        cache = ProfileCache(max_entries=2, ttl=60)
+        cache.set("a", {})
+        cache.set("b", {})
+        cache.get("a")
+        cache.set("c", {})
+        assert cache.get("b") is None and cache.get("a") == {}
+        assert cache.stats()["evictions"] == 1
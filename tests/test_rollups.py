@@ -0,0 +1,55 @@
+"""
+Unit tests for time-bucketed analytics rollups
+Run with: pytest tests/test_rollups.py -v
+"""
+
+import pytest
+from src.rollups import DAY, HOUR, MINUTE, RollupSeries
+
+NOW = 1_700_000_000 // DAY * DAY
+
+
+def test_range_query_by_minute():
+    """Test per-minute counts, lengths, latencies and unique users"""
+    series = RollupSeries(retention=[DAY, 30 * DAY, 365 * DAY])
+    for i in range(120):
+        series.record(NOW + i, f"user{i % 3}", 0.5, 10, 40)
+    points = series.query(NOW, NOW + 3 * MINUTE, MINUTE)
+    assert [p["start"] for p in points] == [NOW, NOW + MINUTE, NOW + 2 * MINUTE]
+    assert [p["count"] for p in points] == [60, 60, 0]
+    assert points[0]["unique_users"] == 3
+    assert points[0]["p50_response_time"] == pytest.approx(0.5, rel=0.02)
+    assert points[0]["avg_query_length"] == 10 and points[0]["avg_response_length"] == 40
+
+    hourly = series.query(NOW, NOW + HOUR, HOUR)
+    assert len(hourly) == 1 and hourly[0]["count"] == 120
+
+
+def test_old_minutes_downsample_into_hours_and_days():
+    """Test that aged buckets are merged into coarser tiers and eventually dropped"""
+    series = RollupSeries(retention=[HOUR, DAY, 3 * DAY])
+    series.record(NOW, "early", 1.0, 5, 5)
+    series.record(NOW + 10 * MINUTE, "early", 1.0, 5, 5)
+    series.record(NOW + 2 * HOUR, "later", 1.0, 5, 5)
+    assert NOW not in series.tiers[0] and series.tiers[1][NOW].count == 2
+
+    # Data keeps answering queries from the coarser tier
+    points = series.query(NOW, NOW + 3 * HOUR, HOUR)
+    assert [p["count"] for p in points] == [2, 0, 1]
+    assert points[0]["resolution"] == HOUR and points[0]["unique_users"] == 1
+
+    series.record(NOW + 2 * DAY, "next", 1.0, 5, 5)
+    assert series.tiers[2][NOW].count == 3
+    series.record(NOW + 5 * DAY, "much_later", 1.0, 5, 5)
+    assert NOW not in series.tiers[2]
+    assert series.query(NOW, NOW + DAY, DAY)[0]["count"] == 0
+
+
+def test_snapshot_roundtrip():
+    """Test that rollups survive export and load"""
+    series = RollupSeries(retention=[DAY, 30 * DAY, 365 * DAY])
+    for i in range(10):
+        series.record(NOW + i * MINUTE, f"user{i}", 0.2, 3, 7)
+    restored = RollupSeries(retention=[DAY, 30 * DAY, 365 * DAY])
+    restored.load(series.to_dict())
+    assert restored.query(NOW, NOW + HOUR, HOUR) == series.query(NOW, NOW + HOUR, HOUR)
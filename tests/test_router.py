@@ -0,0 +1,138 @@
+"""
+Unit tests for multi-provider routing
+Run with: pytest tests/test_router.py -v
+"""
+
+import pytest
+from src.backends import FakeBackend
+from src.router import ProviderRouter, ProviderUnavailableError
+
+
+def make_backend(name, **kwargs):
+    backend = FakeBackend(**kwargs)
+    backend.name = name
+    return backend
+
+
+class TestProviderRouter:
+    """Test suite for ProviderRouter"""
+
+    @pytest.mark.asyncio
+    async def test_failover_to_healthy_provider(self):
+        """Test that a failing provider falls over to the next one"""
+        broken = make_backend("broken", error_rate=1.0)
+        healthy = make_backend("healthy")
+        router = ProviderRouter([broken, healthy], hedge=False, failure_threshold=3, cooldown=60)
+
+        reply = await router.send_async([], "Hello")
+        assert reply.startswith("You said: Hello")
+        assert router.providers[0].failures == 1
+
+    @pytest.mark.asyncio
+    async def test_circuit_opens_after_failure_streak(self):
+        """Test that the breaker stops sending traffic to a failing provider"""
+        broken = make_backend("broken", error_rate=1.0)
+        healthy = make_backend("healthy", latency="fixed:0.001")
+        router = ProviderRouter([broken, healthy], hedge=False, failure_threshold=2, cooldown=60)
+
+        for _ in range(5):
+            await router.send_async([], "Hello")
+        assert broken.calls == 2
+        assert router.stats()["providers"][0]["state"] == "open"
+
+        router_all_broken = ProviderRouter([broken], hedge=False, failure_threshold=1, cooldown=60)
+        with pytest.raises(Exception):
+            await router_all_broken.send_async([], "Hello")
+        with pytest.raises(ProviderUnavailableError):
+            await router_all_broken.send_async([], "Hello")
+
+    @pytest.mark.asyncio
+    async def test_routes_to_lower_latency_provider(self):
+        """Test latency-aware ranking"""
+        slow = make_backend("slow", latency="fixed:0.03")
+        fast = make_backend("fast", latency="fixed:0.001")
+        router = ProviderRouter([slow, fast], hedge=False)
+        for _ in range(6):
+            await router.send_async([], "Hello")
+        assert fast.calls > slow.calls
+
+    @pytest.mark.asyncio
+    async def test_hedges_when_primary_exceeds_p95(self):
+        """Test that a brownout on the primary is capped by a hedged request"""
+        primary = make_backend("primary", latency="fixed:0.005")
+        secondary = make_backend("secondary", latency="fixed:0.05")
+        router = ProviderRouter([primary, secondary], hedge=True, hedge_min_samples=5)
+        # History: the primary usually answers in ~5ms, the secondary in ~50ms
+        for _ in range(5):
+            router.providers[0].record_success(0.005)
+            router.providers[1].record_success(0.05)
+        # Brownout: the primary now takes 500ms
+        primary._sample_latency = lambda rng: 0.5
+
+        import time
+        start = time.perf_counter()
+        await router.send_async([], "Hello")
+        assert time.perf_counter() - start < 0.3
+        assert router.hedged_requests == 1
+        assert secondary.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_fails_over_before_first_chunk(self):
+        """Test streaming failover"""
+        router = ProviderRouter([make_backend("broken", error_rate=1.0), make_backend("healthy")], hedge=False)
+        chunks = [chunk async for chunk in router.stream_async([], "Hi", timeout=5.0)]
+        assert "".join(chunks).startswith("You said: Hi")
+        assert router.providers[1].backend.last_timeout == 5.0
+        assert router.providers[1].first_chunk_latencies.count == 1
+        # Time to first chunk must not feed the full-call p95 that hedging uses
+        assert router.providers[1].latencies.count == 0
+
+    @pytest.mark.asyncio
+    async def test_slow_streaming_provider_is_demoted(self):
+        """Test that streams are ranked by time to first chunk, not left in configured order"""
+        slow = make_backend("slow", latency="fixed:0.03")
+        fast = make_backend("fast", latency="fixed:0.001")
+        router = ProviderRouter([slow, fast], hedge=False)
+        for _ in range(6):
+            [chunk async for chunk in router.stream_async([], "Hello")]
+        assert fast.calls > slow.calls
+        assert router.providers[0].first_chunk_ewma > router.providers[1].first_chunk_ewma
+
+    @pytest.mark.asyncio
+    async def test_stream_hedges_past_first_chunk_p95(self):
+        """Test that a stream whose primary stalls before its first chunk is hedged to the next provider"""
+        import asyncio
+        import time
+        primary = make_backend("primary", latency="fixed:0.01")
+        secondary = make_backend("secondary", latency="fixed:0.01")
+        router = ProviderRouter([primary, secondary], hedge=True, hedge_min_samples=5)
+        for _ in range(5):
+            router.providers[0].record_success(0.01, first_chunk=True)
+        router.providers[1].record_success(0.05, first_chunk=True)
+        primary._sample_latency = lambda rng: 0.5
+
+        start = time.perf_counter()
+        chunks = [chunk async for chunk in router.stream_async([], "Hello")]
+        assert time.perf_counter() - start < 0.3
+        assert "".join(chunks).startswith("You said: Hello")
+        assert router.hedged_requests == 1
+        assert secondary.calls == 1
+        # The losing stream is cancelled (on the next loop iteration) and its claim released
+        await asyncio.sleep(0.01)
+        assert primary.in_flight == 0
+        assert not router.providers[0].probing
+
+    @pytest.mark.asyncio
+    async def test_half_open_lets_one_trial_through(self):
+        """Test that a recovering provider gets a single probe, not the full load"""
+        import asyncio
+        recovering = make_backend("recovering", latency="fixed:0.05")
+        fallback = make_backend("fallback", latency="fixed:0.001")
+        router = ProviderRouter([recovering, fallback], hedge=False, failure_threshold=1, cooldown=0)
+        router.providers[0].record_failure()
+        assert router.providers[0].state() == "half_open"
+
+        await asyncio.gather(*(router.send_async([], "Hello") for _ in range(5)))
+        assert recovering.calls == 1
+        assert fallback.calls == 4
+        assert router.providers[0].state() == "closed" and not router.providers[0].probing
@@ -0,0 +1,118 @@
+"""
+Unit tests for the streaming aggregate structures
+Run with: pytest tests/test_sketches.py -v
+"""
+
+import random
+import statistics
+
+import pytest
+from src.sketches import LatencyHistogram, RunningStats
+
+
+class TestRunningStats:
+    """Test suite for RunningStats"""
+
+    def test_matches_statistics_module(self):
+        """Test mean/variance/min/max against the stdlib"""
+        values = [random.uniform(0.05, 4.0) for _ in range(500)]
+        stats = RunningStats()
+        for value in values:
+            stats.add(value)
+        assert stats.count == 500
+        assert stats.mean == pytest.approx(statistics.mean(values))
+        assert stats.variance == pytest.approx(statistics.variance(values))
+        assert (stats.min, stats.max) == (min(values), max(values))
+
+    def test_merge(self):
+        """Test that merged stats equal stats over the combined data"""
+        left, right, combined = RunningStats(), RunningStats(), RunningStats()
+        for i in range(100):
+            (left if i % 3 else right).add(i * 0.1)
+            combined.add(i * 0.1)
+        left.merge(right)
+        assert left.count == combined.count
+        assert left.mean == pytest.approx(combined.mean)
+        assert left.variance == pytest.approx(combined.variance)
+
+
+class TestLatencyHistogram:
+    """Test suite for LatencyHistogram"""
+
+    def test_percentiles_within_precision(self):
+        """Test that quantiles stay within the configured relative error"""
+        values = sorted(random.lognormvariate(0, 0.8) for _ in range(5000))
+        histogram = LatencyHistogram(precision=0.02)
+        for value in values:
+            histogram.record(value)
+        percentiles = histogram.percentiles()
+        for name, q in {"p50": 0.5, "p95": 0.95, "p99": 0.99}.items():
+            exact = values[int(q * len(values)) - 1]
+            assert percentiles[name] == pytest.approx(exact, rel=0.05)
+        assert histogram.quantile(0.5) == percentiles["p50"]
+
+    def test_merge(self):
+        """Test merging two histograms"""
+        first, second = LatencyHistogram(), LatencyHistogram()
+        for _ in range(10):
+            first.record(0.1)
+            second.record(1.0)
+        first.merge(second)
+        assert first.count == 20
+        assert first.quantile(0.25) == pytest.approx(0.1, rel=0.02)
+        assert first.quantile(0.99) == pytest.approx(1.0, rel=0.02)
+
+
+class TestTopK:
+    """Test suite for TopK heavy hitters"""
+
+    def test_exact_mode_matches_sort(self):
+        """Test that exact mode agrees with a full sort"""
+        from collections import Counter
+        from src.sketches import TopK
+        stream = [f"user{random.randint(0, 50)}" for _ in range(2000)]
+        top = TopK()
+        for key in stream:
+            top.increment(key)
+        expected = Counter(stream)
+        result = top.top(5)
+        assert [entry["count"] for entry in result] == sorted(expected.values(), reverse=True)[:5]
+        assert all(expected[entry["key"]] == entry["count"] for entry in result)
+        assert len(top) == len(expected)
+
+    def test_space_saving_is_bounded_and_finds_heavy_hitters(self):
+        """Test that approximate mode keeps memory bounded and keeps heavy hitters"""
+        from src.sketches import TopK
+        top = TopK(capacity=10)
+        for i in range(3000):
+            top.increment("heavy" if i % 3 == 0 else f"noise{i}")
+        assert len(top) == 10
+        best = top.top(1)[0]
+        assert best["key"] == "heavy"
+        assert best["count"] - best["error"] <= 1000 <= best["count"]
+
+
+class TestHyperLogLog:
+    """Test suite for HyperLogLog distinct counts"""
+
+    def test_estimate_within_error(self):
+        """Test small counts are exact-ish and large ones within a few percent"""
+        from src.sketches import HyperLogLog
+        small, large = HyperLogLog(), HyperLogLog()
+        for i in range(20):
+            small.add(f"user{i % 10}")
+        for i in range(20000):
+            large.add(f"user{i}")
+        assert small.count() == 10
+        assert large.count() == pytest.approx(20000, rel=0.1)
+
+    def test_merge_and_roundtrip(self):
+        """Test that merged sketches count the union and survive serialization"""
+        from src.sketches import HyperLogLog
+        left, right = HyperLogLog(), HyperLogLog()
+        for i in range(300):
+            left.add(f"user{i}")
+            right.add(f"user{i + 150}")
+        left.merge(right)
+        assert left.count() == pytest.approx(450, rel=0.1)
+        assert HyperLogLog.from_dict(left.to_dict()).count() == left.count()
@@ -0,0 +1,125 @@
+"""
+Unit tests for conversation and analytics snapshots
+Run with: pytest tests/test_snapshot.py -v
+"""
+
+import time
+
+import pytest
+from src.analytics import AnalyticsTracker
+from src.interaction_log import InteractionLog
+from src.memory import ConversationStore
+from src.snapshot import SnapshotError, SnapshotReader, Snapshotter
+
+
+def make_tracker():
+    return AnalyticsTracker(InteractionLog(segment_dir=""))
+
+
+class TestSnapshots:
+    """Test suite for Snapshotter and the lazy restore path"""
+
+    @pytest.fixture
+    def path(self, tmp_path):
+        """Snapshot file location"""
+        return str(tmp_path / "snapshot.bin")
+
+    @pytest.fixture
+    def saved(self, path):
+        """Save a snapshot with two users and some analytics"""
+        store = ConversationStore()
+        tracker = make_tracker()
+        store.set_profile("user1", "Customer Profile: {}")
+        store.append("user1", "user", "hello")
+        store.append("user1", "assistant", "hi there")
+        store.append("user2", "user", "আমার অর্ডার কোথায়?")
+        store.set_summary("user1", "Greeted the agent.", upto=0)
+        tracker.log_interaction("user1", "hello", "hi there", 0.5)
+        tracker.log_interaction("user2", "আমার অর্ডার কোথায়?", "answer", 1.5)
+        Snapshotter(store, tracker, path=path).save()
+        return store, tracker
+
+    def test_restore_is_lazy(self, path, saved):
+        """Test that users are restored on first touch, not at startup"""
+        old_store, _ = saved
+        store = ConversationStore()
+        assert Snapshotter(store, make_tracker(), path=path).restore()
+        assert store.stats()["users"] == 0
+        assert store.stats()["unrestored_users"] == 2
+
+        assert store["user1"] == old_store["user1"]
+        assert store.stats()["restored"] == 1
+        assert store.stats()["unrestored_users"] == 1
+
+    def test_summary_and_wire_history_survive(self, path, saved):
+        """Test that the summary stays anchored to the same turns"""
+        old_store, _ = saved
+        store = ConversationStore()
+        Snapshotter(store, make_tracker(), path=path).restore()
+        assert store.wire_history("user1") == old_store.wire_history("user1")
+        window = store.context_window("user1", token_budget=10_000)
+        assert window.summary == "Greeted the agent."
+        assert window.overflow == []
+
+    def test_analytics_restored(self, path, saved):
+        """Test that counters, percentiles, top users and recent interactions come back"""
+        _, old_tracker = saved
+        tracker = make_tracker()
+        Snapshotter(ConversationStore(), tracker, path=path).restore()
+        assert tracker.get_summary_stats() == old_tracker.get_summary_stats()
+        assert tracker.get_top_users(5) == old_tracker.get_top_users(5)
+        assert tracker.get_user_stats("user2") == old_tracker.get_user_stats("user2")
+        assert tracker.get_recent_interactions(5) == old_tracker.get_recent_interactions(5)
+
+    def test_untouched_users_carried_over(self, path, saved):
+        """Test that a snapshot taken before users are touched still has them"""
+        store = ConversationStore()
+        tracker = make_tracker()
+        snapshotter = Snapshotter(store, tracker, path=path)
+        snapshotter.restore()
+        store.append("user3", "user", "new")
+        snapshotter.save()
+        assert snapshotter.last_save_users == 3
+
+        fresh = ConversationStore()
+        Snapshotter(fresh, make_tracker(), path=path).restore()
+        assert [m["content"] for m in fresh["user2"]] == ["আমার অর্ডার কোথায়?"]
+        assert [m["content"] for m in fresh["user3"]] == ["new"]
+
+    def test_expired_users_not_restored(self, path, saved):
+        """Test that users idle past the TTL are dropped on restore"""
+        store = ConversationStore(idle_ttl=0.01)
+        Snapshotter(store, make_tracker(), path=path).restore()
+        time.sleep(0.02)
+        assert "user1" not in store
+
+    def test_discarded_users_stay_gone(self, path, saved):
+        """Test that forgetting a user also forgets their snapshot record"""
+        store = ConversationStore()
+        Snapshotter(store, make_tracker(), path=path).restore()
+        store.discard("user1")
+        assert "user1" not in store
+
+    def test_corrupt_snapshot_is_ignored(self, path):
+        """Test that a bad file is reported and startup continues empty"""
+        with open(path, "wb") as f:
+            f.write(b"not a snapshot at all")
+        with pytest.raises(SnapshotError):
+            SnapshotReader(path)
+        store = ConversationStore()
+        assert not Snapshotter(store, make_tracker(), path=path).restore()
+        assert len(store) == 0
+
+    def test_save_writes_the_captured_state(self, path):
+        """Test that interactions logged after capture (e.g. while the thread writes) are not in the file"""
+        tracker = make_tracker()
+        tracker.log_interaction("user1", "hello", "hi there", 0.5)
+        snapshotter = Snapshotter(ConversationStore(), tracker, path=path)
+        captured = snapshotter.capture()
+        tracker.log_interaction("user2", "later", "answer", 1.0)
+        snapshotter.save(captured)
+
+        restored = make_tracker()
+        Snapshotter(ConversationStore(), restored, path=path).restore()
+        assert restored.get_summary_stats()["total_interactions"] == 1
+        assert restored.rollups.to_dict() == captured[3]["rollups"]
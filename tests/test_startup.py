@@ -0,0 +1,40 @@
+"""
+Unit tests for cold-start tracking and lazy provider imports
+Run with: pytest tests/test_startup.py -v
+"""
+
+import os
+import subprocess
+import sys
+
+from src.startup import StartupTracker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_provider_sdks_are_imported_lazily():
+    """Test that importing the agent does not import any provider SDK"""
+    code = "import sys, src.agent; print(sorted(m for m in ('google.generativeai', 'groq') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_readiness_and_timings():
+    """Test the starting -> warming -> ready lifecycle and recorded phases"""
+    tracker = StartupTracker()
+    assert not tracker.ready and tracker.stats()["state"] == "starting"
+    tracker.warming()
+    with tracker.timed("warmup"):
+        pass
+    assert not tracker.ready
+    tracker.finished()
+    stats = tracker.stats()
+    assert stats["ready"] and stats["state"] == "ready" and "warmup" in stats["timings"]
+
+
+def test_failed_warm_up_is_reported_but_ready():
+    """Test that a warm-up failure degrades rather than blocks readiness"""
+    tracker = StartupTracker()
+    tracker.finished(ValueError("Google API Key is required for Gemini."))
+    assert tracker.ready
+    assert tracker.stats()["state"] == "degraded" and "API Key" in tracker.stats()["error"]
@@ -0,0 +1,239 @@
+"""
+Unit tests for the shared state backends (SQLite-WAL and Redis protocol)
+Run with: pytest tests/test_state.py -v
+"""
+
+import pytest
+from src.analytics import AnalyticsTracker
+from src.interaction_log import InteractionLog
+from src.memory import ConversationStore
+from src.state import RedisStateBackend, SharedState, SQLiteStateBackend
+from tests.fake_redis import FakeRedisServer
+
+
+@pytest.fixture
+def redis_server():
+    """Run an in-process fake Redis server"""
+    server = FakeRedisServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    """Create each backend kind"""
+    if request.param == "sqlite":
+        backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+    else:
+        server = request.getfixturevalue("redis_server")
+        backend = RedisStateBackend(server.url)
+    yield backend
+    backend.close()
+
+
+def make_state(backend, **kwargs):
+    # Large batch and interval so tests decide when flushes happen
+    options = {"flush_interval": 3600, "flush_batch": 10_000, "cache_ttl": 0}
+    options.update(kwargs)
+    return SharedState(backend, **options)
+
+
+class TestStateBackends:
+    """Both backends must answer the same commands the same way"""
+
+    def test_lists_are_trimmed_and_ranged(self, backend):
+        """Test RPUSH/LTRIM/LRANGE semantics"""
+        backend.execute([("RPUSH", "l", "a", "b", "c", "d"), ("LTRIM", "l", -3, -1)])
+        assert backend.execute([("LRANGE", "l", 0, -1)]) == [["b", "c", "d"]]
+        assert backend.execute([("LRANGE", "l", -2, -1)]) == [["c", "d"]]
+
+    def test_counters(self, backend):
+        """Test hash and sorted set increments"""
+        backend.execute([
+            ("HINCRBYFLOAT", "h", "x", "1.5"),
+            ("HINCRBYFLOAT", "h", "x", "1"),
+            ("ZINCRBY", "z", "3", "alice"),
+            ("ZINCRBY", "z", "5", "bob"),
+        ])
+        totals, top, size = backend.execute([
+            ("HGETALL", "h"), ("ZREVRANGE", "z", 0, 0, "WITHSCORES"), ("ZCARD", "z"),
+        ])
+        assert totals == ["x", "2.5"]
+        assert top == ["bob", "5"]
+        assert size == 2
+
+    def test_strings_and_delete(self, backend):
+        """Test GET/SET/DEL"""
+        backend.execute([("SET", "k", "v")])
+        assert backend.execute([("GET", "k"), ("GET", "missing")]) == ["v", None]
+        backend.execute([("DEL", "k")])
+        assert backend.execute([("GET", "k")]) == [None]
+
+
+class TestSharedState:
+    """Test batching, caching and the store/analytics integration"""
+
+    def test_writes_are_batched(self, backend):
+        """Test that writes wait in the buffer and counters are merged"""
+        state = make_state(backend)
+        for _ in range(10):
+            state.record_interaction("user1", "hi", 0.5, 10, 3)
+        assert state.stats()["pending_writes"] > 0
+        assert state.stats()["flushes"] == 0
+
+        sent = state.flush()
+        # 20 list commands, but each counter is sent once however many times it moved
+        assert sent == 20 + 9
+        assert state.analytics_totals()["totals"]["interactions"] == 10
+
+    @pytest.mark.asyncio
+    async def test_full_batch_wakes_the_flusher(self, backend):
+        """Test that writes never flush inline, and a full buffer is flushed without waiting for the interval"""
+        import asyncio
+        state = make_state(backend, flush_batch=3)
+        flusher = asyncio.create_task(state.run_flusher())
+        await asyncio.sleep(0)
+        state.set_profile("user1", "Profile", ttl=60)
+        state.set_profile("user2", "Profile", ttl=60)
+        assert state.stats()["flushes"] == 0
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if state.stats()["flushes"]:
+                break
+        assert state.stats()["flushes"] == 1
+        assert state.stats()["pending_writes"] == 0
+        flusher.cancel()
+        await flusher
+
+    def test_reads_are_cached(self, backend):
+        """Test that analytics reads are served from cache within the TTL"""
+        state = make_state(backend, cache_ttl=60)
+        state.record_interaction("user1", "hi", 0.5, 10, 3)
+        assert state.analytics_totals()["totals"]["interactions"] == 1
+        state.record_interaction("user1", "hi", 0.5, 10, 3)
+        assert state.analytics_totals()["totals"]["interactions"] == 1
+        assert state.stats()["cache_hits"] == 1
+
+    def test_conversation_visible_to_other_workers(self, backend):
+        """Test that a second store (another worker) sees the first one's turns"""
+        worker_a = ConversationStore(max_messages=4, shared=make_state(backend))
+        worker_b = ConversationStore(max_messages=4, shared=make_state(backend))
+
+        worker_a.set_profile("user1", "Customer Profile: {}")
+        worker_a.append("user1", "user", "hello")
+        worker_a.append("user1", "assistant", "hi there")
+        worker_a.shared.flush()
+
+        assert worker_b["user1"] == [
+            {"role": "system", "content": "Customer Profile: {}"},
+            {"role": "user", "content": "hello"},
+            {"role": "assistant", "content": "hi there"},
+        ]
+
+        # Worker B continues the conversation; worker A picks up only the new turns
+        worker_b.append("user1", "user", "order status?")
+        worker_b.shared.flush()
+        assert [m["content"] for m in worker_a["user1"]][-2:] == ["hi there", "order status?"]
+        assert worker_a.wire_history("user1")[-1] == {"role": "user", "parts": ["order status?"]}
+
+    @pytest.mark.asyncio
+    async def test_prefetch_loads_off_the_event_loop(self, backend):
+        """Test that prefetch loads in a worker thread and the reads after it stay local"""
+        import threading
+        worker_a = ConversationStore(shared=make_state(backend))
+        worker_b = ConversationStore(shared=make_state(backend, cache_ttl=60))
+        worker_a.append("user1", "user", "hello")
+        worker_a.shared.flush()
+
+        loads = []
+        load = worker_b.shared.load_conversation
+        worker_b.shared.load_conversation = lambda user_id: loads.append(threading.current_thread()) or load(user_id)
+        await worker_b.prefetch("user1")
+        assert worker_b["user1"] == [{"role": "user", "content": "hello"}]
+        worker_b.append("user1", "assistant", "hi")
+        assert len(loads) == 1 and loads[0] is not threading.main_thread()
+
+    def test_discard_is_shared(self, backend):
+        """Test that forgetting a user removes them for every worker"""
+        worker_a = ConversationStore(shared=make_state(backend))
+        worker_b = ConversationStore(shared=make_state(backend))
+        worker_a.append("user1", "user", "hello")
+        worker_a.shared.flush()
+        assert "user1" in worker_b
+        worker_a.discard("user1")
+        worker_a.shared.flush()
+        assert "user1" not in worker_b
+
+    def test_analytics_aggregated_across_workers(self, backend):
+        """Test that summary and top users cover every worker"""
+        trackers = [
+            AnalyticsTracker(InteractionLog(segment_dir=""), shared=make_state(backend))
+            for _ in range(2)
+        ]
+        trackers[0].log_interaction("user1", "hello", "hi", 0.5)
+        trackers[1].log_interaction("user1", "bye", "goodbye", 1.5)
+        trackers[1].log_interaction("user2", "hey", "hello", 1.0)
+        for tracker in trackers:
+            tracker.shared.flush()
+
+        summary = trackers[0].get_summary_stats()
+        assert summary["total_interactions"] == 3
+        assert summary["unique_users"] == 2
+        assert summary["avg_response_time"] == 1.0
+        assert summary["p50_response_time"] == pytest.approx(1.0, rel=0.02)
+
+        assert trackers[0].get_top_users(1) == [{"user_id": "user1", "total_queries": 2}]
+        user = trackers[1].get_user_stats("user1")
+        assert user["total_queries"] == 2
+        assert user["recent_queries"] == ["hello", "bye"]
+        assert trackers[1].get_user_stats("nobody") == {"error": "User not found"}
+
+    def test_failed_flush_is_retried(self, tmp_path):
+        """Test that writes survive a backend outage"""
+        server = FakeRedisServer()
+        state = make_state(RedisStateBackend(server.url, timeout=1.0))
+        state.set_profile("user1", "Profile", ttl=60)
+        server.close()
+        assert state.flush() == 0
+        assert state.stats()["flush_errors"] == 1
+        assert state.stats()["pending_writes"] == 2
+
+        state.backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+        assert state.flush() == 2
+        assert state.load_conversation("user1") == ("Profile", [])
+
+    def test_idle_disconnect_is_replaced_before_writing(self, redis_server):
+        """Test that a connection the server closed while idle is reconnected without losing the batch"""
+        backend = RedisStateBackend(redis_server.url, timeout=1.0)
+        backend.execute([("SET", "k", "v")])
+        redis_server.disconnect_clients()
+        import time
+        time.sleep(0.05)
+        assert backend.execute([("GET", "k")]) == ["v"]
+        backend.close()
+
+    def test_partly_applied_pipeline_is_not_resent(self, redis_server):
+        """Test that a connection lost mid-pipeline raises instead of replaying increments"""
+        backend = RedisStateBackend(redis_server.url, timeout=1.0)
+        backend.execute([("SET", "k", "v")])
+        redis_server.drop_before_reply = True
+        with pytest.raises((OSError, ConnectionError)):
+            backend.execute([("HINCRBYFLOAT", "h", "n", "1")])
+        assert redis_server.data["h"] == {"n": 1.0}
+        backend.close()
+
+    def test_failed_increments_survive_trimming(self, tmp_path):
+        """Test that increments from a failed flush are merged back, never trimmed with plain writes"""
+        server = FakeRedisServer()
+        state = make_state(RedisStateBackend(server.url, timeout=1.0), max_pending=1)
+        state.record_interaction("user1", "hello", 1.0, 5, 3)
+        state.record_interaction("user1", "again", 1.0, 5, 3)
+        server.close()
+        assert state.flush() == 0
+        assert state.stats()["dropped_commands"] > 0
+
+        state.backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+        state.flush()
+        assert state.analytics_totals()["totals"]["interactions"] == 2
+        assert state.user_stats("user1")["queries"] == 2
+        assert state.top_users(1) == [("user1", 2)]
@@ -0,0 +1,100 @@
+"""
+Unit tests for speculative voice sessions
+Run with: pytest tests/test_voice.py -v
+"""
+
+import asyncio
+
+import pytest
+from src.voice import VoiceSession, transcript_key
+
+
+class FakeReplies:
+    """Generates canned two-sentence replies and records what was started, finished and committed"""
+
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.started = []
+        self.finished = []
+        self.committed = []
+
+    async def generate(self, text):
+        self.started.append(text)
+        await asyncio.sleep(self.delay)
+        yield f"About {text}."
+        yield "Anything else?"
+        self.finished.append(text)
+
+    def commit(self, text, response, response_time):
+        self.committed.append((text, response))
+
+
+async def collect(session, text):
+    return [sentence async for sentence in session.final(text)]
+
+
+def test_transcript_key_ignores_recognizer_noise():
+    """Test that case, punctuation and spacing do not change the key"""
+    assert transcript_key("Where is  my order?") == transcript_key("where is my order")
+
+
+@pytest.mark.asyncio
+async def test_stable_interim_is_adopted():
+    """Test that a reply speculated on a stable interim is reused for the matching final"""
+    replies = FakeReplies()
+    session = VoiceSession(replies.generate, replies.commit, stable_after=0.01)
+    session.interim("where is my order")
+    await asyncio.sleep(0.05)
+    assert replies.finished == ["where is my order"]
+
+    assert await collect(session, "Where is my order?") == ["About where is my order.", "Anything else?"]
+    assert replies.started == ["where is my order"]
+    assert replies.committed == [("Where is my order?", "About where is my order. Anything else?")]
+    assert session.stats() == {"turns": 1, "speculations": 1, "adopted": 1, "discarded": 0}
+
+
+@pytest.mark.asyncio
+async def test_divergent_final_restarts_generation():
+    """Test that a speculation for different words is cancelled and never committed"""
+    replies = FakeReplies(delay=0.2)
+    session = VoiceSession(replies.generate, replies.commit, stable_after=0.01)
+    session.interim("cancel my")
+    await asyncio.sleep(0.03)
+    assert await collect(session, "cancel my subscription") == ["About cancel my subscription.", "Anything else?"]
+    assert replies.started == ["cancel my", "cancel my subscription"]
+    assert replies.finished == ["cancel my subscription"]
+    assert [text for text, _ in replies.committed] == ["cancel my subscription"]
+    assert session.discarded == 1
+
+
+@pytest.mark.asyncio
+async def test_unstable_interims_do_not_speculate():
+    """Test that changing interims wait, and speculation is capped per utterance"""
+    replies = FakeReplies()
+    session = VoiceSession(replies.generate, replies.commit, stable_after=0.05, max_speculations=1)
+    for text in ("i", "i want", "i want a", "i want a refund"):
+        session.interim(text)
+        await asyncio.sleep(0.01)
+    assert replies.started == []
+    await asyncio.sleep(0.06)
+    session.interim("i want a refund please")
+    await asyncio.sleep(0.1)
+    assert replies.started == ["i want a refund"]
+    await session.close()
+    assert replies.committed == []
+
+
+@pytest.mark.asyncio
+async def test_failed_reply_is_not_committed():
+    """Test that an upstream failure surfaces from final() and the turn is not committed"""
+    replies = FakeReplies()
+
+    async def failing(text):
+        yield "Partial answer."
+        raise RuntimeError("503 Service Unavailable")
+
+    session = VoiceSession(failing, replies.commit, stable_after=0.01)
+    with pytest.raises(RuntimeError, match="503"):
+        await collect(session, "where is my order")
+    assert replies.committed == []
+    assert session.stats()["turns"] == 0